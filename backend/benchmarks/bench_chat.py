@@ -0,0 +1,91 @@
+"""
+Benchmark de throughput concorrente do /chat.
+
+Dispara N requisicoes com C em paralelo contra uma API ja rodando e imprime
+requisicoes/segundo e a latencia por percentil. Com --stream usa o /chat/stream
+e mede tambem o time-to-first-byte (primeiro evento SSE). Para comparar antes/depois,
+rode a API de cada versao apontando para o mesmo stub LLM:
+
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 300
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:9100/v1 uvicorn main:app --port 8000
+    python -m benchmarks.bench_chat --url http://127.0.0.1:8000 --requests 400 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def _worker(http: httpx.AsyncClient, url: str, queue: asyncio.Queue, latencies: list, ttfbs: list, errors: list, stream: bool):
+    """Consome a fila de requisicoes, guardando a latencia (e o TTFB no modo stream) de cada uma."""
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        payload = {"history": [{"role": "user", "content": "Oi"}]}
+        started = time.perf_counter()
+        try:
+            if stream:
+                async with http.stream("POST", f"{url}/chat/stream", json=payload) as response:
+                    response.raise_for_status()
+                    first_byte = None
+                    async for _ in response.aiter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - started
+                    ttfbs.append(first_byte)
+            else:
+                response = await http.post(f"{url}/chat", json=payload)
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+
+
+def _percentile(values: list, pct: float) -> float:
+    """Percentil simples (nearest-rank) em segundos."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _report(label: str, values: list):
+    print(
+        f"{label} (ms) media={statistics.mean(values) * 1000:.0f} "
+        f"p50={_percentile(values, 50) * 1000:.0f} "
+        f"p95={_percentile(values, 95) * 1000:.0f} "
+        f"p99={_percentile(values, 99) * 1000:.0f}"
+    )
+
+
+async def run(url: str, total: int, concurrency: int, stream: bool = False):
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    latencies, ttfbs, errors = [], [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(_worker(http, url, queue, latencies, ttfbs, errors, stream) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    print(f"Requisicoes: {total} | concorrencia: {concurrency} | erros: {len(errors)}")
+    print(f"Tempo total: {elapsed:.2f}s | throughput: {len(latencies) / elapsed:.1f} req/s")
+    if latencies:
+        _report("Latencia", latencies)
+    if ttfbs:
+        _report("TTFB", ttfbs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concorrente do /chat")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--stream", action="store_true", help="usa o /chat/stream e mede o TTFB")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.requests, args.concurrency, args.stream))
@@ -0,0 +1,116 @@
+"""
+Microbenchmark do custo de serializacao por chamada ao Pipefy.
+
+Compara o jeito antigo (montar a mutation inteira com f-string e serializar
+{"query": ...}) com o registro de documentos pre-compilados (documento fixo,
+so o input vai em "variables"; com APQ, nem o texto do documento vai), com o input
+montado como dict e serializado inteiro ou renderizado por um InputTemplate.
+
+    python -m benchmarks.bench_graphql_serialization --iterations 200000
+"""
+
+import argparse
+import json
+import time
+
+from services.graphql_documents import SLOT, DocumentRegistry, InputTemplate
+
+LEAD = {
+    "name": "Maria Souza",
+    "email": "maria@empresa.com",
+    "company": "Empresa LTDA",
+    "need": "Automatizar a qualificacao de leads do time comercial",
+    "interest_confirmed": True,
+}
+PIPE_ID, PHASE_ID = "301234567", "318765432"
+FIELDS = ("nome", "email", "empresa", "necessidade", "interesse")
+
+
+def fstring_payload(lead: dict) -> bytes:
+    """Como era antes: valores interpolados no texto da query."""
+    interest = str(lead.get("interest_confirmed", False)).lower()
+    mutation = f"""
+    mutation {{
+      createCard(input: {{
+        pipe_id: {PIPE_ID},
+        phase_id: {PHASE_ID},
+        fields_attributes: [
+          {{field_id: "{FIELDS[0]}", field_value: "{lead.get('name', '')}"}},
+          {{field_id: "{FIELDS[1]}", field_value: "{lead.get('email', '')}"}},
+          {{field_id: "{FIELDS[2]}", field_value: "{lead.get('company', '')}"}},
+          {{field_id: "{FIELDS[3]}", field_value: "{lead.get('need', '')}"}},
+          {{field_id: "{FIELDS[4]}", field_value: "{interest}"}}
+        ]
+      }}) {{
+        card {{
+          id
+          title
+          url
+        }}
+      }}
+    }}
+    """
+    return json.dumps({"query": mutation}).encode("utf-8")
+
+
+def registry_dict_payload(registry: DocumentRegistry, lead: dict, persisted: bool) -> bytes:
+    """Documento do registro (compilado uma vez) + input montado como dict e serializado inteiro."""
+    document = registry.compile_batch(("createCard",))
+    interest = str(lead.get("interest_confirmed", False)).lower()
+    values = (lead.get("name", ""), lead.get("email", ""), lead.get("company", ""), lead.get("need", ""), interest)
+    payload = {
+        "variables": {
+            "m0": {
+                "pipe_id": PIPE_ID,
+                "phase_id": PHASE_ID,
+                "fields_attributes": [{"field_id": field_id, "field_value": value} for field_id, value in zip(FIELDS, values)],
+            }
+        }
+    }
+    if persisted:
+        payload["extensions"] = document.persisted_extension()
+    else:
+        payload["query"] = document.text
+    return json.dumps(payload).encode("utf-8")
+
+
+CARD_INPUT = InputTemplate({
+    "pipe_id": PIPE_ID,
+    "phase_id": PHASE_ID,
+    "fields_attributes": [{"field_id": field_id, "field_value": SLOT} for field_id in FIELDS],
+})
+
+
+def registry_payload(registry: DocumentRegistry, lead: dict, persisted: bool) -> bytes:
+    """Como o pipefy_service envia: trecho do documento em cache + so os valores codificados."""
+    document = registry.compile_batch(("createCard",))
+    interest = str(lead.get("interest_confirmed", False)).lower()
+    card_input = CARD_INPUT.render(lead.get("name", ""), lead.get("email", ""), lead.get("company", ""), lead.get("need", ""), interest)
+    return document.request_body([card_input], persisted=persisted)
+
+
+def _measure(label: str, build, iterations: int):
+    size = len(build())
+    started = time.perf_counter()
+    for _ in range(iterations):
+        build()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed / iterations * 1e6:8.2f} us/chamada   {size:5d} bytes/chamada")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    registry = DocumentRegistry("PipefyBatch")
+    registry.register("createCard", "CreateCardInput!", "card { id title url }")
+
+    _measure("f-string (antes)", lambda: fstring_payload(LEAD), args.iterations)
+    _measure("registro + dict", lambda: registry_dict_payload(registry, LEAD, persisted=False), args.iterations)
+    _measure("registro + template", lambda: registry_payload(registry, LEAD, persisted=False), args.iterations)
+    _measure("registro + template + APQ", lambda: registry_payload(registry, LEAD, persisted=True), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
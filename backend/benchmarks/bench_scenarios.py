@@ -0,0 +1,346 @@
+"""
+Benchmark de ponta a ponta por cenario, comparavel entre commits.
+
+Sobe o benchmarks.fake_upstreams (OpenAI, Pipefy e Calendly falsos) e a API apontando
+para ele (bancos SQLite temporarios), roda conversas roteirizadas com C em paralelo e
+imprime, por cenario: latencia p50/p95/p99 (por requisicao e por etapa), throughput,
+chamadas ao LLM por conversa (lidas do /metrics) e memoria (RSS) do processo da API.
+
+Cenarios:
+- opening           1 turno no /chat ("Oi")
+- opening_stream    1 turno no /chat/stream (mede tambem o TTFB)
+- lead_to_schedule  4 turnos no /chat ate o gatilho create_lead + show_slots, depois /schedule
+- lead_sessions     o mesmo fluxo pela API de sessoes (/sessions/{id}/messages)
+
+    python -m benchmarks.bench_scenarios --conversations 100 --concurrency 20 --json-out antes.json
+    # ... muda o codigo ...
+    python -m benchmarks.bench_scenarios --conversations 100 --concurrency 20 --compare antes.json
+
+Com --url o benchmark usa uma API ja rodando (e --pid, opcional, para medir a memoria dela).
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.bench_chat import _percentile
+from benchmarks.harness import BACKEND_DIR, api_env, free_port, stop_processes, wait_until_up
+
+SCENARIOS = ["opening", "opening_stream", "lead_to_schedule", "lead_sessions"]
+
+
+def _rss_mb(pid: Optional[int]) -> Optional[float]:
+    """RSS atual do processo (Linux, via /proc); None se nao der para medir."""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def _llm_calls(http: httpx.AsyncClient, base: str) -> Optional[float]:
+    """Chamadas a OpenAI feitas pela API ate agora (contagem dos spans openai_chat/openai_stream)."""
+    try:
+        text = (await http.get(f"{base}/metrics")).text
+    except httpx.HTTPError:
+        return None
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if line.startswith("sdr_stage_duration_seconds_count{") and ('stage="openai_chat"' in line or 'stage="openai_stream"' in line)
+    )
+
+
+def _user_turns(i: int) -> List[str]:
+    """Roteiro do usuario para a conversa i (dados unicos, para nao cair na idempotencia da fila)."""
+    return [
+        "Oi",
+        f"Meu nome é Lead {i} e trabalho na Empresa {i}",
+        f"Meu e-mail é lead{i}@empresa{i}.com. Precisamos automatizar a triagem de leads",
+        "Sim, quero agendar uma conversa",
+    ]
+
+
+class Recorder:
+    """Guarda latencias por etapa, status HTTP e erros de um cenario."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, int] = defaultdict(int)
+        self.errors: List[str] = []
+
+    async def call(self, step: str, send):
+        started = time.perf_counter()
+        try:
+            response = await send()
+        except httpx.HTTPError as e:
+            self.errors.append(f"{step}: {e!r}")
+            return None
+        self.latencies[step].append(time.perf_counter() - started)
+        self.statuses[str(response.status_code)] += 1
+        return response
+
+
+async def _stream_turn(http: httpx.AsyncClient, rec: Recorder, step: str, url: str, payload: dict) -> Optional[str]:
+    """POST em um endpoint SSE; registra TTFB e latencia total e devolve o payload do evento final."""
+    started = time.perf_counter()
+    last_event = None
+    try:
+        async with http.stream("POST", url, json=payload) as response:
+            rec.statuses[str(response.status_code)] += 1
+            first = True
+            async for line in response.aiter_lines():
+                if first:
+                    rec.latencies[f"{step} (ttfb)"].append(time.perf_counter() - started)
+                    first = False
+                if line.startswith("data:"):
+                    last_event = line[5:].strip()
+    except httpx.HTTPError as e:
+        rec.errors.append(f"{step}: {e!r}")
+        return None
+    rec.latencies[step].append(time.perf_counter() - started)
+    return last_event
+
+
+async def _schedule(http: httpx.AsyncClient, rec: Recorder, base: str, result: dict, i: int):
+    slots = result.get("slots") or []
+    if not isinstance(slots, list) or not slots:
+        rec.errors.append("show_slots sem horarios")
+        return
+    # Espalha as conversas pelos horarios; conflitos (409) entram na contagem de status
+    await rec.call("schedule", lambda: http.post(f"{base}/schedule", json={
+        "slot_info": slots[i % len(slots)],
+        "lead_data": result["lead_data"],
+        "pipefy_card_id": result.get("pipefy_card_id"),
+        "pipefy_job_id": result.get("pipefy_job_id"),
+    }))
+
+
+async def _conversation(scenario: str, http: httpx.AsyncClient, rec: Recorder, base: str, i: int):
+    turns = _user_turns(i)
+    if scenario == "opening":
+        await rec.call("chat", lambda: http.post(f"{base}/chat", json={"history": [{"role": "user", "content": turns[0]}]}))
+        return
+    if scenario == "opening_stream":
+        await _stream_turn(http, rec, "chat_stream", f"{base}/chat/stream", {"history": [{"role": "user", "content": turns[0]}]})
+        return
+
+    history: List[Dict[str, str]] = []
+    session_id = None
+    if scenario == "lead_sessions":
+        response = await rec.call("create_session", lambda: http.post(f"{base}/sessions", json={"history": []}))
+        if response is None or response.status_code != 201:
+            return
+        session_id = response.json()["session_id"]
+
+    for turn, message in enumerate(turns, start=1):
+        step = f"turn_{turn}"
+        if session_id is None:
+            history.append({"role": "user", "content": message})
+            response = await rec.call(step, lambda: http.post(f"{base}/chat", json={"history": list(history)}))
+        else:
+            response = await rec.call(step, lambda: http.post(f"{base}/sessions/{session_id}/messages", json={"message": message}))
+        if response is None or response.status_code != 200:
+            return
+        reply = response.json()["response"]
+        history.append({"role": "assistant", "content": reply})
+
+    try:
+        result = json.loads(reply)
+    except json.JSONDecodeError:
+        result = None
+    if not isinstance(result, dict) or result.get("action") != "show_slots":
+        rec.errors.append(f"conversa {i} terminou sem show_slots: {reply[:80]}")
+        return
+    await _schedule(http, rec, base, result, i)
+
+
+async def run_scenario(scenario: str, base: str, conversations: int, concurrency: int, pid: Optional[int]) -> dict:
+    rec = Recorder()
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(conversations):
+        queue.put_nowait(i)
+    # Prefixo por cenario: as conversas de cenarios diferentes nao se repetem
+    offset = SCENARIOS.index(scenario) * 1_000_000 + int(time.time()) % 1000 * 1000
+
+    async def worker(http: httpx.AsyncClient):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await _conversation(scenario, http, rec, base, offset + i)
+
+    rss_samples = [value for value in [_rss_mb(pid)] if value is not None]
+
+    async def sample_memory():
+        while True:
+            await asyncio.sleep(0.1)
+            value = _rss_mb(pid)
+            if value is not None:
+                rss_samples.append(value)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    sampler = asyncio.create_task(sample_memory())
+    async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+        llm_before = await _llm_calls(http, base)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        llm_after = await _llm_calls(http, base)
+    sampler.cancel()
+    llm_calls = llm_after - llm_before if llm_before is not None and llm_after is not None else None
+
+    all_latencies = [value for step, values in rec.latencies.items() if not step.endswith("(ttfb)") for value in values]
+    return {
+        "scenario": scenario,
+        "conversations": conversations,
+        "concurrency": concurrency,
+        "requests": len(all_latencies),
+        "errors": len(rec.errors),
+        "error_samples": rec.errors[:5],
+        "statuses": dict(rec.statuses),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "conversations_per_s": round(conversations / elapsed, 2) if elapsed else 0.0,
+        "llm_calls_per_conversation": round(llm_calls / conversations, 2) if llm_calls is not None and conversations else None,
+        "latency_ms": _summary(all_latencies),
+        "steps": {step: _summary(values) for step, values in sorted(rec.latencies.items())},
+        "rss_mb": {
+            "start": round(rss_samples[0], 1) if rss_samples else None,
+            "peak": round(max(rss_samples), 1) if rss_samples else None,
+            "end": round(_rss_mb(pid), 1) if _rss_mb(pid) is not None else None,
+        },
+    }
+
+
+def _summary(values: List[float]) -> dict:
+    if not values:
+        return {}
+    return {
+        "p50": round(_percentile(values, 50) * 1000, 1),
+        "p95": round(_percentile(values, 95) * 1000, 1),
+        "p99": round(_percentile(values, 99) * 1000, 1),
+    }
+
+
+def _print_result(result: dict, baseline: Optional[dict] = None):
+    latency, rss = result["latency_ms"], result["rss_mb"]
+    print(f"\n== {result['scenario']} | {result['conversations']} conversas, concorrencia {result['concurrency']}")
+    print(f"   requisicoes={result['requests']} erros={result['errors']} status={result['statuses']}")
+    print(f"   throughput={result['throughput_rps']} req/s ({result['conversations_per_s']} conversas/s)"
+          + _delta(result["throughput_rps"], baseline and baseline["throughput_rps"]))
+    if result.get("llm_calls_per_conversation") is not None:
+        print(f"   chamadas ao LLM por conversa={result['llm_calls_per_conversation']}"
+              + _delta(result["llm_calls_per_conversation"], baseline and baseline.get("llm_calls_per_conversation")))
+    if latency:
+        print("   latencia (ms) " + " ".join(
+            f"{pct}={latency[pct]}{_delta(latency[pct], baseline and baseline['latency_ms'].get(pct))}" for pct in ("p50", "p95", "p99")))
+    for step, values in result["steps"].items():
+        print(f"     {step:<22} p50={values['p50']} p95={values['p95']} p99={values['p99']}")
+    if rss["peak"] is not None:
+        print(f"   memoria RSS (MB) inicio={rss['start']} pico={rss['peak']} fim={rss['end']}"
+              + _delta(rss["peak"], baseline and baseline["rss_mb"].get("peak")))
+    for sample in result["error_samples"]:
+        print(f"   ! {sample}")
+
+
+def _delta(current: float, previous: Optional[float]) -> str:
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _start_stack(args, workdir: str):
+    """Sobe os upstreams falsos e a API (uvicorn) apontando para eles."""
+    fake_port, api_port = free_port(), free_port()
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(fake_port),
+         "--latency-ms", str(args.llm_ms), "--token-ms", str(args.token_ms),
+         "--pipefy-ms", str(args.pipefy_ms), "--calendly-ms", str(args.calendly_ms)],
+        cwd=BACKEND_DIR,
+    )
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    env = api_env(fake_url, workdir)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(api_port), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        wait_until_up(f"{fake_url}/docs", fake)
+        wait_until_up(f"http://127.0.0.1:{api_port}/", api)
+    except Exception:
+        stop_processes([api, fake])
+        raise
+    return f"http://127.0.0.1:{api_port}", api, [api, fake]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="lista separada por virgula")
+    parser.add_argument("--conversations", type=int, default=50, help="conversas por cenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--llm-ms", type=int, default=300, help="OpenAI falsa: tempo ate o primeiro token")
+    parser.add_argument("--token-ms", type=int, default=10, help="OpenAI falsa: intervalo entre tokens")
+    parser.add_argument("--pipefy-ms", type=int, default=150)
+    parser.add_argument("--calendly-ms", type=int, default=100)
+    parser.add_argument("--url", help="usa uma API ja rodando em vez de subir uma")
+    parser.add_argument("--pid", type=int, help="com --url: PID da API, para medir a memoria")
+    parser.add_argument("--json-out", help="grava os resultados (com o commit) neste arquivo")
+    parser.add_argument("--compare", help="resultado anterior (--json-out) para mostrar a variacao")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"cenarios desconhecidos: {', '.join(sorted(unknown))}")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+
+    with tempfile.TemporaryDirectory(prefix="sdr-bench-") as workdir:
+        processes: List[subprocess.Popen] = []
+        if args.url:
+            base, pid = args.url.rstrip("/"), args.pid
+        else:
+            base, api, processes = _start_stack(args, workdir)
+            pid = api.pid
+        try:
+            results = []
+            for scenario in scenarios:
+                result = asyncio.run(run_scenario(scenario, base, args.conversations, args.concurrency, pid))
+                _print_result(result, baseline.get(scenario))
+                results.append(result)
+        finally:
+            stop_processes(processes)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "created_at": time.time(), "args": vars(args), "results": results}, f, indent=2)
+        print(f"\nResultados gravados em {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
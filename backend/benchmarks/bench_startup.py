@@ -0,0 +1,154 @@
+"""
+Benchmark do cold start da API: tempo de import e latencia da primeira requisicao.
+
+Mede, em processos novos a cada rodada:
+- import: `import main` num interpretador limpo (e os imports de topo mais pesados,
+  via python -X importtime);
+- boot: do spawn do uvicorn ate o GET / responder;
+- primeira requisicao: o primeiro POST /chat que chega ao LLM (OpenAI falsa do
+  benchmarks.fake_upstreams), comparado com o segundo, ja com tudo aquecido.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --runs 5 --json-out antes.json
+    # ... muda o codigo ...
+    python -m benchmarks.bench_startup --runs 5 --compare antes.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.bench_scenarios import _delta, _git_commit
+from benchmarks.harness import BACKEND_DIR, api_env, free_port, stop_processes, wait_until_up
+
+_IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+# "import time:  self |  cumulative | <indentacao>modulo"
+_IMPORTTIME_RE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _import_seconds(env: Dict[str, str]) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _heaviest_imports(env: Dict[str, str], top: int) -> List[Tuple[str, float]]:
+    """Imports diretos de main (e das libs de topo) que mais custam, em ms cumulativos."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    costs = []
+    for line in out.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        # Indentacao 2 = importado diretamente por main
+        if match and len(match.group(2)) == 3:
+            costs.append((match.group(3), int(match.group(1)) / 1000))
+    return sorted(costs, key=lambda item: item[1], reverse=True)[:top]
+
+
+def _post_chat(http: httpx.Client, base: str, text: str) -> float:
+    started = time.perf_counter()
+    response = http.post(f"{base}/chat", json={"history": [{"role": "user", "content": text}]})
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def _boot_once(env: Dict[str, str]) -> Dict[str, float]:
+    """Sobe a API, espera o GET / e faz duas chamadas ao /chat que passam pelo LLM."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        with httpx.Client(timeout=30.0) as http:
+            while True:
+                if api.poll() is not None:
+                    raise RuntimeError(f"API saiu antes de responder (codigo {api.returncode})")
+                try:
+                    http.get(f"{base}/")
+                    break
+                except httpx.HTTPError:
+                    time.sleep(0.01)
+            boot = time.perf_counter() - started
+            # Mensagens sem os 4 dados do lead e fora do cache de abertura: vao ao LLM
+            first = _post_chat(http, base, "Oi, queria entender como voces trabalham com automacao.")
+            second = _post_chat(http, base, "Oi, voces atendem empresas pequenas tambem?")
+    finally:
+        stop_processes([api])
+    return {"boot_s": boot, "first_chat_s": first, "second_chat_s": second}
+
+
+def _median(values: List[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="processos novos por medida")
+    parser.add_argument("--llm-ms", type=int, default=50, help="OpenAI falsa: tempo ate o primeiro token")
+    parser.add_argument("--top", type=int, default=8, help="quantos imports pesados listar")
+    parser.add_argument("--json-out", help="grava os resultados (com o commit) neste arquivo")
+    parser.add_argument("--compare", help="resultado anterior (--json-out) para mostrar a variacao")
+    args = parser.parse_args()
+
+    baseline: Optional[dict] = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(fake_port), "--latency-ms", str(args.llm_ms), "--token-ms", "0"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        wait_until_up(f"{fake_url}/docs", fake)
+        with tempfile.TemporaryDirectory() as workdir:
+            env = api_env(fake_url, workdir)
+            imports = [_import_seconds(env) for _ in range(args.runs)]
+            heaviest = _heaviest_imports(env, args.top)
+            boots = [_boot_once(env) for _ in range(args.runs)]
+    finally:
+        stop_processes([fake])
+
+    result = {
+        "commit": _git_commit(),
+        "runs": args.runs,
+        "import_ms": _median(imports) * 1000,
+        "boot_ms": _median([b["boot_s"] for b in boots]) * 1000,
+        "first_chat_ms": _median([b["first_chat_s"] for b in boots]) * 1000,
+        "second_chat_ms": _median([b["second_chat_s"] for b in boots]) * 1000,
+        "spawn_to_first_chat_ms": _median([b["boot_s"] + b["first_chat_s"] for b in boots]) * 1000,
+    }
+    previous = baseline or {}
+    print(f"== cold start | {args.runs} rodadas (medianas), OpenAI falsa com {args.llm_ms} ms")
+    print(f"   import main            {result['import_ms']:8.1f} ms{_delta(result['import_ms'], previous.get('import_ms'))}")
+    print(f"   spawn ate GET /        {result['boot_ms']:8.1f} ms{_delta(result['boot_ms'], previous.get('boot_ms'))}")
+    print(f"   1o POST /chat (LLM)    {result['first_chat_ms']:8.1f} ms{_delta(result['first_chat_ms'], previous.get('first_chat_ms'))}")
+    print(f"   2o POST /chat (LLM)    {result['second_chat_ms']:8.1f} ms{_delta(result['second_chat_ms'], previous.get('second_chat_ms'))}")
+    print(f"   spawn ate 1o /chat     {result['spawn_to_first_chat_ms']:8.1f} ms{_delta(result['spawn_to_first_chat_ms'], previous.get('spawn_to_first_chat_ms'))}")
+    print("   imports de topo mais pesados (cumulativo):")
+    for module, ms in heaviest:
+        print(f"     {module:<32} {ms:7.1f} ms")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Microbenchmark da deteccao do gatilho create_lead sobre um corpus de respostas gravadas.
+
+Compara o jeito antigo (json.loads em toda resposta, excecao como controle de fluxo)
+com services/trigger_detection.py: acertos (gatilho detectado ou texto ignorado, como
+esperado no corpus) e custo por resposta, separado entre texto puro (sem o marcador
+create_lead), texto que menciona o marcador mas nao e gatilho valido, e gatilhos.
+
+    python -m benchmarks.bench_trigger_detection --iterations 20000
+    python -m benchmarks.bench_trigger_detection --corpus minhas_respostas.jsonl
+
+O corpus e um JSONL com {"reply": "...", "trigger": true|false}.
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Callable, List, Optional
+
+from services.trigger_detection import TRIGGER_MARKER, detect_trigger
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trigger_corpus.jsonl")
+
+
+def legacy_detect(ai_response: str) -> Optional[dict]:
+    """Como era antes no /chat: json.loads direto e qualquer dict com a action vale."""
+    try:
+        json_data = json.loads(ai_response)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(json_data, dict) and json_data.get("action") == "create_lead":
+        return json_data.get("data")
+    return None
+
+
+def _load(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _time_per_reply(detect: Callable[[str], Optional[dict]], replies: List[str], iterations: int) -> float:
+    if not replies:
+        return 0.0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for reply in replies:
+            detect(reply)
+    return (time.perf_counter() - started) / (iterations * len(replies)) * 1e6
+
+
+def _report(label: str, detect: Callable[[str], Optional[dict]], corpus: List[dict], iterations: int):
+    wrong = [row["reply"] for row in corpus if (detect(row["reply"]) is not None) != row["trigger"]]
+    plain = [row["reply"] for row in corpus if not row["trigger"] and TRIGGER_MARKER not in row["reply"]]
+    suspicious = [row["reply"] for row in corpus if not row["trigger"] and TRIGGER_MARKER in row["reply"]]
+    triggers = [row["reply"] for row in corpus if row["trigger"]]
+    print(
+        f"{label:<20} acertos {len(corpus) - len(wrong):3d}/{len(corpus)}"
+        f"   texto {_time_per_reply(detect, plain, iterations):6.2f}"
+        f"   suspeito {_time_per_reply(detect, suspicious, iterations):6.2f}"
+        f"   gatilho {_time_per_reply(detect, triggers, iterations):6.2f} us/resposta"
+    )
+    for reply in wrong:
+        print(f"   ! {reply[:90]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    corpus = _load(args.corpus)
+    print(f"corpus: {len(corpus)} respostas ({sum(row['trigger'] for row in corpus)} gatilhos)")
+    _report("json.loads (antes)", legacy_detect, corpus, args.iterations)
+    _report("trigger_detection", detect_trigger, corpus, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
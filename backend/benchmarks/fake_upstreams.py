@@ -0,0 +1,128 @@
+"""
+OpenAI, Pipefy e Calendly falsos num servidor so, para os benchmarks de ponta a ponta.
+
+- POST /v1/chat/completions: conversa roteirizada (normal e streaming). O 4o turno do
+  usuario, se comecar com "Sim", recebe o JSON do gatilho create_lead com os dados
+  tirados das mensagens anteriores (nome, empresa, e-mail, necessidade). Se a requisicao
+  oferecer a tool create_lead, o gatilho vem como tool call.
+- POST /graphql: Pipefy; entende lotes com alias (m0, m1, ...) de createCard e updateFieldsValues.
+- GET /calendly/users/me e /calendly/event_types: o minimo que o calendar_service consulta.
+
+Cada upstream tem latencia configuravel. Aponte a API para ca com:
+
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+    PIPEFY_GRAPHQL_URL=http://127.0.0.1:9100/graphql
+    CALENDLY_API_URL=http://127.0.0.1:9100/calendly
+
+Uso:
+    python -m benchmarks.fake_upstreams --port 9100 --latency-ms 300 --pipefy-ms 150 --calendly-ms 100
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import re
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+from benchmarks import stub_llm_server
+
+app = FastAPI(title="Fake upstreams")
+
+PIPEFY_SECONDS = 0.15
+CALENDLY_SECONDS = 0.1
+
+_card_ids = itertools.count(1)
+
+# Respostas de texto para os turnos 1 a 3 (a ultima e a "pergunta direta")
+SCRIPT = [
+    "Olá! Sou o agente da Verzel. Para começar, qual é o seu nome e empresa?",
+    "Prazer! Qual é o seu e-mail e o principal desafio que vocês enfrentam hoje?",
+    "Entendi. Você gostaria de seguir com uma conversa com nosso time para resolver isso?",
+]
+
+_NAME = re.compile(r"meu nome é ([^,.]+?) e trabalho na ([^,.]+)", re.IGNORECASE)
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+_NEED = re.compile(r"precisamos (.+)$", re.IGNORECASE)
+
+
+def _lead_from(user_messages: list) -> dict:
+    text = "\n".join(user_messages)
+    name = _NAME.search(text)
+    email = _EMAIL.search(text)
+    need = next((m.group(1) for m in map(_NEED.search, user_messages) if m), "")
+    return {
+        "name": name.group(1) if name else "",
+        "email": email.group(0).rstrip(".") if email else "",
+        "company": name.group(2) if name else "",
+        "need": need,
+        "interest_confirmed": True,
+    }
+
+
+def scripted_reply(messages: list) -> str:
+    """Escolhe a resposta pelo numero de turnos do usuario na conversa."""
+    user_messages = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+    turn = len(user_messages)
+    if turn > len(SCRIPT) and user_messages[-1].lower().startswith("sim"):
+        return json.dumps({"action": "create_lead", "data": _lead_from(user_messages)}, ensure_ascii=False)
+    return SCRIPT[min(turn, len(SCRIPT)) - 1] if turn else SCRIPT[0]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    # Pedido de resumo do ContextManager: responde um texto curto qualquer
+    if messages and messages[0].get("role") == "system" and messages[0].get("content", "").startswith("Resuma"):
+        return await stub_llm_server.respond(body, "Resumo: cliente em qualificação.")
+    reply = scripted_reply(messages)
+    # Com a tool create_lead oferecida (OPENAI_LEAD_TOOL_CALLING), o gatilho vem como tool call
+    if reply.startswith("{") and any(tool.get("function", {}).get("name") == "create_lead" for tool in body.get("tools") or []):
+        return await stub_llm_server.respond(body, tool_call=("create_lead", json.dumps(json.loads(reply)["data"], ensure_ascii=False)))
+    return await stub_llm_server.respond(body, reply)
+
+
+@app.post("/graphql")
+async def pipefy_graphql(request: Request):
+    body = await request.json()
+    await asyncio.sleep(PIPEFY_SECONDS)
+    variables = body.get("variables") or {}
+    data = {}
+    for alias, field in re.findall(r"(m\d+): (\w+)\(", body.get("query", "")):
+        if field == "createCard":
+            card_id = str(next(_card_ids))
+            data[alias] = {"card": {"id": card_id, "title": card_id, "url": f"https://app.pipefy.com/open-cards/{card_id}"}}
+        elif field == "updateFieldsValues":
+            data[alias] = {"clientMutationId": None, "success": bool(variables.get(alias, {}).get("nodeId"))}
+    return {"data": data}
+
+
+@app.get("/calendly/users/me")
+async def calendly_user():
+    await asyncio.sleep(CALENDLY_SECONDS)
+    return {"resource": {"uri": "https://api.calendly.com/users/FAKE"}}
+
+
+@app.get("/calendly/event_types")
+async def calendly_event_types():
+    await asyncio.sleep(CALENDLY_SECONDS)
+    return {"collection": [{"uri": "https://api.calendly.com/event_types/FAKE"}]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI, Pipefy e Calendly falsos para benchmarks")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=int, default=300, help="OpenAI: tempo ate o primeiro token")
+    parser.add_argument("--token-ms", type=int, default=20, help="OpenAI: intervalo entre tokens")
+    parser.add_argument("--pipefy-ms", type=int, default=150)
+    parser.add_argument("--calendly-ms", type=int, default=100)
+    args = parser.parse_args()
+
+    stub_llm_server.LATENCY_SECONDS = args.latency_ms / 1000
+    stub_llm_server.TOKEN_SECONDS = args.token_ms / 1000
+    PIPEFY_SECONDS = args.pipefy_ms / 1000
+    CALENDLY_SECONDS = args.calendly_ms / 1000
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
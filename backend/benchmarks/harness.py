@@ -0,0 +1,68 @@
+"""
+Infra comum para subir a stack local: portas livres, espera pelo processo responder,
+ambiente da API apontando para o benchmarks.fake_upstreams e parada ordenada.
+
+Usado pelos benchmarks e pelo bulk_import --fake-upstreams.
+"""
+
+import os
+import socket
+import subprocess
+import time
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"processo saiu antes de responder em {url} (codigo {process.returncode})")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"timeout esperando {url}")
+
+
+def api_env(fake_url: str, workdir: str) -> Dict[str, str]:
+    """Ambiente da API apontando para os upstreams falsos, com bancos SQLite em workdir."""
+    return dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"{fake_url}/v1",
+        PIPEFY_GRAPHQL_URL=f"{fake_url}/graphql",
+        CALENDLY_API_URL=f"{fake_url}/calendly",
+        PIPEFY_API_KEY="bench", CALENDLY_API_KEY="bench", PIPE_ID="1", PHASE_ID="1",
+        PIPEFY_FIELD_NAME="nome", PIPEFY_FIELD_EMAIL="email", PIPEFY_FIELD_COMPANY="empresa",
+        PIPEFY_FIELD_NEED="necessidade", PIPEFY_FIELD_INTEREST="interesse",
+        PIPEFY_FIELD_MEETING_LINK="link", PIPEFY_FIELD_MEETING_TIME="horario",
+        JOB_QUEUE_DB_PATH=os.path.join(workdir, "jobs.db"),
+        SESSION_DB_PATH=os.path.join(workdir, "sessions.db"),
+        BOOKING_DB_PATH=os.path.join(workdir, "bookings.db"),
+        AVAILABILITY_INDEX_PATH="",
+        # Janela longa: os agendamentos dos cenarios nao esgotam os horarios simulados
+        AVAILABILITY_WINDOW_DAYS="365",
+        # Retries esperados da fila (ex: card ainda nao criado) nao poluem a saida
+        LOG_LEVEL="ERROR",
+    )
+
+
+def stop_processes(processes: List[subprocess.Popen]):
+    """Para na ordem dada (a API antes dos upstreams falsos, para ela drenar sem erros de conexao)."""
+    for process in processes:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
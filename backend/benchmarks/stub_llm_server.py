@@ -0,0 +1,116 @@
+"""
+Servidor LLM falso para benchmarks.
+Imita o endpoint /v1/chat/completions da OpenAI (normal e streaming), com latencia
+configuravel, para medir o /chat sem gastar tokens nem depender da rede.
+
+Uso:
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 300 --token-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="Stub LLM")
+
+# Latencia ate o primeiro token e intervalo entre tokens (ajustados pela linha de comando)
+LATENCY_SECONDS = 0.3
+TOKEN_SECONDS = 0.02
+
+REPLY = "Olá! Sou o agente da Verzel. Para começar, qual é o seu nome?"
+
+
+def _tokens(text: str):
+    """Quebra o texto em 'tokens' (palavras com o espaco que as segue)."""
+    words = text.split(" ")
+    return [word + " " for word in words[:-1]] + [words[-1]]
+
+
+def _tool_call(tool_call: Tuple[str, str], arguments: str, first: bool = True) -> dict:
+    """Tool call no formato da OpenAI; nos chunks seguintes do stream so vao os argumentos."""
+    name, _ = tool_call
+    function = {"name": name, "arguments": arguments} if first else {"arguments": arguments}
+    call = {"index": 0, "function": function}
+    if first:
+        call.update(id=f"call_{uuid.uuid4().hex[:24]}", type="function")
+    return call
+
+
+async def _stream_chunks(model: str, reply: str = REPLY, tool_call: Optional[Tuple[str, str]] = None, include_usage: bool = False):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await asyncio.sleep(LATENCY_SECONDS)
+    if tool_call is not None:
+        deltas = [{"tool_calls": [_tool_call(tool_call, token, first=index == 0)]} for index, token in enumerate(_tokens(tool_call[1]))]
+    else:
+        deltas = [{"content": token} for token in _tokens(reply)]
+    for delta in deltas:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(TOKEN_SECONDS)
+    if include_usage:
+        # stream_options.include_usage: um ultimo chunk sem choices, so com o usage
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def respond(body: dict, reply: str = REPLY, tool_call: Optional[Tuple[str, str]] = None):
+    """
+    Resposta no formato da OpenAI (streaming ou nao) para o texto dado, simulando o tempo de geracao.
+    Com tool_call=(nome, argumentos JSON), responde com um tool call em vez de texto.
+    """
+    model = body.get("model", "stub")
+    if body.get("stream"):
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(_stream_chunks(model, reply, tool_call, include_usage), media_type="text/event-stream")
+
+    await asyncio.sleep(LATENCY_SECONDS + TOKEN_SECONDS * len(_tokens(tool_call[1] if tool_call else reply)))
+    if tool_call is not None:
+        message = {"role": "assistant", "content": None, "tool_calls": [_tool_call(tool_call, tool_call[1])]}
+        del message["tool_calls"][0]["index"]
+    else:
+        message = {"role": "assistant", "content": reply}
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if tool_call else "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Responde sempre com o mesmo texto."""
+    return await respond(await request.json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor LLM falso para benchmarks")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=int, default=300, help="tempo ate o primeiro token")
+    parser.add_argument("--token-ms", type=int, default=20, help="intervalo entre tokens")
+    args = parser.parse_args()
+
+    LATENCY_SECONDS = args.latency_ms / 1000
+    TOKEN_SECONDS = args.token_ms / 1000
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,362 @@
+"""
+Reprocessamento offline e importacao de leads em lote, pelo mesmo fluxo do /chat:
+gatilho create_lead -> card no Pipefy (fila de jobs) -> horarios livres.
+
+Dois modos, lendo o arquivo em streaming (registro a registro, nunca o arquivo inteiro):
+- leads: CSV (com cabecalho) ou JSONL com name, email, company, need e interest_confirmed.
+  Cada linha e validada pelo schema do gatilho e vira um create_lead direto, sem LLM.
+- conversations: JSONL com {"id": ..., "messages": [{"role": "user", "content": ...}, ...]}.
+  Os turnos do usuario sao reenviados ao agente (generate_response) ate sair o gatilho.
+
+- Concorrencia limitada: --concurrency registros em andamento, e a leitura do arquivo
+  espera quando eles estao ocupados. Por baixo continuam valendo a admissao da OpenAI
+  e a fila de jobs (JOB_WORKER_CONCURRENCY).
+- Um registro so conta como feito quando o card foi criado no Pipefy (job succeeded).
+- Checkpoint (--checkpoint): gravado de forma atomica a cada --checkpoint-every registros
+  e no fim, inclusive no Ctrl+C. Rodar de novo com o mesmo checkpoint pula o que ja foi
+  feito. Registros que falharam tambem encerram (a marca d'agua avanca por cima deles),
+  mas ficam numa lista propria e sao tentados de novo na proxima execucao: a fila usa os
+  dados do lead como chave de idempotencia, entao o card nao duplica, e um job de criacao
+  que tinha morrido (dead) volta para a fila em vez de ser devolvido como esta.
+- Throughput, latencia por registro (p50/p95) e contagens a cada --report-seconds e no fim.
+- --fake-upstreams sobe o benchmarks.fake_upstreams (OpenAI, Pipefy e Calendly falsos) e
+  aponta a execucao para ele, com bancos SQLite temporarios: ensaio sem tocar nos servicos reais.
+
+Uso:
+    python bulk_import.py leads leads.csv --concurrency 8 --checkpoint leads.ckpt
+    python bulk_import.py conversations conversas.jsonl --out resultados.jsonl
+    python bulk_import.py leads leads.csv --fake-upstreams
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+# Tentativas quando a admissao da OpenAI recusa a chamada (fila cheia): espera o Retry-After
+ADMISSION_RETRIES = 5
+
+
+class InvalidRecord(Exception):
+    """Registro que nao da para processar (JSON quebrado, lead fora do schema)."""
+
+
+# --- Leitura em streaming ---
+
+def _detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def _read_records(path: str, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """(indice, registro cru) sob demanda; linha em branco vem como None (mantem os indices estaveis)."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for index, row in enumerate(csv.DictReader(f)):
+                yield index, row
+        else:
+            for index, line in enumerate(f):
+                yield index, line.strip() or None
+
+
+# --- Checkpoint ---
+
+class Checkpoint:
+    """
+    Registros encerrados: todos abaixo de watermark + os encerrados fora de ordem acima dele
+    (com concorrencia eles terminam fora de ordem; o conjunto fica do tamanho da janela).
+    Falha tambem encerra, para a marca d'agua nao parar nela; os que falharam ficam em
+    `failed` e voltam a ser processados na proxima execucao.
+    """
+
+    def __init__(self, path: Optional[str], source: str):
+        self.path = path
+        self.source = source
+        self.watermark = 0
+        self.done: Set[int] = set()
+        self.failed: Set[int] = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("source") != source:
+                raise SystemExit(f"bulk_import: checkpoint {path} e de outro arquivo ({data.get('source')})")
+            self.watermark = data["watermark"]
+            self.done = set(data["done"])
+            self.failed = set(data.get("failed", []))
+
+    def is_done(self, index: int) -> bool:
+        return (index < self.watermark or index in self.done) and index not in self.failed
+
+    def mark(self, index: int, failed: bool = False):
+        if failed:
+            self.failed.add(index)
+        else:
+            self.failed.discard(index)
+        # Retentativa de um registro abaixo da marca d'agua: so sai (ou fica) na lista de falhas
+        if index < self.watermark:
+            return
+        self.done.add(index)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self):
+        if not self.path:
+            return
+        # Grava num temporario e troca: um Ctrl+C no meio nao corrompe o checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"source": self.source, "watermark": self.watermark, "done": sorted(self.done), "failed": sorted(self.failed)},
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+
+# --- Progresso ---
+
+class Progress:
+    """Contagens por resultado e latencia de cada registro processado nesta execucao."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.outcomes: Counter = Counter()
+        self.latencies = array("d")
+
+    def add(self, outcome: str, seconds: float):
+        self.outcomes[outcome] += 1
+        self.latencies.append(seconds)
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        processed = len(self.latencies)
+        ordered = sorted(self.latencies)
+        p50 = ordered[int(0.50 * (len(ordered) - 1))] * 1000 if ordered else 0.0
+        p95 = ordered[int(0.95 * (len(ordered) - 1))] * 1000 if ordered else 0.0
+        counts = ", ".join(f"{name} {count}" for name, count in sorted(self.outcomes.items()))
+        return (
+            f"{processed} registros em {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} reg/s)"
+            f" | {counts or 'nada processado'} | latencia p50={p50:.0f}ms p95={p95:.0f}ms"
+        )
+
+
+# --- Processamento (services importados so depois de o ambiente estar pronto) ---
+
+async def _create_lead(lead_data: Dict[str, Any], job_timeout: float) -> Dict[str, Any]:
+    """O fluxo do gatilho (card + horarios) e a espera pelo card no Pipefy."""
+    from main import process_lead_trigger
+    from services.job_queue import job_queue
+
+    response = await process_lead_trigger(lead_data)
+    job = await job_queue.wait_for(response["pipefy_job_id"], job_timeout)
+    if job is None or job["status"] != "succeeded":
+        status = job["status"] if job else "sumiu"
+        raise RuntimeError(f"card nao criado no Pipefy (job {response['pipefy_job_id']}: {status})")
+    return {
+        "outcome": "lead",
+        "email": lead_data.get("email"),
+        "card_id": (job["result"] or {}).get("id"),
+        "slots": len(response.get("slots") or []),
+    }
+
+
+async def _process_lead(raw: Any, job_timeout: float) -> Dict[str, Any]:
+    from pydantic import ValidationError
+    from services.trigger_detection import LeadData
+
+    try:
+        record = json.loads(raw) if isinstance(raw, str) else raw
+        # Celula vazia no CSV = campo nao informado (cai no padrao do schema)
+        if isinstance(record, dict):
+            record = {key: value for key, value in record.items() if value not in ("", None)}
+        lead = LeadData.model_validate(record)
+    except json.JSONDecodeError as e:
+        raise InvalidRecord(f"JSON invalido: {e}") from e
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors(include_url=False))
+        raise InvalidRecord(problems) from e
+    return await _create_lead(lead.model_dump(), job_timeout)
+
+
+async def _generate(history):
+    from services.admission import AdmissionRejected
+    from services.openai_service import ERROR_REPLY, generate_response
+
+    for attempt in range(ADMISSION_RETRIES):
+        try:
+            reply = await generate_response(history)
+        except AdmissionRejected as e:
+            if attempt == ADMISSION_RETRIES - 1:
+                raise
+            await asyncio.sleep(e.retry_after)
+            continue
+        if reply == ERROR_REPLY:
+            raise RuntimeError("a chamada a OpenAI falhou")
+        return reply
+
+
+async def _process_conversation(raw: Any, job_timeout: float) -> Dict[str, Any]:
+    from services.trigger_detection import detect_trigger
+
+    try:
+        record = json.loads(raw)
+        user_turns = [m["content"] for m in record["messages"] if m.get("role") == "user"]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise InvalidRecord(f"conversa invalida: {e}") from e
+
+    history = []
+    for turn, content in enumerate(user_turns, start=1):
+        history.append({"role": "user", "content": content})
+        reply = await _generate(history)
+        lead_data = detect_trigger(reply)
+        if lead_data is not None:
+            return {"id": record.get("id"), "turns": turn, **await _create_lead(lead_data, job_timeout)}
+        history.append({"role": "assistant", "content": reply})
+    return {"outcome": "no_lead", "id": record.get("id"), "turns": len(user_turns)}
+
+
+async def run(args) -> int:
+    from services import http_client, openai_service
+    from services.job_queue import job_queue
+    from services.observability import shutdown_logging
+    from services.settings import get_settings
+
+    if args.mode == "conversations":
+        get_settings().require_openai()
+    handler = _process_conversation if args.mode == "conversations" else _process_lead
+    fmt = _detect_format(args.path, args.format)
+    if args.mode == "conversations" and fmt != "jsonl":
+        raise SystemExit("bulk_import: conversas so em JSONL")
+
+    checkpoint = Checkpoint(args.checkpoint, os.path.abspath(args.path))
+    progress = Progress()
+    out = open(args.out, "a", encoding="utf-8") if args.out else None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    skipped = enqueued = 0
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, raw = item
+            started = time.perf_counter()
+            try:
+                result = await handler(raw, args.job_timeout)
+            except InvalidRecord as e:
+                result = {"outcome": "invalid", "error": str(e)}
+            except Exception as e:
+                result = {"outcome": "failed", "error": f"{type(e).__name__}: {e}"}
+            progress.add(result["outcome"], time.perf_counter() - started)
+            # Falha encerra o registro nesta execucao, mas a proxima tenta de novo
+            checkpoint.mark(index, failed=result["outcome"] == "failed")
+            if out is not None:
+                out.write(json.dumps({"index": index, **result}, ensure_ascii=False) + "\n")
+            if len(progress.latencies) % args.checkpoint_every == 0:
+                checkpoint.save()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(args.report_seconds)
+            print(f"bulk_import: {progress.line()}", file=sys.stderr)
+
+    await job_queue.start()
+    workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+    reporting = asyncio.create_task(reporter())
+    try:
+        for index, raw in _read_records(args.path, fmt):
+            if checkpoint.is_done(index):
+                skipped += 1
+                continue
+            if raw is None:
+                checkpoint.mark(index)
+                continue
+            if args.limit and enqueued >= args.limit:
+                break
+            # Fila cheia = workers ocupados: a leitura espera (memoria limitada a janela)
+            await queue.put((index, raw))
+            enqueued += 1
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        reporting.cancel()
+        for task in workers:
+            task.cancel()
+        checkpoint.save()
+        if out is not None:
+            out.close()
+        await job_queue.stop(grace_seconds=args.job_timeout)
+        await openai_service.context_manager.drain(args.job_timeout)
+        await http_client.aclose_all()
+        await openai_service.close_client()
+        shutdown_logging()
+
+    summary = progress.line() + (f" | ja feitos antes: {skipped}" if skipped else "")
+    print(f"bulk_import: concluido: {summary}")
+    return 1 if progress.outcomes["failed"] else 0
+
+
+# --- Upstreams falsos ---
+
+def _start_fake_upstreams(workdir: str, llm_ms: int) -> subprocess.Popen:
+    """Sobe o benchmarks.fake_upstreams e aponta o ambiente (e os bancos SQLite) para ele."""
+    from benchmarks.harness import api_env, free_port, wait_until_up
+
+    port = free_port()
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(port), "--latency-ms", str(llm_ms), "--token-ms", "0"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    wait_until_up(f"http://127.0.0.1:{port}/docs", fake)
+    os.environ.update(api_env(f"http://127.0.0.1:{port}", workdir))
+    return fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["leads", "conversations"])
+    parser.add_argument("path", help="arquivo CSV ou JSONL")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="padrao: pela extensao do arquivo")
+    parser.add_argument("--concurrency", type=int, default=8, help="registros em andamento ao mesmo tempo")
+    parser.add_argument("--checkpoint", help="arquivo de progresso (retoma de onde parou)")
+    parser.add_argument("--checkpoint-every", type=int, default=50)
+    parser.add_argument("--out", help="JSONL com o resultado de cada registro (append)")
+    parser.add_argument("--limit", type=int, default=0, help="processa no maximo N registros novos")
+    parser.add_argument("--job-timeout", type=float, default=60.0, help="espera maxima pelo card no Pipefy")
+    parser.add_argument("--report-seconds", type=float, default=5.0)
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL dos services durante a execucao")
+    parser.add_argument("--fake-upstreams", action="store_true", help="roda contra o benchmarks.fake_upstreams")
+    parser.add_argument("--llm-ms", type=int, default=50, help="com --fake-upstreams: latencia da OpenAI falsa")
+    args = parser.parse_args()
+
+    # O ambiente precisa estar pronto antes do import dos services (configuracao no import)
+    fake = None
+    workdir = tempfile.TemporaryDirectory() if args.fake_upstreams else None
+    if workdir is not None:
+        fake = _start_fake_upstreams(workdir.name, args.llm_ms)
+    os.environ["LOG_LEVEL"] = args.log_level
+    try:
+        exit_code = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("bulk_import: interrompido; o checkpoint guarda o que ja terminou.", file=sys.stderr)
+        exit_code = 130
+    finally:
+        if fake is not None:
+            fake.terminate()
+            fake.wait(timeout=10)
+            workdir.cleanup()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,37 +11,103 @@ Data: 27/10/2025
 # ======================================================
 
 # Built-in
+import asyncio
 import json
+import os
+import time
+from contextlib import asynccontextmanager
 
 # Terceiros
-import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 # Locais (seus modulos)
-from services.openai_service import generate_response
-from services.pipefy_service import create_pipefy_card, update_pipefy_card_meeting_info
-from services.calendar_service import get_available_slots, create_meeting
-from typing import List, Dict
+from services.openai_service import ERROR_REPLY, StreamError, generate_response, generate_response_stream
+from services.crm_jobs import enqueue_create_card, enqueue_meeting_update
+from services.calendar_service import get_available_slots, create_meeting, release_meeting_slot, run_availability_sync_loop, slot_start
+from services import http_client, openai_service
+from services.admission import AdmissionRejected
+from services.context_manager import load_tokenizer
+from services.booking import BookingInProgress, IdempotencyMismatch, SlotTaken, booking_ledger, derive_key, fingerprint
+from services.metrics import Counter, Histogram, render_latest, run_snapshot_loop
+from services.observability import RequestTimingMiddleware, get_logger, request_parsed, shutdown_logging, span
+from services.session_store import SessionNotFound, get_session_store
+from services.settings import get_settings
+from services.trigger_detection import TriggerStreamGate, detect_trigger
+from services.job_queue import FINISHED_STATUSES, job_queue
+from typing import AsyncIterator, List, Dict, Optional
 
 # ======================================================
 # 🚀 CONFIGURAÇÃO DA APLICAÇÃO FASTAPI
 # ======================================================
 
+# Tempo que o shutdown espera os jobs e resumos (chamadas ao LLM) em andamento terminarem.
+# As requisicoes em andamento sao drenadas antes pelo uvicorn (ver serve.py).
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "10"))
+
+# Gatilho create_lead: tempo maximo esperando os horarios (card e horarios correm em paralelo)
+# e, sem interesse, quanto esperar o card ficar pronto para devolver o link dele
+CREATE_LEAD_BUDGET_SECONDS = float(os.getenv("CREATE_LEAD_BUDGET_SECONDS", "3"))
+CREATE_LEAD_CARD_WAIT_SECONDS = float(os.getenv("CREATE_LEAD_CARD_WAIT_SECONDS", "0.5"))
+
+# Carrega o SDK da OpenAI e o tokenizer numa thread logo no startup, em vez de no
+# primeiro turno que chama o LLM. Desligado por padrao: o import disputa o GIL com o
+# boot e com as primeiras requisicoes (no cold start, atrasa tudo em vez de adiantar).
+# O serve.py faz o aquecimento antes do fork, sem essa disputa.
+STARTUP_WARM_UP = os.getenv("STARTUP_WARM_UP", "false").lower() == "true"
+
+def warm_up():
+    """Importa o que e pesado e so o caminho do LLM usa (SDK da OpenAI, tokenizer)."""
+    try:
+        openai_service.preload_sdk()
+        load_tokenizer()
+    except Exception as e:
+        log.warning("Falha no aquecimento do startup", extra={"error": str(e)})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Ciclo de vida da aplicacao: valida a configuracao, mantem o indice de disponibilidade
+    sincronizado em background, sobe os workers da fila de jobs e, no shutdown, drena o
+    trabalho em andamento e fecha os pools HTTP compartilhados (inclusive o da OpenAI).
+    """
+    # Sem a chave da OpenAI o app nao sobe; integracoes faltando so geram aviso
+    settings = get_settings()
+    settings.require_openai()
+    missing = settings.missing_integrations()
+    if missing:
+        log.warning("Integracoes sem configuracao no .env; os fluxos que dependem delas vao falhar", extra={"missing": missing})
+    if STARTUP_WARM_UP:
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+    availability_sync = asyncio.create_task(run_availability_sync_loop())
+    metrics_snapshots = asyncio.create_task(run_snapshot_loop())
+    await job_queue.start()
+    yield
+    availability_sync.cancel()
+    metrics_snapshots.cancel()
+    await asyncio.gather(
+        job_queue.stop(grace_seconds=SHUTDOWN_DRAIN_SECONDS),
+        openai_service.context_manager.drain(SHUTDOWN_DRAIN_SECONDS),
+    )
+    await http_client.aclose_all()
+    await openai_service.close_client()
+    booking_ledger.close()
+    shutdown_logging()
+
 # Criar a instancia principal da aplicacao
 app = FastAPI(
     title="AI SDR Agent API",
     description="API para o agente SDR de IA",
-    version="0.7.0"
+    version="0.7.0",
+    lifespan=lifespan
 )
 
 # --- HABILITAR CORS ---
-origins = [
-    "http://localhost:5173", # A origem do seu frontend React/Vite
-    "http://127.0.0.1:5173", # As vezes o navegador usa esse
-    "https://ai-sdr-agent-api.vercel.app" 
-]
+# Origens do frontend (React/Vite local e o deploy na Vercel), configuraveis por CORS_ORIGINS
+origins = get_settings().cors_origins
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,6 +117,33 @@ app.add_middleware(
     allow_headers=["*"], # Permite todos os cabecalhos
 )
 
+# --- LATENCIA POR ROTA E ETAPA "request_parse" ---
+app.add_middleware(RequestTimingMiddleware)
+
+log = get_logger("main")
+
+# --- ADMISSAO DA OPENAI: fila cheia ou prazo vencido viram 429 rapido ---
+@app.exception_handler(AdmissionRejected)
+async def handle_admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Muitas conversas ao mesmo tempo. Tente novamente em instantes.", "reason": exc.reason},
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+# --- METRICAS DO STREAM ---
+STREAM_TTFB = Histogram(
+    "sdr_chat_stream_ttfb_seconds",
+    "Tempo ate o primeiro evento enviado pelo /chat/stream"
+)
+
+# --- METRICAS DO GATILHO create_lead ---
+CREATE_LEAD_DEGRADED = Counter(
+    "sdr_create_lead_degraded_total",
+    "Gatilhos create_lead respondidos sem tudo: slots_timeout, slots_error, no_slots ou card_pending",
+    ["reason"]
+)
+
 # ======================================================
 # 🧩 MODELOS Pydantic
 # ======================================================
@@ -65,13 +158,226 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     
+# Corpo do POST /sessions: historico inicial opcional (ex: restaurar uma conversa expirada)
+class CreateSessionRequest(BaseModel):
+    history: List[Dict[str, str]] = []
+
+class CreateSessionResponse(BaseModel):
+    session_id: str
+
+# Corpo do POST /sessions/{id}/messages: so a mensagem nova do usuario
+class SessionMessageRequest(BaseModel):
+    message: str = Field(..., min_length=1, max_length=4000)
+
 # Modelo para o novo endpoint de agendamento
 class ScheduleRequest(BaseModel):
     slot_info: Dict # Informacoes do horario escolhido [ex: {"start_time": "...", "scheduling_url": "..."}]
     lead_data: Dict # Dados do lead(name, email, company, need)
-    pipefy_card_id: str # ID do card no Pipefy para atualizar
+    pipefy_card_id: Optional[str] = None # ID do card no Pipefy para atualizar
+    pipefy_job_id: Optional[str] = None # Ou o job que esta criando o card (quando o ID ainda nao existe)
 
 
+# ======================================================
+# 🔁 ORQUESTRACAO DO GATILHO create_lead
+# ======================================================
+
+def _discard_result(task: asyncio.Task):
+    """Task que passou do orcamento segue em background; so evita o aviso de excecao nao lida."""
+    if not task.cancelled():
+        task.exception()
+
+async def _fetch_slots() -> List:
+    """Ramo dos horarios; levanta excecao se o Calendly/indice devolver erro."""
+    with span("create_lead_slots"):
+        slots = await get_available_slots()
+    if isinstance(slots, dict):
+        raise RuntimeError(slots.get("error", "erro ao buscar horarios"))
+    return slots
+
+def _card_snapshot(card_job: Dict, wait: asyncio.Task) -> Dict:
+    """Estado do job do card agora: o resultado do wait_for se ele ja terminou, senao o job enfileirado."""
+    if wait.done() and not wait.cancelled() and wait.exception() is None and wait.result() is not None:
+        return wait.result()
+    wait.cancel()
+    return card_job
+
+async def process_lead_trigger(lead_data: Dict) -> Dict:
+    """
+    Executa o fluxo de negocio do gatilho create_lead como um fan-out com orcamento de tempo:
+    - o card e enfileirado (a fila cria no Pipefy em background, com retry) e, com interesse
+      confirmado, os horarios sao buscados ao mesmo tempo;
+    - a resposta sai quando os horarios chegam (ate CREATE_LEAD_BUDGET_SECONDS); se o card
+      ficou pronto nesse meio tempo o ID dele ja vai junto, senao vai so o job;
+    - horarios fora do prazo ou com erro nao derrubam o lead: o card segue sendo criado e o
+      cliente recebe uma confirmacao em vez da lista.
+    Retorna o payload (show_slots ou success) que vai para o frontend.
+    """
+    log.debug("Dados do lead recebidos", extra={"lead_data": lead_data})
+    started = time.perf_counter()
+    interested = lead_data.get("interest_confirmed") is True
+
+    with span("create_lead_fanout"):
+        # 1. Horarios (se houver interesse) e enfileiramento do card, em paralelo
+        slots_task = asyncio.create_task(_fetch_slots()) if interested else None
+        try:
+            card_job = await enqueue_create_card(lead_data)
+        except Exception:
+            if slots_task is not None:
+                slots_task.cancel()
+            raise
+        log.info("Criação do card enfileirada", extra={"job_id": card_job["id"], "job_status": card_job["status"]})
+
+        # 2. Enquanto os horarios nao chegam, espera o card de graca (sem atrasar a resposta)
+        card_wait = asyncio.create_task(job_queue.wait_for(card_job["id"], CREATE_LEAD_BUDGET_SECONDS))
+        if slots_task is not None:
+            await asyncio.wait({slots_task}, timeout=CREATE_LEAD_BUDGET_SECONDS)
+        else:
+            await asyncio.wait({card_wait}, timeout=CREATE_LEAD_CARD_WAIT_SECONDS)
+        card_job = _card_snapshot(card_job, card_wait)
+
+    card_ready = card_job["status"] in FINISHED_STATUSES
+    if not card_ready:
+        CREATE_LEAD_DEGRADED.inc(reason="card_pending")
+    timing = {"total_ms": round((time.perf_counter() - started) * 1000, 1), "card_ready": card_ready, "interested": interested}
+
+    # 3. Sem interesse: so o registro do lead
+    if not interested:
+        log.info("Interesse não confirmado. Lead registrado no Pipefy.", extra=timing)
+        return {
+            "status": "success",
+            "message": "Lead registrado (sem interesse).",
+            "pipefy_card_url": (card_job["result"] or {}).get("url"),
+            "pipefy_job_id": card_job["id"]
+        }
+
+    # 4. Com interesse: horarios, ou degrada para uma confirmacao se eles nao vieram
+    if not slots_task.done():
+        reason = "slots_timeout"
+        slots_task.add_done_callback(_discard_result)
+    elif slots_task.exception() is not None:
+        reason = "slots_error"
+        log.error("Erro ao buscar horários para o lead", extra={"error": str(slots_task.exception())})
+    else:
+        reason = None if slots_task.result() else "no_slots"
+    log.info("Gatilho create_lead processado", extra={**timing, "slots": reason or "ok"})
+
+    if reason is not None:
+        CREATE_LEAD_DEGRADED.inc(reason=reason)
+        return {
+            "status": "success",
+            "message": "Recebemos seus dados! Não consegui carregar os horários agora; nosso time vai entrar em contato para agendar a conversa.",
+            "pipefy_card_url": (card_job["result"] or {}).get("url"),
+            "pipefy_job_id": card_job["id"]
+        }
+
+    # O frontend vai precisar mostrar esses horarios e guardar os dados do lead e o card/job
+    return {
+        "action": "show_slots",
+        "slots": slots_task.result(),
+        "lead_data": lead_data, # Devolve os dados para o frontend usar no /schedule
+        "pipefy_card_id": (card_job["result"] or {}).get("id"), # Card ja criado (dentro do orcamento ou job repetido)
+        "pipefy_job_id": card_job["id"] # Devolve o job para o frontend usar no /schedule
+    }
+
+async def resolve_ai_response(ai_response: str) -> str:
+    """
+    O "MAESTRO": decide se a resposta da IA e texto normal ou o gatilho create_lead.
+    Retorna o que vai para o frontend (o texto da IA ou o JSON show_slots/success).
+    """
+    # JSON puro, em bloco de codigo ou no meio do texto, validado pelo schema
+    with span("trigger_detection"):
+        lead_data = detect_trigger(ai_response)
+
+    if lead_data is not None:
+        log.info("Gatilho detectado: create_lead")
+        result = await process_lead_trigger(lead_data)
+        return json.dumps(result)
+
+    # Se nao era um gatilho, retorna a resposta normal da IA para continuar a conversa
+    log.debug("Resposta é texto normal, continuando a conversa.")
+    return ai_response
+
+def _sse_event(event: str, data: Dict) -> str:
+    """Formata um evento Server-Sent Events com payload JSON (uma linha so)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _chat_event_stream(history: Optional[List[Dict[str, str]]] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Repassa os tokens da IA como eventos SSE.
+    O texto sai token a token; so o que pode ser o gatilho fica acumulado (um "{" ou bloco
+    de codigo no inicio da resposta ou de uma linha, ou um "{" seguido do marcador create_lead,
+    ver TriggerStreamGate). No fim, o acumulado vira o evento "action" (se for o gatilho)
+    ou e entregue como texto. Se a geracao cair no meio, sai um evento "error".
+    Com session_id, a resposta da IA e salva na sessao ao final, mesmo parcial (erro ou
+    cliente desconectado).
+    """
+    full_text: List[str] = []
+    gate = TriggerStreamGate()
+    try:
+        try:
+            async for token in generate_response_stream(history, session_id=session_id):
+                full_text.append(token)
+                text = gate.feed(token)
+                if text:
+                    yield _sse_event("token", {"text": text})
+        except StreamError:
+            # O que ja saiu fica; a prosa retida tambem sai, um JSON pela metade nao
+            held = gate.flush()
+            if held and not gate.buffering:
+                yield _sse_event("token", {"text": held})
+            yield _sse_event("error", {"message": ERROR_REPLY})
+            return
+
+        if gate.buffering:
+            ai_response = "".join(full_text)
+            log.debug("Resposta da IA acumulada no stream", extra={"response": ai_response})
+            with span("trigger_detection"):
+                lead_data = detect_trigger(ai_response)
+            if lead_data is not None:
+                log.info("Gatilho detectado no stream: create_lead")
+                result = await process_lead_trigger(lead_data)
+                yield _sse_event("action", result)
+                yield _sse_event("done", {})
+                return
+        # Parecia JSON mas nao era um gatilho (ou e so o fim da prosa): entrega como texto normal
+        held = gate.flush()
+        if held:
+            yield _sse_event("token", {"text": held})
+        yield _sse_event("done", {})
+    finally:
+        if session_id is not None and full_text:
+            # shield: com o cliente desconectado a task pode ser cancelada de novo aqui
+            await asyncio.shield(get_session_store().append(session_id, [{"role": "assistant", "content": "".join(full_text)}]))
+
+async def _observe_ttfb(events: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Mede o tempo ate o primeiro evento SSE sair (time-to-first-byte do stream)."""
+    started = time.perf_counter()
+    first = True
+    async for event in events:
+        if first:
+            STREAM_TTFB.observe(time.perf_counter() - started)
+            first = False
+        yield event
+
+async def _sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """
+    Monta a resposta SSE so depois do primeiro evento: se a admissao da OpenAI recusar
+    a chamada, ainda da para responder 429 (depois que os headers saem, nao da mais).
+    """
+    events = _observe_ttfb(events)
+    first = await events.__anext__()
+
+    async def replay() -> AsyncIterator[str]:
+        yield first
+        async for event in events:
+            yield event
+
+    return StreamingResponse(
+        replay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ======================================================
 # 🌐 ENDPOINTS DA API
 # ======================================================
@@ -82,109 +388,203 @@ def read_root():
     """Rota raiz que verifica se a API esta online"""
     return {"message": "AI SDR Agent API - online"}
 
+# --- Endpoint de metricas (formato Prometheus) ---
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """Expoe as metricas coletadas (ex: latencia por upstream) para o Prometheus."""
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+# --- Status de um job da fila (ex: criacao do card no Pipefy) ---
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    """Retorna o status de um job em background (pending, running, succeeded ou dead)."""
+    job = await job_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return job
+
 # --- Endpoint de chat (POST) ---
 # O endpoint principal que o frontend vai usar
 @app.post("/chat", response_model=ChatResponse)
-def handle_chat(request: ChatRequest):
+async def handle_chat(request: ChatRequest):
     """
     Processa o histórico de mensagens do usuário e decide se e uma resposta de texto
     ou um gatilho de criação de lead.
     - Se for texto → responde normalmente.
     - Se for JSON com {"action": "create_lead"} → cria card no Pipefy e agenda.
     """
+    request_parsed()
     # Logar apenas a ultima mensagem para nao poluir demais o console
-    if request.history:
-        print(f"Histórico recebido(ultima msg): {request.history[-1]['content']}")
-    else:
-        print("Histórico recebido vazio")
+    log.debug("Histórico recebido", extra={"messages": len(request.history), "last_message": request.history[-1]["content"] if request.history else None})
     
     # 1. Gerar a resposta da IA 
-    ai_response = generate_response(request.history)
-    print(f"Resposta da IA: {ai_response}")    
+    ai_response = await generate_response(request.history)
+    log.debug("Resposta da IA", extra={"response": ai_response})
     
-    # 2. O "MAESTRO" tenta ler a resposta como JSON
+    # 2. O "MAESTRO" decide se e texto ou gatilho
+    return ChatResponse(response=await resolve_ai_response(ai_response))
+
+# --- Endpoint de chat em streaming (Server-Sent Events) ---
+@app.post("/chat/stream")
+async def handle_chat_stream(request: ChatRequest):
+    """
+    Mesma logica do /chat, mas envia o texto da IA token a token via SSE.
+    Eventos enviados:
+    - "token"  → {"text": "..."} pedaco de texto da IA
+    - "action" → mesmo JSON que o /chat devolveria para um gatilho (show_slots / success)
+    - "error"  → {"message": "..."} a geracao falhou (o texto ja enviado fica como esta)
+    - "done"   → fim da resposta
+    """
+    request_parsed()
+    log.debug("Histórico recebido no stream", extra={"messages": len(request.history), "last_message": request.history[-1]["content"] if request.history else None})
+
+    return await _sse_response(_chat_event_stream(request.history))
+
+# --- Endpoints de sessao (historico guardado no servidor) ---
+@app.post("/sessions", response_model=CreateSessionResponse, status_code=201)
+async def create_session(request: Optional[CreateSessionRequest] = None):
+    """Cria uma sessao de conversa. O cliente passa a mandar so as mensagens novas."""
+    request_parsed()
+    history = request.history if request else []
+    session_id = await get_session_store().create(history)
+    log.info("Sessão criada", extra={"session_id": session_id})
+    return CreateSessionResponse(session_id=session_id)
+
+@app.get("/sessions/{session_id}")
+async def read_session(session_id: str):
+    """Retorna o historico guardado (ex: para redesenhar o chat depois de um refresh)."""
     try:
-        # Tentar carregar a resposta da IA como um dicionario em python
-        json_data = json.loads(ai_response)
-        
-        # Se der certo, verifica se e o gatilho que esperamos
-        if json_data.get("action") == "create_lead":
-            print("GATILHO DETECTADO: 'create_lead'")           
-            lead_data = json_data.get("data")
-            print(f"Dados do Lead: {lead_data}")
-            
-            # Aqui chamamos o servico do Pipefy para criar o card
-            # 1. Criar o card no Pipefy
-            card_info = create_pipefy_card(lead_data)
-            pipefy_card_id = card_info.get("id")
-            print(f"Informações do card: {card_info}")
-            
-            # 2. Verifica se o cliente tem interesse para agendar
-            if lead_data.get("interest_confirmed") is True:
-                print("Interesse confirmado, buscando horarios...")
-                
-                # 3. Buscar horarios disponiveis
-                available_slots = get_available_slots() # chama o calendar_service
-            
-                # 4. Retorna os horarios para o frontend
-                # O frontend vai precisar mostrar esses horarios e guardar os dados do lead e o card_id
-                return ChatResponse(response=json.dumps({
-                    "action": "show_slots",
-                    "slots": available_slots,
-                    "lead_data": lead_data, # Devolve os dados para o frontend usar no /schedule
-                    "pipefy_card_id": pipefy_card_id # Devolve o ID para o frontend usar no /schedule
-                }))
-            else:
-                print("Interesse não confirmado. Lead registrado no Pipefy.")
-                return ChatResponse(response=json.dumps({
-                    "status": "success",
-                    "message": "Lead registrado (sem interesse).",
-                    "pipefy_card_url": card_info.get("url") 
-            }))
-                
-    except json.JSONDecodeError:
-        # Se der erro, nao era um JSON. Era so texto normal.
-        # Apenas retorna a resposta de texto da IA para continuar a conversa
-        print("Resposta é texto normal, continuando a conversa.")
-        pass
-    
-    # Se nao era um gatilho, retorna a resposta normal da IA
-    return ChatResponse(response=ai_response)
+        history = await get_session_store().get_history(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada ou expirada.")
+    return {"session_id": session_id, "history": history}
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    """Encerra a sessao e descarta o historico."""
+    await get_session_store().delete(session_id)
+
+@app.post("/sessions/{session_id}/messages", response_model=ChatResponse)
+async def handle_session_message(session_id: str, request: SessionMessageRequest):
+    """
+    Mesma logica do /chat, mas o cliente manda so a mensagem nova:
+    o historico e lido do session store e a resposta da IA e salva nele.
+    """
+    request_parsed()
+    log.debug("Mensagem recebida na sessão", extra={"session_id": session_id, "user_message": request.message})
+    store = get_session_store()
+    try:
+        await store.append(session_id, [{"role": "user", "content": request.message}])
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada ou expirada.")
+
+    ai_response = await generate_response(session_id=session_id)
+    log.debug("Resposta da IA", extra={"session_id": session_id, "response": ai_response})
+    await store.append(session_id, [{"role": "assistant", "content": ai_response}])
+
+    return ChatResponse(response=await resolve_ai_response(ai_response))
+
+@app.post("/sessions/{session_id}/messages/stream")
+async def handle_session_message_stream(session_id: str, request: SessionMessageRequest):
+    """Versao SSE do POST /sessions/{id}/messages (mesmos eventos do /chat/stream)."""
+    request_parsed()
+    try:
+        await get_session_store().append(session_id, [{"role": "user", "content": request.message}])
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada ou expirada.")
+
+    return await _sse_response(_chat_event_stream(session_id=session_id))
 
 # --- Endpoint para agendar a reuniao ---
 @app.post("/schedule")
-async def schedule_meeting(request: ScheduleRequest):
+async def schedule_meeting(
+    request: ScheduleRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=200),
+):
     """
     Recebe o horario escolhido pelo usuario e os dados do lead,
     cria o evento no calendly e atualiza o card no Pipefy.
+    Idempotente: repetir o pedido (mesma Idempotency-Key ou, sem ela, mesmo e-mail +
+    horario) devolve a resposta do primeiro, sem agendar de novo.
     """
-    print(f"Recebida solicitação de agendamento para: {request.lead_data.get('email')}")
-    print(f"Slot escolhido: {request.slot_info}")
-    
-    # 1. Criar o evento no Calendly
-    meeting_confirmation = create_meeting(request.slot_info, request.lead_data)
+    request_parsed()
+    log.info("Recebida solicitação de agendamento", extra={"email": request.lead_data.get("email"), "slot": request.slot_info})
+    if not request.pipefy_card_id and not request.pipefy_job_id:
+        raise HTTPException(status_code=422, detail="Informe pipefy_card_id ou pipefy_job_id.")
+    start = slot_start(request.slot_info)
+    if start is None:
+        raise HTTPException(status_code=422, detail="Horário inválido.")
+
+    if idempotency_key:
+        key, key_fingerprint = idempotency_key, fingerprint(request.model_dump())
+    else:
+        # Chave derivada: o proprio lead + horario identificam o pedido (duplo clique,
+        # retry do frontend), entao qualquer corpo com os mesmos dois vale como repeticao
+        key = derive_key(request.lead_data.get("email", ""), request.slot_info.get("start_time", ""))
+        key_fingerprint = key
+
+    try:
+        result, replayed = await booking_ledger.book_once(key, key_fingerprint, start, lambda: _book_meeting(request))
+    except SlotTaken:
+        raise HTTPException(status_code=409, detail="Este horário acabou de ser reservado. Escolha outro.")
+    except IdempotencyMismatch:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já usada com um pedido diferente.")
+    except BookingInProgress:
+        raise HTTPException(status_code=409, detail="Este agendamento ainda está em andamento. Tente de novo em instantes.")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+        log.info("Agendamento repetido, devolvendo a resposta original", extra={"email": request.lead_data.get("email")})
+    return result
+
+
+async def _book_meeting(request: ScheduleRequest) -> Dict:
+    """O agendamento de fato (roda no maximo uma vez por chave, dentro do lock do horario)."""
+    # 1. Criar o evento no Calendly (create_meeting reserva o horario no indice local antes)
+    try:
+        meeting_confirmation = await create_meeting(request.slot_info, request.lead_data)
+    except BaseException:
+        # A reuniao nao foi criada: o livro de reservas solta o horario e o indice local
+        # tambem precisa devolve-lo
+        await release_meeting_slot(request.slot_info)
+        raise
     
+    if meeting_confirmation.get("slot_unavailable"):
+        raise HTTPException(status_code=409, detail=meeting_confirmation["error"])
     if "error" in meeting_confirmation:
         raise HTTPException(status_code=500, detail=f"Erro ao criar evento no Calendly: {meeting_confirmation['error']}")
     meeting_link = meeting_confirmation.get("meeting_link")
     meeting_datetime = meeting_confirmation.get("meeting_datetime")
     
-    print(f"Reunião agendada! Link: {meeting_link}, Horario: {meeting_datetime}")
+    log.info("Reunião agendada", extra={"meeting_link": meeting_link, "meeting_datetime": meeting_datetime})
     
-    # 2. Atualizar o card no Pipefy com as informações da reuniao
-    update_success = update_pipefy_card_meeting_info(
-        card_id=request.pipefy_card_id,
-        meeting_link=meeting_link,
-        meeting_datetime=meeting_datetime
-    )
-    if not update_success:
-        print(f"AVISO: Reunião agendada, mas falha ao atualizar o card {request.pipefy_card_id} no Pipefy.")
+    # 2. Enfileirar a atualizacao do card no Pipefy com as informações da reuniao
+    # (com retry e dead letter na fila, em vez de so imprimir a falha). A reuniao ja
+    # existe: se nem enfileirar der certo, o horario continua reservado e o agendamento
+    # conta como feito; o card fica para ser atualizado a mao, a partir do log
+    update_job_id = None
+    try:
+        update_job = await enqueue_meeting_update(
+            meeting_link=meeting_link,
+            meeting_datetime=meeting_datetime,
+            card_id=request.pipefy_card_id,
+            card_job_id=request.pipefy_job_id
+        )
+        update_job_id = update_job["id"]
+        log.info("Atualização do card enfileirada", extra={"job_id": update_job_id})
+    except Exception as e:
+        log.error(
+            "Falha ao enfileirar a atualização do card; reunião mantida",
+            extra={"error": str(e), "card_id": request.pipefy_card_id, "card_job_id": request.pipefy_job_id,
+                   "meeting_link": meeting_link, "meeting_datetime": meeting_datetime},
+        )
     # 3. Retornar a confirmação para o frontend
     return {
         "status": "success",
         "message": "Reunião agendada com sucesso!",
         "meeting_link": meeting_link,
-        "meeting_datetime": meeting_datetime
+        "meeting_datetime": meeting_datetime,
+        "pipefy_update_job_id": update_job_id
     }
     
 # ======================================================
@@ -193,4 +593,6 @@ async def schedule_meeting(request: ScheduleRequest):
 
 # Permite rodar o app diretamente com python main.py
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+Ponto de entrada de producao: varios processos worker atendendo o mesmo socket.
+
+- Pre-fork: o processo principal importa o app (e todos os services) uma vez e so
+  depois cria os workers com fork, entao os modulos ja chegam carregados em cada um
+  (menos tempo de boot e memoria compartilhada por copy-on-write).
+- Cada worker e um uvicorn com o proprio event loop; o kernel distribui as conexoes
+  entre eles, e o throughput escala com os nucleos.
+- Shutdown gracioso: SIGTERM/SIGINT param de aceitar conexoes, esperam as requisicoes
+  em andamento (inclusive chamadas ao LLM em streaming) por ate GRACEFUL_TIMEOUT_SECONDS
+  e rodam o lifespan (que drena jobs e resumos). Quem passar do prazo leva SIGKILL.
+- Worker que morre e recriado. Se ele cai logo depois de subir (ex: OPENAI_API_KEY
+  ausente, que derruba o lifespan), a recriacao espera cada vez mais (backoff
+  exponencial); depois de WORKER_MAX_BOOT_FAILURES quedas seguidas no boot o supervisor
+  desiste, encerra os outros workers e sai com o codigo de erro do worker.
+- Estado compartilhado: com mais de um worker, sessoes vao para o SQLite (WAL) e o cache
+  de respostas ganha a camada compartilhada em SHARED_CACHE_PATH. A fila de jobs ja e
+  um arquivo SQLite com lease, entao os workers dividem os jobs sem duplicar.
+  As metricas de cada worker vao para METRICS_DIR, e o /metrics de qualquer um junta
+  todas com o label worker.
+
+Uso:
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+"""
+
+import argparse
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import uvicorn
+from services.settings import load_env
+
+load_env()
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+GRACEFUL_TIMEOUT_SECONDS = float(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+# Tempo minimo entre recriar workers que morreram (evita loop de crash); dobra a cada
+# queda seguida no boot, ate RESPAWN_MAX_DELAY_SECONDS
+RESPAWN_DELAY_SECONDS = 1.0
+RESPAWN_MAX_DELAY_SECONDS = 30.0
+# Worker que sai com erro antes disso conta como falha de boot
+WORKER_BOOT_GRACE_SECONDS = float(os.getenv("WORKER_BOOT_GRACE_SECONDS", "10"))
+WORKER_MAX_BOOT_FAILURES = int(os.getenv("WORKER_MAX_BOOT_FAILURES", "5"))
+# Mesmo codigo do uvicorn.run quando o startup (lifespan) falha
+STARTUP_FAILURE_EXIT_CODE = 3
+
+
+def _configure_shared_state(workers: int):
+    """Com varios processos, o estado que precisa ser visto por todos vai para SQLite."""
+    if workers <= 1:
+        return
+    if os.getenv("SESSION_STORE", "memory") == "memory":
+        print("serve: SESSION_STORE=memory nao e compartilhado entre workers, usando sqlite.", file=sys.stderr)
+        os.environ["SESSION_STORE"] = "sqlite"
+    os.environ.setdefault("SHARED_CACHE_PATH", "shared_cache.db")
+    os.environ.setdefault("METRICS_DIR", "metrics")
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, log_level: str) -> int:
+    """Corpo do processo filho: um servidor uvicorn no socket herdado. Retorna o codigo de saida."""
+    # Handlers do supervisor nao valem no filho (o uvicorn instala os proprios)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Sem isso todos os filhos herdam o mesmo estado do random (ex: jitter do retry)
+    random.seed()
+    config = uvicorn.Config(app, lifespan="on", log_level=log_level, timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    # Lifespan que falhou no startup: o uvicorn so retorna, sem levantar
+    return 0 if server.started else STARTUP_FAILURE_EXIT_CODE
+
+
+def serve(workers: int, host: str, port: int, log_level: str) -> int:
+    """Supervisiona os workers ate o shutdown. Retorna o codigo de saida do processo."""
+    _configure_shared_state(workers)
+
+    # Pre-carrega o app, os services e o que eles so importam no primeiro uso
+    # (SDK da OpenAI, tokenizer) antes do fork, para os workers herdarem prontos
+    from main import app, warm_up
+    from services import metrics
+
+    warm_up()
+    # Snapshots de uma execucao anterior teriam pids que nao existem mais
+    metrics.clear_snapshots()
+
+    sock = _bind(host, port)
+    print(f"serve: {workers} worker(s) em http://{host}:{port} (pid {os.getpid()})", file=sys.stderr)
+
+    children = {}
+    stopping = {"deadline": None}
+    # Recriacoes agendadas (instante monotonic) e quedas seguidas no boot
+    respawns = []
+    boot_failures = 0
+    exit_code = 0
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _run_worker(app, sock, log_level)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                # _exit: o filho nao roda os atexit/finalizadores herdados do supervisor
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop_children():
+        stopping["deadline"] = time.monotonic() + GRACEFUL_TIMEOUT_SECONDS + 5
+        respawns.clear()
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def handle_stop(signum, frame):
+        if stopping["deadline"] is None:
+            print(f"serve: recebido sinal {signum}, drenando workers...", file=sys.stderr)
+            stop_children()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while children or respawns:
+        while respawns and respawns[0] <= time.monotonic():
+            respawns.pop(0)
+            spawn()
+        pid, status = os.waitpid(-1, os.WNOHANG) if children else (0, 0)
+        if pid == 0:
+            if stopping["deadline"] is not None and time.monotonic() > stopping["deadline"]:
+                # Passou do prazo do shutdown gracioso: encerra na marra
+                for child in children:
+                    os.kill(child, signal.SIGKILL)
+            time.sleep(0.2)
+            continue
+        started_at = children.pop(pid, None)
+        metrics.remove_snapshot(pid)
+        if started_at is None or stopping["deadline"] is not None:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        uptime = time.monotonic() - started_at
+        if code != 0 and uptime < WORKER_BOOT_GRACE_SECONDS:
+            boot_failures += 1
+        else:
+            boot_failures = 0
+        if boot_failures >= WORKER_MAX_BOOT_FAILURES:
+            print(f"serve: worker {pid} caiu no boot {boot_failures} vezes seguidas (codigo {code}), desistindo.", file=sys.stderr)
+            exit_code = code if code > 0 else 1
+            stop_children()
+            continue
+        delay = RESPAWN_DELAY_SECONDS * 2 ** max(0, boot_failures - 1)
+        delay = max(0.0, min(RESPAWN_MAX_DELAY_SECONDS, delay) - (uptime if boot_failures == 0 else 0.0))
+        print(f"serve: worker {pid} saiu (codigo {code}), recriando em {delay:.1f}s.", file=sys.stderr)
+        respawns.append(time.monotonic() + delay)
+        respawns.sort()
+
+    sock.close()
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sobe a API com varios workers (pre-fork)")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        # Sem fork (Windows): o uvicorn sobe os workers do zero, sem pre-carregar
+        _configure_shared_state(args.workers)
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level,
+                    timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS)
+        return
+    sys.exit(serve(args.workers, args.host, args.port, args.log_level))
+
+
+if __name__ == "__main__":
+    main()
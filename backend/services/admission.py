@@ -0,0 +1,269 @@
+"""
+Controle de admissao das chamadas a OpenAI.
+
+Em pico de trafego, disparar toda chamada na hora so estoura o rate limit da OpenAI
+e deixa todo mundo lento junto. Aqui cada chamada precisa ser admitida antes:
+
+- dois token buckets: requisicoes/minuto (custo 1) e tokens/minuto (custo = tokens
+  estimados do prompt + uma estimativa da resposta, acertada depois com o uso real);
+- limite de chamadas simultaneas;
+- fila de espera limitada, com prazo por requisicao: fila cheia ou prazo vencido viram
+  AdmissionRejected, que a API devolve como 429 com Retry-After;
+- prioridade: conversas mais adiantadas na qualificacao passam na frente das novas
+  (um lead quase fechado nao espera atras de um "Oi").
+
+Os limites sao por processo: com varios workers (serve.py), divida pelo numero de workers.
+Limite 0 desliga aquela restricao.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+from services.metrics import Counter, Gauge, Histogram
+
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "50"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+# Tokens de resposta reservados por chamada ate o uso real ser conhecido
+ADMISSION_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("ADMISSION_COMPLETION_TOKENS_ESTIMATE", "300"))
+
+# Prioridades (maior passa na frente)
+PRIORITY_BACKGROUND = 0  # ex: resumo rolante do historico
+PRIORITY_MAX = 5
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "sdr_admission_queue_depth",
+    "Chamadas a OpenAI esperando admissao",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "sdr_admission_in_flight",
+    "Chamadas a OpenAI admitidas e em andamento",
+)
+ADMISSION_WAIT = Histogram(
+    "sdr_admission_wait_seconds",
+    "Tempo de espera na fila de admissao, por resultado (admitted ou rejected)",
+    ["outcome"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "sdr_admission_rejections_total",
+    "Chamadas recusadas pela admissao: queue_full ou deadline",
+    ["reason"],
+)
+
+
+class AdmissionRejected(Exception):
+    """A chamada nao foi admitida (fila cheia ou prazo vencido). A API responde 429."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"OpenAI sobrecarregada ({reason}), tente de novo em {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Bucket que enche continuamente ate `capacity`, a `per_minute` unidades por minuto."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Segundos ate haver `amount` no bucket (0 se ja tem)."""
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        if self.enabled:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Devolve (ou, com amount negativo, cobra a mais) depois de saber o custo real."""
+        if self.enabled:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "future")
+
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        self.future = future
+
+
+class Ticket:
+    """Chamada admitida; settle() acerta o bucket de tokens com o uso real da OpenAI."""
+
+    def __init__(self, controller: "AdmissionController", estimated_tokens: int):
+        self.controller = controller
+        self.estimated_tokens = estimated_tokens
+
+    def settle(self, actual_tokens: Optional[int]):
+        if actual_tokens is not None:
+            self.controller.tpm.give_back(self.estimated_tokens - actual_tokens)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        rpm: int = OPENAI_RPM_LIMIT,
+        tpm: int = OPENAI_TPM_LIMIT,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+    ):
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        # (-prioridade, ordem de chegada, waiter): maior prioridade primeiro, FIFO no empate
+        self._heap: List[Tuple[int, int, _Waiter]] = []
+        self._order = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+
+    def _can_run(self, tokens: int) -> float:
+        """0 se a chamada pode sair agora; senao, segundos ate poder (inf = esperar alguem terminar)."""
+        if self.max_concurrency > 0 and self.in_flight >= self.max_concurrency:
+            return math.inf
+        return max(self.rpm.time_until(1), self.tpm.time_until(tokens))
+
+    def _grant(self, tokens: int):
+        self.rpm.take(1)
+        self.tpm.take(tokens)
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def _release(self):
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        self._notify()
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    def _pending(self) -> int:
+        return sum(1 for _, _, waiter in self._heap if not waiter.future.done())
+
+    def _retry_after(self, tokens: int) -> float:
+        """Estimativa de quando vale tentar de novo: a fila atual drenando no ritmo do RPM."""
+        per_request = 60.0 / self.rpm.capacity if self.rpm.enabled else 1.0
+        wait = self._can_run(tokens)
+        return max(1.0, (0.0 if math.isinf(wait) else wait) + self._pending() * per_request)
+
+    async def _pump(self):
+        """Libera os waiters em ordem de prioridade conforme os buckets e a concorrencia permitem."""
+        while self._heap:
+            _, _, waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            wait = self._can_run(waiter.tokens)
+            if wait <= 0:
+                heapq.heappop(self._heap)
+                self._grant(waiter.tokens)
+                waiter.future.set_result(None)
+                continue
+            ADMISSION_QUEUE_DEPTH.set(self._pending())
+            # Acorda quando o bucket enche o suficiente, alguem termina ou alguem chega
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=None if math.isinf(wait) else wait)
+            except asyncio.TimeoutError:
+                pass
+        ADMISSION_QUEUE_DEPTH.set(0)
+        self._pump_task = None
+
+    @asynccontextmanager
+    async def admit(self, priority: int, tokens: int, max_wait_seconds: Optional[float] = None) -> AsyncIterator[Ticket]:
+        """
+        Espera a vez da chamada (ou levanta AdmissionRejected) e a mantem contada
+        como "em andamento" ate o bloco terminar.
+        """
+        tokens = tokens + ADMISSION_COMPLETION_TOKENS_ESTIMATE
+        started = time.perf_counter()
+        if not self._heap and self._can_run(tokens) <= 0:
+            # Caminho rapido: ninguem esperando e ha capacidade
+            self._grant(tokens)
+            ADMISSION_WAIT.observe(0.0, outcome="admitted")
+        else:
+            await self._wait_turn(priority, tokens, max_wait_seconds, started)
+        try:
+            yield Ticket(self, tokens)
+        finally:
+            self._release()
+
+    async def _wait_turn(self, priority: int, tokens: int, max_wait_seconds: Optional[float], started: float):
+        if self._pending() >= self.queue_size:
+            ADMISSION_REJECTIONS.inc(reason="queue_full")
+            ADMISSION_WAIT.observe(0.0, outcome="rejected")
+            raise AdmissionRejected("queue_full", self._retry_after(tokens))
+
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        waiter = _Waiter(tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (-min(priority, PRIORITY_MAX), next(self._order), waiter))
+        ADMISSION_QUEUE_DEPTH.set(self._pending())
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        else:
+            self._notify()
+
+        timeout = self.max_wait_seconds if max_wait_seconds is None else max_wait_seconds
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._notify()
+                ADMISSION_REJECTIONS.inc(reason="deadline")
+                ADMISSION_WAIT.observe(time.perf_counter() - started, outcome="rejected")
+                raise AdmissionRejected("deadline", self._retry_after(tokens))
+        except asyncio.CancelledError:
+            # Cliente desistiu: se a vaga ja tinha sido concedida, devolve
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            else:
+                waiter.future.cancel()
+            raise
+        ADMISSION_WAIT.observe(time.perf_counter() - started, outcome="admitted")
+
+
+def conversation_priority(messages: List[dict]) -> int:
+    """Quanto mais turnos do usuario (mais perto do create_lead), maior a prioridade."""
+    user_turns = sum(1 for m in messages if m.get("role") == "user")
+    return max(1, min(user_turns, PRIORITY_MAX))
+
+
+# Controlador compartilhado pelo processo
+admission = AdmissionController()
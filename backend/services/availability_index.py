@@ -0,0 +1,190 @@
+"""
+Indice local de disponibilidade de horarios, por tipo de evento.
+
+Cada tipo de evento guarda os horarios livres numa lista ordenada pelo inicio
+(epoch em segundos), entao "proximos N horarios livres depois de T" e um bisect
+(O(log n)) + um slice. Reservas e sincronizacoes passam pelo mesmo lock, entao
+um horario reservado sai do indice de forma atomica e este processo nao o oferece de novo.
+
+O indice e por processo: com varios workers (serve.py), cada um so sabe das reservas
+que passaram por ele, e dois workers podem oferecer o mesmo horario. Ele serve para
+estreitar as ofertas sem ir ao Calendly; quem garante que um horario nao e agendado
+duas vezes e o livro de reservas no SQLite (services/booking.py), compartilhado por
+todos os workers: o segundo pedido recebe 409.
+
+Opcionalmente o indice e salvo em JSON (AVAILABILITY_INDEX_PATH) para sobreviver a restart.
+"""
+
+import asyncio
+import json
+import os
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Tuple
+
+from services.metrics import Counter, Gauge
+from services.observability import get_logger
+
+AVAILABILITY_INDEX_PATH = os.getenv("AVAILABILITY_INDEX_PATH", "")
+
+AVAILABILITY_FREE_SLOTS = Gauge(
+    "sdr_availability_free_slots",
+    "Horarios livres no indice local, por tipo de evento",
+    ["event_type"],
+)
+AVAILABILITY_RESERVATIONS = Counter(
+    "sdr_availability_reservations_total",
+    "Tentativas de reserva no indice: ok ou conflict (horario ja tomado)",
+    ["result"],
+)
+
+log = get_logger("availability_index")
+
+# (inicio, fim, url de agendamento)
+Slot = Tuple[float, float, str]
+
+
+@dataclass
+class _EventTypeIndex:
+    """Horarios de um tipo de evento: livres (ordenados) e reservados."""
+
+    starts: List[float] = field(default_factory=list)  # inicios livres, ordenados
+    slots: Dict[float, Slot] = field(default_factory=dict)  # inicio -> slot livre
+    booked: Dict[float, Slot] = field(default_factory=dict)  # inicio -> slot reservado
+    synced_until: float = 0.0  # fim da janela ja sincronizada
+
+
+class AvailabilityIndex:
+    """Indice de horarios livres com consulta por intervalo e reserva atomica."""
+
+    def __init__(self, path: str = AVAILABILITY_INDEX_PATH):
+        self.path = path
+        self._indexes: Dict[str, _EventTypeIndex] = {}
+        self._lock = asyncio.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _index(self, event_type: str) -> _EventTypeIndex:
+        index = self._indexes.get(event_type)
+        if index is None:
+            index = self._indexes[event_type] = _EventTypeIndex()
+        return index
+
+    # --- Consultas ---
+
+    def synced_until(self, event_type: str) -> float:
+        """Ate onde a janela deste tipo de evento ja foi sincronizada (0 = nunca)."""
+        index = self._indexes.get(event_type)
+        return index.synced_until if index else 0.0
+
+    def next_free(self, event_type: str, after: float, limit: int) -> List[Slot]:
+        """Proximos `limit` horarios livres com inicio >= after (bisect + slice)."""
+        index = self._indexes.get(event_type)
+        if index is None:
+            return []
+        position = bisect_left(index.starts, after)
+        return [index.slots[start] for start in index.starts[position:position + limit]]
+
+    # --- Atualizacoes (sempre sob o lock) ---
+
+    async def merge_window(self, event_type: str, window_start: float, window_end: float, slots: Iterable[Slot], now: float):
+        """
+        Substitui os horarios livres de [window_start, window_end) pelos recebidos do upstream
+        (sincronizacao incremental). Horarios ja reservados nunca voltam a ficar livres,
+        e horarios que ja passaram sao descartados.
+        """
+        async with self._lock:
+            index = self._index(event_type)
+            lo = bisect_left(index.starts, window_start)
+            hi = bisect_left(index.starts, window_end)
+            for start in index.starts[lo:hi]:
+                del index.slots[start]
+            fresh = sorted(
+                slot for slot in slots
+                if window_start <= slot[0] < window_end and slot[0] not in index.booked
+            )
+            index.starts[lo:hi] = [slot[0] for slot in fresh]
+            index.slots.update((slot[0], slot) for slot in fresh)
+            self._prune(index, now)
+            index.synced_until = max(index.synced_until, window_end)
+            AVAILABILITY_FREE_SLOTS.set(len(index.starts), event_type=event_type)
+        await self._save()
+
+    async def reserve(self, event_type: str, start: float) -> bool:
+        """Tira o horario do indice (atomico). Retorna False se ele nao estiver livre."""
+        async with self._lock:
+            index = self._index(event_type)
+            if start in index.booked or start not in index.slots:
+                AVAILABILITY_RESERVATIONS.inc(result="conflict")
+                return False
+            position = bisect_left(index.starts, start)
+            del index.starts[position]
+            index.booked[start] = index.slots.pop(start)
+            AVAILABILITY_RESERVATIONS.inc(result="ok")
+            AVAILABILITY_FREE_SLOTS.set(len(index.starts), event_type=event_type)
+        await self._save()
+        return True
+
+    async def release(self, event_type: str, start: float):
+        """Devolve um horario reservado (ex: o agendamento falhou depois da reserva)."""
+        async with self._lock:
+            index = self._index(event_type)
+            slot = index.booked.pop(start, None)
+            if slot is not None:
+                insort(index.starts, start)
+                index.slots[start] = slot
+            AVAILABILITY_FREE_SLOTS.set(len(index.starts), event_type=event_type)
+        await self._save()
+
+    @staticmethod
+    def _prune(index: _EventTypeIndex, now: float):
+        position = bisect_left(index.starts, now)
+        for start in index.starts[:position]:
+            del index.slots[start]
+        del index.starts[:position]
+        index.booked = {start: slot for start, slot in index.booked.items() if start >= now}
+
+    # --- Persistencia opcional em JSON ---
+
+    def _snapshot(self) -> dict:
+        return {
+            event_type: {
+                "synced_until": index.synced_until,
+                "free": [list(index.slots[start]) for start in index.starts],
+                "booked": [list(index.booked[start]) for start in sorted(index.booked)],
+            }
+            for event_type, index in self._indexes.items()
+        }
+
+    async def _save(self):
+        if not self.path:
+            return
+        snapshot = self._snapshot()
+
+        def write():
+            # Grava num arquivo temporario e troca, para nunca deixar um JSON pela metade
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+
+        await asyncio.to_thread(write)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Não foi possível carregar o índice de disponibilidade, começando vazio", extra={"path": self.path, "error": str(e)})
+            return
+        for event_type, stored in data.items():
+            index = self._index(event_type)
+            index.synced_until = stored.get("synced_until", 0.0)
+            index.booked = {start: (start, end, url) for start, end, url in stored.get("booked", [])}
+            for start, end, url in stored.get("free", []):
+                index.slots[start] = (start, end, url)
+            index.starts = sorted(index.slots)
+
+
+# Indice compartilhado pelo processo
+availability_index = AvailabilityIndex()
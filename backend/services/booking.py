@@ -0,0 +1,314 @@
+"""
+Agendamentos idempotentes: o mesmo pedido de /schedule nunca agenda duas vezes.
+
+- Chave de idempotencia: header Idempotency-Key ou, sem ele, derivada do e-mail do lead
+  + horario (cobre o duplo clique). A resposta de um agendamento concluido fica guardada
+  (LRU em memoria + SQLite): a repeticao devolve o mesmo JSON, sem chamar Calendly nem
+  Pipefy de novo. Pedidos repetidos que chegam enquanto o primeiro ainda esta rodando
+  esperam por ele e recebem o mesmo resultado.
+- Lock por horario: dentro do processo, um asyncio.Lock por inicio de horario; entre
+  workers, o livro de reservas no SQLite (BEGIN IMMEDIATE), que e a fonte da verdade.
+  Se a mesma chave ja esta "held" em outro worker, este espera a resposta dele aparecer
+  no SQLite (ou o "held" vencer/ser solto) em vez de agendar de novo; passado o prazo,
+  levanta BookingInProgress.
+- Livro de reservas: cada horario fica "held" (agendamento em andamento, com prazo para
+  o caso do worker morrer no meio) ou "booked" (agendado), com quem pediu.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from services.metrics import Counter
+from services.observability import get_logger
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+BOOKING_DB_PATH = os.getenv("BOOKING_DB_PATH", "bookings.db")
+# Prazo de um "held": se o agendamento nao terminar ate la, o horario volta a ficar livre
+BOOKING_HOLD_SECONDS = float(os.getenv("BOOKING_HOLD_SECONDS", "60"))
+BOOKING_IDEMPOTENCY_TTL_SECONDS = int(os.getenv("BOOKING_IDEMPOTENCY_TTL_SECONDS", str(60 * 60 * 24)))
+BOOKING_IDEMPOTENCY_CACHE_SIZE = int(os.getenv("BOOKING_IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Mesma chave em andamento em outro worker: de quanto em quanto tempo reler o livro
+BOOKING_WAIT_POLL_SECONDS = 0.1
+
+BOOKING_REQUESTS = Counter(
+    "sdr_booking_requests_total",
+    "Pedidos de agendamento: booked, replay_memory, replay_db, coalesced, conflict, in_progress ou failed",
+    ["result"],
+)
+
+log = get_logger("booking")
+
+
+class SlotTaken(Exception):
+    """O horario ja esta reservado ou agendado por outro pedido."""
+
+
+class IdempotencyMismatch(Exception):
+    """A mesma Idempotency-Key chegou com um corpo diferente."""
+
+
+class BookingInProgress(Exception):
+    """A mesma chave esta sendo agendada por outro worker e nao terminou dentro do prazo."""
+
+
+class _HeldElsewhere(Exception):
+    """O horario esta "held" pela mesma chave, em outro processo."""
+
+
+class _BookedByKey(Exception):
+    """O horario ja esta "booked" pela mesma chave (a resposta deve estar no livro)."""
+
+
+def fingerprint(payload: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def derive_key(email: str, start_time: str) -> str:
+    """Chave para pedidos sem Idempotency-Key: mesmo lead + mesmo horario = mesmo agendamento."""
+    return "auto:" + hashlib.sha256(f"{(email or '').strip().lower()}|{start_time}".encode()).hexdigest()[:32]
+
+
+class BookingLedger:
+    """Livro de reservas + respostas idempotentes, num arquivo SQLite compartilhado pelos workers."""
+
+    def __init__(self, path: str = BOOKING_DB_PATH, cache_size: int = BOOKING_IDEMPOTENCY_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        # chave -> (expira em, fingerprint, resposta)
+        self._responses: "OrderedDict[str, tuple]" = OrderedDict()
+        # chave -> (agendamento em andamento neste processo, fingerprint do pedido)
+        self._inflight: Dict[str, tuple] = {}
+        # inicio do horario -> (lock, quantos pedidos usando)
+        self._slot_locks: Dict[float, list] = {}
+
+    # --- Banco ---
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Conexao aberta so no primeiro uso (importar o modulo nao cria o arquivo)
+        if self._connection is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS reservations (
+                    slot_start REAL PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    holder TEXT NOT NULL,
+                    held_until REAL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS idempotent_responses (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                """
+            )
+            self._connection = conn
+        return self._connection
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _hold(self, slot_start: float, holder: str) -> str:
+        """
+        Marca o horario como "held" para holder, se estiver livre (ou com "held" vencido).
+        Retorna "acquired", "in_progress" (a mesma chave ja esta "held", ou seja, o pedido
+        esta rodando em outro processo), "booked_by_holder" ou "taken". Um "booked" nunca
+        volta a "held": nem para o mesmo holder, cuja resposta guardada pode ter expirado.
+        """
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT status, holder, held_until FROM reservations WHERE slot_start = ?", (slot_start,)
+            ).fetchone()
+            if row is not None:
+                status, current_holder, held_until = row
+                expired = status == "held" and (held_until or 0) < now
+                if not expired:
+                    self._conn.execute("COMMIT")
+                    if current_holder != holder:
+                        return "taken"
+                    return "in_progress" if status == "held" else "booked_by_holder"
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reservations (slot_start, status, holder, held_until, updated_at) VALUES (?, 'held', ?, ?, ?)",
+                (slot_start, holder, now + BOOKING_HOLD_SECONDS, now),
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return "acquired"
+
+    def _release(self, slot_start: float, holder: str):
+        self._conn.execute("DELETE FROM reservations WHERE slot_start = ? AND holder = ? AND status = 'held'", (slot_start, holder))
+
+    def _complete(self, slot_start: float, holder: str, key_fingerprint: str, response: Dict[str, Any]):
+        """Marca o horario como agendado e guarda a resposta, na mesma transacao."""
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "UPDATE reservations SET status = 'booked', held_until = NULL, updated_at = ? WHERE slot_start = ? AND holder = ?",
+                (now, slot_start, holder),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotent_responses (key, fingerprint, response, expires_at) VALUES (?, ?, ?, ?)",
+                (holder, key_fingerprint, json.dumps(response, ensure_ascii=False), now + BOOKING_IDEMPOTENCY_TTL_SECONDS),
+            )
+            self._conn.execute("DELETE FROM reservations WHERE slot_start < ?", (now - 86400,))
+            self._conn.execute("DELETE FROM idempotent_responses WHERE expires_at <= ?", (now,))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _stored_response(self, key: str) -> Optional[tuple]:
+        row = self._conn.execute(
+            "SELECT fingerprint, response, expires_at FROM idempotent_responses WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return (row[2], row[0], json.loads(row[1])) if row else None
+
+    def close(self):
+        """Fecha a conexao (checkpoint do WAL); a proxima operacao reabre."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    # --- Cache de respostas em memoria ---
+
+    def _remember(self, key: str, entry: tuple):
+        self._responses[key] = entry
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.cache_size:
+            self._responses.popitem(last=False)
+
+    def _cached(self, key: str, key_fingerprint: str) -> Optional[Dict[str, Any]]:
+        entry = self._responses.get(key)
+        if entry is None:
+            return None
+        expires_at, stored_fingerprint, response = entry
+        if expires_at <= time.time():
+            del self._responses[key]
+            return None
+        if stored_fingerprint != key_fingerprint:
+            raise IdempotencyMismatch(key)
+        return response
+
+    # --- API publica ---
+
+    async def book_once(
+        self,
+        key: str,
+        key_fingerprint: str,
+        slot_start: float,
+        action: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> tuple:
+        """
+        Executa action() (o agendamento de fato) no maximo uma vez por chave.
+        Retorna (resposta, replayed). Levanta SlotTaken se o horario for de outro pedido,
+        IdempotencyMismatch se a chave ja foi usada com outro corpo e BookingInProgress se
+        o mesmo pedido continua rodando em outro worker depois de BOOKING_HOLD_SECONDS.
+        """
+        # 1. Ja concluido: memoria (microssegundos) ou SQLite (outro worker, restart)
+        cached = self._cached(key, key_fingerprint)
+        if cached is not None:
+            BOOKING_REQUESTS.inc(result="replay_memory")
+            return cached, True
+
+        # 2. Mesmo pedido rodando neste processo: espera o resultado dele
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[1] != key_fingerprint:
+                raise IdempotencyMismatch(key)
+            BOOKING_REQUESTS.inc(result="coalesced")
+            return await asyncio.shield(inflight[0]), True
+
+        future = asyncio.get_running_loop().create_future()
+        # Sem ninguem esperando, a excecao guardada no future nao gera aviso
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = (future, key_fingerprint)
+        try:
+            deadline = time.monotonic() + BOOKING_HOLD_SECONDS
+            booked_by_key = False
+            while True:
+                stored = await asyncio.to_thread(self._run, self._stored_response, key)
+                if stored is not None:
+                    self._remember(key, stored)
+                    response = self._cached(key, key_fingerprint)
+                    BOOKING_REQUESTS.inc(result="replay_db")
+                    future.set_result(response)
+                    return response, True
+                if booked_by_key:
+                    # Agendado por esta chave, mas a resposta ja expirou: nao agenda de novo
+                    BOOKING_REQUESTS.inc(result="conflict")
+                    raise SlotTaken(slot_start)
+                try:
+                    response = await self._book(key, key_fingerprint, slot_start, action)
+                except _BookedByKey:
+                    # Outro worker concluiu entre a leitura acima e o hold: rele a resposta
+                    booked_by_key = True
+                    continue
+                except _HeldElsewhere:
+                    # 3. Mesmo pedido rodando em outro worker: espera a resposta dele no livro
+                    if time.monotonic() >= deadline:
+                        BOOKING_REQUESTS.inc(result="in_progress")
+                        raise BookingInProgress(key)
+                    await asyncio.sleep(BOOKING_WAIT_POLL_SECONDS)
+                    continue
+                future.set_result(response)
+                return response, False
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _book(self, key: str, key_fingerprint: str, slot_start: float, action) -> Dict[str, Any]:
+        # 4. Lock do horario neste processo, depois a reserva no livro (vale entre workers)
+        entry = self._slot_locks.setdefault(slot_start, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                outcome = await asyncio.to_thread(self._run, self._hold, slot_start, key)
+                if outcome == "in_progress":
+                    raise _HeldElsewhere(key)
+                if outcome == "booked_by_holder":
+                    raise _BookedByKey(key)
+                if outcome == "taken":
+                    BOOKING_REQUESTS.inc(result="conflict")
+                    raise SlotTaken(slot_start)
+                try:
+                    response = await action()
+                except BaseException:
+                    BOOKING_REQUESTS.inc(result="failed")
+                    await asyncio.to_thread(self._run, self._release, slot_start, key)
+                    raise
+                await asyncio.to_thread(self._run, self._complete, slot_start, key, key_fingerprint, response)
+                self._remember(key, (time.time() + BOOKING_IDEMPOTENCY_TTL_SECONDS, key_fingerprint, response))
+                BOOKING_REQUESTS.inc(result="booked")
+                return response
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._slot_locks.pop(slot_start, None)
+
+
+# Livro compartilhado pelo processo
+booking_ledger = BookingLedger()
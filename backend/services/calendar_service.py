@@ -1,17 +1,63 @@
+import asyncio
 import os
-import requests
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from typing import List, Dict
+import time
+import httpx
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional
 
-# Carrega as variáveis de ambiente do arquivo .env
-load_dotenv()
+from services import http_client
+from services.availability_index import Slot, availability_index
+from services.metadata_cache import MetadataCache
+from services.observability import get_logger, span
+from services.settings import get_settings
 
-CALENDLY_API_KEY = os.getenv("CALENDLY_API_KEY")
-CALENDLY_API_URL = "https://api.calendly.com"
+log = get_logger("calendar_service")
+
+CALENDLY_API_KEY = get_settings().calendly_api_key
+# Sobrescrevivel para apontar para um servidor local (ex: benchmarks/fake_upstreams.py)
+CALENDLY_API_URL = get_settings().calendly_api_url
+
+# Usuario e tipo de evento quase nunca mudam: ficam em cache por CALENDLY_METADATA_TTL_SECONDS
+# e, depois disso, continuam sendo servidos por ate CALENDLY_METADATA_MAX_STALE_SECONDS
+# enquanto sao atualizados em background
+CALENDLY_METADATA_TTL_SECONDS = int(os.getenv("CALENDLY_METADATA_TTL_SECONDS", "3600"))
+CALENDLY_METADATA_MAX_STALE_SECONDS = int(os.getenv("CALENDLY_METADATA_MAX_STALE_SECONDS", "86400"))
+_metadata_cache = MetadataCache("calendly", CALENDLY_METADATA_TTL_SECONDS, CALENDLY_METADATA_MAX_STALE_SECONDS)
+# Respostas que dizem que o que esta em cache deixou de valer (token trocado, usuario removido)
+_STALE_METADATA_STATUS = {401, 404}
+
+# Indice local de disponibilidade: janela sincronizada, intervalo entre sincronizacoes
+# incrementais e a cada quantos ciclos a janela inteira e buscada de novo
+AVAILABILITY_WINDOW_DAYS = int(os.getenv("AVAILABILITY_WINDOW_DAYS", "7"))
+AVAILABILITY_SYNC_INTERVAL_SECONDS = int(os.getenv("AVAILABILITY_SYNC_INTERVAL_SECONDS", "300"))
+AVAILABILITY_FULL_SYNC_EVERY = int(os.getenv("AVAILABILITY_FULL_SYNC_EVERY", "12"))
+AVAILABLE_SLOTS_LIMIT = int(os.getenv("AVAILABLE_SLOTS_LIMIT", "3"))
+CALENDLY_SLOT_MINUTES = 30
+SIMULATED_SLOT_HOURS = (10, 14, 15)
+
+# Garante uma unica sincronizacao sob demanda por vez
+_sync_lock = asyncio.Lock()
 
 # --- Funcoes Auxiliares ----
 
+def _format_time(timestamp: float) -> str:
+    """Epoch (UTC) → string ISO 8601 com Z, o formato que o frontend ja recebe."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _parse_time(value: str) -> Optional[float]:
+    """String ISO 8601 (com Z ou offset) → epoch. Retorna None se for invalida."""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def slot_start(slot_info: dict) -> Optional[float]:
+    """Inicio (epoch) do horario escolhido no /schedule, ou None se vier invalido."""
+    return _parse_time(slot_info.get("start_time"))
+
 def _get_calendly_headers():
     """Retorna os cabeçalhos de autorização para a API do Calendly."""
     return {
@@ -19,73 +65,134 @@ def _get_calendly_headers():
         "Content-Type": "application/json"
     }
 
-def _get_user_url():
+async def _get_user_url():
     """Obtém a URL do usuário atual no Calendly."""
     try:
-        response = requests.get(f"{CALENDLY_API_URL}/users/me", headers=_get_calendly_headers())
-        response.raise_for_status() # Lança um erro se a requisição falhar
+        with span("calendly_user_lookup"):
+            response = await http_client.request("calendly", "GET", f"{CALENDLY_API_URL}/users/me", headers=_get_calendly_headers())
+            response.raise_for_status() # Lança um erro se a requisição falhar
         return response.json()["resource"]["uri"]
-    except requests.exceptions.RequestException as e:
-        print(f"Erro ao obter URL do usuário no Calendly: {e}")
+    except httpx.HTTPError as e:
+        log.error("Erro ao obter URL do usuário no Calendly", extra={"error": str(e)})
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in _STALE_METADATA_STATUS:
+            # Credencial invalida: nada do cache (usuario, tipos de evento) vale mais
+            _metadata_cache.invalidate()
         return None
     
-def _get_event_type_uri(user_uri: str):
+async def _get_event_type_uri(user_uri: str):
     """Obtém o URI do primeiro tipo de evento ativo do usuário."""
     if not user_uri:
         return None
     try:
         # Busca por tipos de evento ativos do usuário, limitando a 1 resultado
         params = {"user": user_uri, "active": "true", "count": 1}
-        response = requests.get(f"{CALENDLY_API_URL}/event_types", headers=_get_calendly_headers(), params=params)
-        response.raise_for_status()    
+        with span("calendly_event_type_lookup"):
+            response = await http_client.request("calendly", "GET", f"{CALENDLY_API_URL}/event_types", headers=_get_calendly_headers(), params=params)
+            response.raise_for_status()
         event_types = response.json()["collection"]
         if event_types:
             return event_types[0]["uri"]
         else:
-            print("Nenhum tipo de evento ativo encontrado no Calendly.")
+            log.warning("Nenhum tipo de evento ativo encontrado no Calendly.")
             return None
-    except requests.exceptions.RequestException as e:
-        print(f"Erro ao obter tipos de evento no Calendly: {e}")
+    except httpx.HTTPError as e:
+        log.error("Erro ao obter tipos de evento no Calendly", extra={"error": str(e)})
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in _STALE_METADATA_STATUS:
+            # O usuario em cache nao existe mais (ou o token mudou): nao servir o velho por MAX_STALE
+            _metadata_cache.invalidate("user_uri")
+            _metadata_cache.invalidate(f"event_type:{user_uri}")
         return None
     
+async def _get_cached_event_type_uri():
+    """URI do tipo de evento, via cache (zero chamadas ao Calendly quando ja esta em cache)."""
+    user_uri = await _metadata_cache.get("user_uri", _get_user_url)
+    if not user_uri:
+        return None
+    return await _metadata_cache.get(f"event_type:{user_uri}", lambda: _get_event_type_uri(user_uri))
+
 # --- Funcoes Principais do Servico ---
 
-def get_available_slots() -> List:
+async def _fetch_availability(event_type_uri: str, start: float, end: float) -> List[Slot]:
     """
-    Busca horários disponíveis no Calendly para os proximos 7 dias.
+    Busca no "upstream" os horarios livres de [start, end) para o tipo de evento.
     """
-    print("Buscando horários disponíveis no Calendly...")
-    user_uri = _get_user_url()
-    event_type_uri = _get_event_type_uri(user_uri)
-
-    if not event_type_uri:
-        return {"error": "Não foi possível obter o tipo de evento no Calendly."}
-    
-    # Definir o intervalo de tempo: de agora ate 7 dias no futuro
-    start_time = datetime.utcnow().isoformat() + "Z"
-    end_time = (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z"
-    
     # NOTA IMPORTANTE SOBRE A API DO CALENDLY:
     # A API gratuita do Calendly ao qual estou usando, NAO permite buscar horarios disponiveis diretamente.
     # Vou SIMULAR a busca de horarios por enquanto.
     
-    # SIMULAÇÃO:
-    print("Simulando busca de horarios (API do Calendly tem limitacoes no plano gratuito)...")
-    mock_slots = [
-        {"start_time": (datetime.utcnow() + timedelta(days=1, hours=14)).isoformat() + "Z", "schedulable_url": f"{CALENDLY_API_URL}/scheduled_links/simulado1"},
-        {"start_time": (datetime.utcnow() + timedelta(days=1, hours=15)).isoformat() + "Z", "schedulable_url": f"{CALENDLY_API_URL}/scheduled_links/simulado2"},
-        {"start_time": (datetime.utcnow() + timedelta(days=2, hours=10)).isoformat() + "Z", "schedulable_url": f"{CALENDLY_API_URL}/scheduled_links/simulado3"}
-    ]
+    # SIMULAÇÃO: horarios fixos (SIMULATED_SLOT_HOURS, em UTC) em todos os dias da janela.
+    # Precisa ser deterministico para a sincronizacao incremental nao "mexer" em horarios ja indexados.
+    slots: List[Slot] = []
+    day = datetime.fromtimestamp(start, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    while day.timestamp() < end:
+        for hour in SIMULATED_SLOT_HOURS:
+            slot_start = day.replace(hour=hour).timestamp()
+            if start <= slot_start < end:
+                url = f"{CALENDLY_API_URL}/scheduled_links/simulado-{int(slot_start)}"
+                slots.append((slot_start, slot_start + CALENDLY_SLOT_MINUTES * 60, url))
+        day += timedelta(days=1)
     
     # Em um cenário real, chamaria um endpoint como:
-    # params = {"event_type": event_type_uri, "start_time": start_time, "end_time": end_time}
-    # response = requests.get(f"{CALENDLY_API_URL}/user_availability_schedules?user={user_uri}", headers=_get_calendly_headers(), params=params)
-    # slots = response.json().get("collection", [])
-    
-    print(f"Horários simulados encontrados: {len(mock_slots)}")
-    return mock_slots
+    # params = {"event_type": event_type_uri, "start_time": _format_time(start), "end_time": _format_time(end)}
+    # response = await http_client.request("calendly", "GET", f"{CALENDLY_API_URL}/event_type_available_times", headers=_get_calendly_headers(), params=params)
+    # slots = [... for item in response.json().get("collection", [])]
+    return slots
+
+async def sync_availability(full: bool = False) -> bool:
+    """
+    Sincroniza o indice local com o Calendly.
+    Incremental: so busca a parte da janela de AVAILABILITY_WINDOW_DAYS que ainda nao foi
+    sincronizada (os dias novos). Com full=True busca a janela inteira de novo.
+    """
+    event_type_uri = await _get_cached_event_type_uri()
+    if not event_type_uri:
+        return False
+
+    now = time.time()
+    horizon = now + AVAILABILITY_WINDOW_DAYS * 86400
+    window_start = now if full else max(now, availability_index.synced_until(event_type_uri))
+    if window_start < horizon:
+        with span("calendly_availability_sync"):
+            slots = await _fetch_availability(event_type_uri, window_start, horizon)
+            await availability_index.merge_window(event_type_uri, window_start, horizon, slots, now)
+        log.info("Índice de disponibilidade sincronizado", extra={"mode": "full" if full else "incremental", "slots": len(slots)})
+    return True
+
+async def run_availability_sync_loop():
+    """Loop de background (iniciado no lifespan da API) que mantem o indice atualizado."""
+    cycle = 0
+    while True:
+        try:
+            await sync_availability(full=cycle % AVAILABILITY_FULL_SYNC_EVERY == 0)
+        except Exception as e:
+            log.error("Erro ao sincronizar disponibilidade do Calendly", extra={"error": str(e)})
+        cycle += 1
+        await asyncio.sleep(AVAILABILITY_SYNC_INTERVAL_SECONDS)
 
-def create_meeting(slot_info: dict, lead_data: dict) -> dict:
+async def get_available_slots() -> List:
+    """
+    Retorna os proximos horarios livres, servidos do indice local de disponibilidade.
+    So vai ao Calendly se o indice ainda nao cobre a janela (ex: logo depois de subir).
+    """
+    with span("calendly_slots") as stage:
+        event_type_uri = await _get_cached_event_type_uri()
+
+        if not event_type_uri:
+            stage.fail()
+            return {"error": "Não foi possível obter o tipo de evento no Calendly."}
+
+        now = time.time()
+        if availability_index.synced_until(event_type_uri) < now + 86400:
+            # Indice vazio ou quase vencido: sincroniza agora (uma vez so, mesmo com varias requisicoes)
+            async with _sync_lock:
+                if availability_index.synced_until(event_type_uri) < now + 86400:
+                    await sync_availability()
+
+        free_slots = availability_index.next_free(event_type_uri, now, AVAILABLE_SLOTS_LIMIT)
+    log.debug("Horários livres servidos do índice local", extra={"slots": len(free_slots)})
+    return [{"start_time": _format_time(start), "schedulable_url": url} for start, _, url in free_slots]
+
+async def create_meeting(slot_info: dict, lead_data: dict) -> dict:
     """
     Agenda uma reunião usando a API do Calendly.
     Requer nome e e-mail do lead.
@@ -99,9 +206,20 @@ def create_meeting(slot_info: dict, lead_data: dict) -> dict:
     # Em um cenário real, usariamos a informacao do slot escolhido e os dados do lead para chamar o endpoint
     scheduling_url = slot_info.get("schedulable_url") # assumimos que o slot tem 
     start_time_str = slot_info.get("start_time")
+    start_timestamp = _parse_time(start_time_str)
+    if start_timestamp is None:
+        return {"error": "Horário inválido."}
+    
+    # Reserva o horario no indice local ANTES de agendar: a reserva e atomica, entao
+    # dois leads nunca levam o mesmo horario (o segundo recebe o erro de conflito)
+    with span("calendly_create_meeting") as stage:
+        event_type_uri = await _get_cached_event_type_uri()
+        if event_type_uri and not await availability_index.reserve(event_type_uri, start_timestamp):
+            stage.fail()
+            return {"error": "Este horário não está mais disponível.", "slot_unavailable": True}
     
     # SIMULAÇÃO:
-    print(f"Simulando agendamento para {name} ({email}) no horário {start_time_str}...")
+    log.info("Simulando agendamento no Calendly", extra={"email": email, "start_time": start_time_str})
     mock_meeting_link = f"https://calendly.com/seu-usuario/reuniao-agendada-{os.urandom(4).hex()}"
     mock_confirmation = {
         "event_uri": f"calendly:event:simulado_{os.urandom(4).hex()}",  # ID ficticio do evento
@@ -110,15 +228,22 @@ def create_meeting(slot_info: dict, lead_data: dict) -> dict:
     }
     
     # A chamada real seria algo como:
-    # event_type_uri_real = _get_event_type_uri(_get_user_uri())
+    # (event_type_uri ja vem do cache, acima)
     # payload = {
     #     "scheduling_link": scheduling_url, # Ou o ID do slot
     #     "invitee_email": email,
     #     "invitee_name": name,
     #     "start_time": start_time_str
     # }
-    # response = requests.post(f"{CALENDLY_API_URL}/scheduled_events", headers=_get_calendly_headers(), json=payload)
+    # response = await http_client.request("calendly", "POST", f"{CALENDLY_API_URL}/scheduled_events", headers=_get_calendly_headers(), json=payload)
     # confirmation_data = response.json().get("resource", {})
     
-    print(f"Agendamento simulado criado. Link da reunião: {mock_meeting_link}")
-    return mock_confirmation
\ No newline at end of file
+    log.info("Agendamento simulado criado", extra={"meeting_link": mock_meeting_link})
+    return mock_confirmation
+
+async def release_meeting_slot(slot_info: dict):
+    """Devolve ao indice o horario reservado por create_meeting (o resto do agendamento falhou)."""
+    start_timestamp = _parse_time(slot_info.get("start_time"))
+    event_type_uri = await _get_cached_event_type_uri()
+    if start_timestamp is not None and event_type_uri:
+        await availability_index.release(event_type_uri, start_timestamp)
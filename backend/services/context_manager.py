@@ -0,0 +1,257 @@
+"""
+Controle do tamanho do contexto enviado a OpenAI.
+Antes de cada chamada, o historico e medido em tokens (tokenizer local) e,
+se passar do orcamento, os turnos mais antigos sao trocados por um resumo.
+
+O resumo e "rolante" e fica em cache: cada resumo cobre um prefixo do historico
+(identificado por um hash encadeado das mensagens) e o proximo e calculado a partir
+dele + as mensagens novas, nunca do zero. O calculo roda em background: enquanto o
+resumo novo nao fica pronto, a requisicao vai com o resumo antigo (se houver) + todos os
+turnos ainda nao resumidos, num orcamento mais folgado (HISTORY_OVERFLOW_RATIO). So se
+nem assim couber ela espera o resumo (ate SUMMARY_WAIT_SECONDS); turnos so sao descartados
+sem resumo como ultimo recurso (e contados em sdr_context_turns_dropped_total).
+"""
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.metrics import Counter
+from services.observability import get_logger
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# Ao resumir, o historico "vivo" volta para esta fracao do orcamento; assim o mesmo
+# resumo serve para varios turnos seguintes antes de precisar de outro
+HISTORY_KEEP_RATIO = float(os.getenv("HISTORY_KEEP_RATIO", "0.6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+# Sem resumo atualizado, o historico pode ir ate esta fracao do orcamento (resumo antigo + turnos nao resumidos)
+HISTORY_OVERFLOW_RATIO = float(os.getenv("HISTORY_OVERFLOW_RATIO", "2.0"))
+# Quanto a requisicao espera o resumo quando nem o orcamento folgado comporta o historico
+SUMMARY_WAIT_SECONDS = float(os.getenv("SUMMARY_WAIT_SECONDS", "5"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "5000"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+# Tokens extras que a API cobra por mensagem (papel, separadores)
+TOKENS_PER_MESSAGE = 4
+
+CONTEXT_TOKENS = Counter(
+    "sdr_context_tokens_total",
+    "Tokens de historico por requisicao: 'original' (sem corte) e 'sent' (enviado)",
+    ["kind"],
+)
+CONTEXT_TOKENS_SAVED = Counter(
+    "sdr_context_tokens_saved_total",
+    "Tokens de historico que deixaram de ser enviados gracas ao corte/resumo",
+)
+CONTEXT_TURNS_DROPPED = Counter(
+    "sdr_context_turns_dropped_total",
+    "Mensagens cortadas sem estar no resumo (resumo nao ficou pronto a tempo)",
+)
+SUMMARY_UPDATES = Counter(
+    "sdr_context_summary_updates_total",
+    "Resumos rolantes calculados, por resultado",
+    ["result"],
+)
+
+log = get_logger("context_manager")
+
+
+# --- Tokenizer ---
+# tiktoken e opcional: sem ele (ou sem acesso ao arquivo de encoding) usamos
+# uma estimativa de ~4 caracteres por token, suficiente para o orcamento.
+# Carregado no primeiro uso (ou pelo aquecimento do lifespan), nao no import:
+# get_encoding pode baixar o arquivo do encoding no primeiro boot.
+@lru_cache(maxsize=1)
+def load_tokenizer():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception:  # ImportError ou falha ao baixar o encoding
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Quantidade de tokens de um texto (com cache, pois o historico se repete a cada turno)."""
+    encoding = load_tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(1, (len(text) + 3) // 4)
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Tokens de uma lista de mensagens no formato da API de chat."""
+    return sum(count_tokens(m.get("content") or "") + TOKENS_PER_MESSAGE for m in messages)
+
+
+def _prefix_hashes(history: List[Dict[str, str]]) -> List[str]:
+    """hashes[i] identifica o prefixo history[:i] (hash encadeado, O(n))."""
+    hashes = [hashlib.sha1(b"").hexdigest()]
+    for message in history:
+        digest = hashlib.sha1()
+        digest.update(hashes[-1].encode())
+        digest.update(message.get("role", "").encode())
+        digest.update(b"\0")
+        digest.update((message.get("content") or "").encode())
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+@dataclass
+class ContextResult:
+    """Resultado do corte: mensagens para enviar (sem o system prompt) e a contabilidade de tokens."""
+
+    messages: List[Dict[str, str]]
+    original_tokens: int
+    sent_tokens: int
+    folded_messages: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.sent_tokens)
+
+
+# Recebe (resumo anterior ou None, mensagens novas a incorporar) e devolve o novo resumo
+Summarizer = Callable[[Optional[str], List[Dict[str, str]]], Awaitable[str]]
+
+
+class ContextManager:
+    """Aplica o orcamento de tokens e mantem o cache de resumos rolantes."""
+
+    def __init__(
+        self,
+        summarizer: Summarizer,
+        budget: int = HISTORY_TOKEN_BUDGET,
+        keep_ratio: float = HISTORY_KEEP_RATIO,
+        cache_size: int = SUMMARY_CACHE_SIZE,
+        overflow_ratio: float = HISTORY_OVERFLOW_RATIO,
+        summary_wait: float = SUMMARY_WAIT_SECONDS,
+    ):
+        self.summarizer = summarizer
+        self.budget = budget
+        self.keep_ratio = keep_ratio
+        self.overflow_ratio = overflow_ratio
+        self.summary_wait = summary_wait
+        self.cache_size = cache_size
+        # hash do prefixo -> (quantidade de mensagens cobertas, texto do resumo)
+        self._summaries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        # Resumos sendo calculados agora (por hash do prefixo alvo), para nao duplicar trabalho
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def _cached_summary(self, hashes: List[str], upto: int) -> Tuple[int, Optional[str]]:
+        """Maior prefixo ja resumido com ate `upto` mensagens: (tamanho, resumo)."""
+        for size in range(upto, 0, -1):
+            entry = self._summaries.get(hashes[size])
+            if entry is not None:
+                self._summaries.move_to_end(hashes[size])
+                return size, entry[1]
+        return 0, None
+
+    def _store_summary(self, prefix_hash: str, size: int, summary: str):
+        self._summaries[prefix_hash] = (size, summary)
+        self._summaries.move_to_end(prefix_hash)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    def _split_point(self, message_tokens: List[int], target: int) -> int:
+        """Indice a partir do qual as mensagens mais recentes cabem em `target` tokens (sempre mantem a ultima)."""
+        kept = 0
+        index = len(message_tokens)
+        while index > 0 and kept + message_tokens[index - 1] <= target:
+            kept += message_tokens[index - 1]
+            index -= 1
+        return min(index, len(message_tokens) - 1)
+
+    def _schedule_fold(
+        self, history: List[Dict[str, str]], hashes: List[str], base_size: int, base_summary: Optional[str], target_size: int
+    ) -> Optional[asyncio.Task]:
+        """
+        Dispara em background o resumo de history[:target_size] a partir do resumo de history[:base_size].
+        Retorna a task (nova ou a que ja estava calculando esse prefixo); None se ele ja esta em cache.
+        """
+        target_hash = hashes[target_size]
+        if target_hash in self._summaries:
+            return None
+        if target_hash in self._pending:
+            return self._pending[target_hash]
+        new_messages = history[base_size:target_size]
+
+        async def fold():
+            try:
+                summary = await self.summarizer(base_summary, new_messages)
+                self._store_summary(target_hash, target_size, summary)
+                SUMMARY_UPDATES.inc(result="ok")
+            except Exception as e:
+                log.error("Erro ao atualizar o resumo da conversa", extra={"error": str(e)})
+                SUMMARY_UPDATES.inc(result="error")
+            finally:
+                self._pending.pop(target_hash, None)
+
+        task = self._pending[target_hash] = asyncio.create_task(fold())
+        return task
+
+    async def drain(self, timeout: float):
+        """Espera os resumos em andamento (chamadas ao LLM) terminarem, por ate timeout segundos."""
+        pending = list(self._pending.values())
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+    async def prepare(self, history: List[Dict[str, str]]) -> ContextResult:
+        """Corta o historico para caber no orcamento, usando o resumo em cache no lugar dos turnos antigos."""
+        message_tokens = [count_tokens(m.get("content") or "") + TOKENS_PER_MESSAGE for m in history]
+        original_tokens = sum(message_tokens)
+        if original_tokens <= self.budget or len(history) < 2:
+            result = ContextResult(list(history), original_tokens, original_tokens)
+            self._record(result)
+            return result
+
+        hashes = _prefix_hashes(history)
+        budget_for_history = max(0, self.budget - SUMMARY_MAX_TOKENS)
+
+        # 1. Ja existe um resumo cujo "resto" do historico ainda cabe no orcamento? Usa ele.
+        max_fold = self._split_point(message_tokens, budget_for_history)
+        summary_size, summary = self._cached_summary(hashes, len(history) - 1)
+        if summary is None or summary_size < max_fold:
+            # 2. Nao: agenda um resumo novo (incremental a partir do maior resumo existente),
+            # dobrando ate o historico vivo voltar para keep_ratio do orcamento
+            target_size = max(max_fold, self._split_point(message_tokens, int(budget_for_history * self.keep_ratio)))
+            task = self._schedule_fold(history, hashes, summary_size, summary, target_size)
+            # Enquanto isso, esta requisicao usa o que tem: resumo antigo (se houver) + todos os
+            # turnos depois dele, com o orcamento folgado. Nenhum turno fica de fora do contexto
+            loose_fold = self._split_point(message_tokens, int(budget_for_history * self.overflow_ratio))
+            if summary_size < loose_fold and task is not None:
+                # Nem assim cabe: espera o resumo (a task segue em background se o prazo vencer)
+                await asyncio.wait({task}, timeout=self.summary_wait)
+                summary_size, summary = self._cached_summary(hashes, len(history) - 1)
+            if summary_size < loose_fold:
+                # Ultimo recurso: o resumo nao veio a tempo (ou falhou) e os turnos mais antigos saem
+                CONTEXT_TURNS_DROPPED.inc(loose_fold - summary_size)
+                log.warning("Turnos cortados sem resumo", extra={"dropped_messages": loose_fold - summary_size})
+                summary_size = loose_fold
+
+        messages: List[Dict[str, str]] = []
+        if summary:
+            messages.append({"role": "system", "content": f"Resumo da conversa até aqui: {summary}"})
+        messages.extend(history[summary_size:])
+
+        result = ContextResult(messages, original_tokens, count_message_tokens(messages), folded_messages=summary_size)
+        self._record(result)
+        return result
+
+    def _record(self, result: ContextResult):
+        CONTEXT_TOKENS.inc(result.original_tokens, kind="original")
+        CONTEXT_TOKENS.inc(result.sent_tokens, kind="sent")
+        if result.tokens_saved:
+            CONTEXT_TOKENS_SAVED.inc(result.tokens_saved)
+            log.info("Historico resumido para caber no orcamento", extra={
+                "original_tokens": result.original_tokens,
+                "sent_tokens": result.sent_tokens,
+                "folded_messages": result.folded_messages,
+                "tokens_saved": result.tokens_saved,
+            })
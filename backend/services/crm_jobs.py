@@ -0,0 +1,84 @@
+"""
+Jobs de escrita no CRM (Pipefy), executados pela fila em background.
+Os endpoints so enfileiram; quem fala com o Pipefy sao os handlers abaixo.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from services.job_queue import JobNotReady, PermanentJobError, job_queue
+from services.pipefy_service import create_pipefy_card, update_pipefy_card_meeting_info
+
+CREATE_CARD = "pipefy.create_card"
+UPDATE_MEETING = "pipefy.update_meeting"
+
+
+class CardNotReady(JobNotReady):
+    """O card ainda nao foi criado (o job de criacao nao terminou): espera sem gastar tentativa."""
+
+
+def _fingerprint(data: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:32]
+
+
+# --- Handlers ---
+
+async def _handle_create_card(payload: Dict[str, Any]) -> Dict[str, Any]:
+    card_info = await create_pipefy_card(payload["lead_data"])
+    # createCard nao e idempotente: se o card pode ter sido criado, repetir duplicaria o lead.
+    # O job vai para a dead letter; conferido no Pipefy, enfileirar de novo o revive.
+    if card_info.get("ambiguous"):
+        raise PermanentJobError(f"Resultado incerto da criação do card (conferir no Pipefy): {card_info['error']}")
+    if "error" in card_info:
+        raise RuntimeError(f"Pipefy recusou a criação do card: {card_info['error']}")
+    return card_info
+
+async def _resolve_card_id(payload: Dict[str, Any]) -> str:
+    """O update pode vir com o card_id direto ou com o job que esta criando o card."""
+    if payload.get("card_id"):
+        return payload["card_id"]
+    create_job = await job_queue.get_job(payload["card_job_id"])
+    if create_job is None:
+        raise PermanentJobError(f"Job de criação {payload['card_job_id']} não existe")
+    if create_job["status"] == "dead":
+        raise PermanentJobError(f"Job de criação {payload['card_job_id']} falhou definitivamente")
+    if create_job["status"] != "succeeded":
+        raise CardNotReady(f"Card do job {payload['card_job_id']} ainda não foi criado")
+    return create_job["result"]["id"]
+
+async def _handle_update_meeting(payload: Dict[str, Any]) -> Dict[str, Any]:
+    card_id = await _resolve_card_id(payload)
+    success = await update_pipefy_card_meeting_info(
+        card_id=card_id,
+        meeting_link=payload["meeting_link"],
+        meeting_datetime=payload["meeting_datetime"]
+    )
+    if not success:
+        raise RuntimeError(f"Falha ao atualizar o card {card_id} no Pipefy")
+    return {"card_id": card_id}
+
+job_queue.register_handler(CREATE_CARD, _handle_create_card)
+job_queue.register_handler(UPDATE_MEETING, _handle_update_meeting)
+
+
+# --- Enfileiramento (usado pelos endpoints) ---
+
+async def enqueue_create_card(lead_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Enfileira a criacao do card. O mesmo lead (mesmos dados) nunca gera dois cards; se a
+    criacao anterior morreu (dead), ela volta para a fila.
+    """
+    key = f"{CREATE_CARD}:{_fingerprint(lead_data)}"
+    return await job_queue.enqueue(CREATE_CARD, {"lead_data": lead_data}, idempotency_key=key)
+
+async def enqueue_meeting_update(meeting_link: str, meeting_datetime: str, card_id: Optional[str] = None, card_job_id: Optional[str] = None) -> Dict[str, Any]:
+    """Enfileira a atualizacao do card com os dados da reuniao (por card_id ou pelo job de criacao)."""
+    payload = {
+        "card_id": card_id,
+        "card_job_id": card_job_id,
+        "meeting_link": meeting_link,
+        "meeting_datetime": meeting_datetime,
+    }
+    key = f"{UPDATE_MEETING}:{card_id or card_job_id}:{meeting_datetime}"
+    return await job_queue.enqueue(UPDATE_MEETING, payload, idempotency_key=key)
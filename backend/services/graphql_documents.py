@@ -0,0 +1,122 @@
+"""
+Registro de documentos GraphQL pre-compilados.
+
+Cada mutation e registrada uma vez (nome, tipo do input e selecao) e os valores
+vao sempre em "variables", nunca no texto da query. Assim:
+
+- o texto do documento e o mesmo em toda chamada (o servidor pode cachear o parse/validacao);
+- aspas, quebras de linha etc. nos dados do lead nao quebram a query;
+- cada documento tem um hash sha256 estavel, usado como ID de persisted query
+  (protocolo APQ: manda so o hash + variables e, se o servidor nao conhecer, reenvia com o texto).
+
+Documentos de lote (varias mutations com alias m0, m1, ...) tambem sao montados uma
+unica vez por combinacao de tipos e ficam em cache (quem monta o lote agrupa os itens por
+tipo, entao cada quantidade por tipo gera um documento so), ja com o trecho do corpo JSON que
+carrega o texto (ou o hash) serializado. Os inputs seguem a mesma ideia (InputTemplate):
+a parte fixa (IDs do pipe, da fase e dos campos) e serializada uma vez, e por chamada
+so os valores do lead sao codificados.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from json.encoder import encode_basestring
+from typing import Any, Dict, Sequence, Tuple
+
+# Marcador dos valores variaveis num InputTemplate (serializado como "\u0000")
+SLOT = "\x00"
+_SLOT_JSON = json.dumps(SLOT)
+
+
+@dataclass(frozen=True)
+class CompiledDocument:
+    """Texto final de um documento GraphQL e seu hash (ID de persisted query)."""
+    text: str
+    sha256: str
+
+    def persisted_extension(self) -> dict:
+        """Bloco "extensions" do protocolo de persisted queries (APQ)."""
+        return {"persistedQuery": {"version": 1, "sha256Hash": self.sha256}}
+
+    @cached_property
+    def _query_prefix(self) -> str:
+        return '{"query":' + json.dumps(self.text, ensure_ascii=False) + ',"variables":{'
+
+    @cached_property
+    def _persisted_prefix(self) -> str:
+        return '{"extensions":' + json.dumps(self.persisted_extension(), separators=(",", ":")) + ',"variables":{'
+
+    def request_body(self, inputs: Sequence[str], persisted: bool = False) -> bytes:
+        """
+        Corpo JSON da requisicao, com os inputs ja serializados em m0, m1, ... O trecho do
+        documento (texto ou hash) vem pronto do cache; aqui so se juntam os pedacos.
+        """
+        prefix = self._persisted_prefix if persisted else self._query_prefix
+        variables = ",".join(f'"m{i}":{encoded}' for i, encoded in enumerate(inputs))
+        return f"{prefix}{variables}}}}}".encode("utf-8")
+
+
+@dataclass(frozen=True)
+class MutationSpec:
+    """Uma mutation registrada: campo raiz, tipo do argumento input e a selecao de retorno."""
+    field: str
+    input_type: str
+    selection: str
+
+    def aliased(self, alias: str, variable: str) -> str:
+        """Campo da mutation com alias, lendo o input da variavel indicada."""
+        return f"{alias}: {self.field}(input: ${variable}) {{ {self.selection} }}"
+
+
+class InputTemplate:
+    """
+    Input de mutation com a parte fixa ja serializada. O esqueleto usa SLOT onde entram os
+    valores de cada chamada; render() codifica so esses valores e junta com os pedacos fixos.
+    """
+
+    def __init__(self, skeleton: Dict[str, Any]):
+        self._parts = json.dumps(skeleton, ensure_ascii=False, separators=(",", ":")).split(_SLOT_JSON)
+
+    def render(self, *values: Any) -> str:
+        if len(values) != len(self._parts) - 1:
+            raise ValueError(f"Esperava {len(self._parts) - 1} valores, recebeu {len(values)}")
+        rendered = [self._parts[0]]
+        for value, part in zip(values, self._parts[1:]):
+            rendered.append(encode_basestring(value) if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+            rendered.append(part)
+        return "".join(rendered)
+
+
+def _compile(text: str) -> CompiledDocument:
+    return CompiledDocument(text=text, sha256=hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+class DocumentRegistry:
+    """Guarda as mutations registradas e compila (uma vez) os documentos usados."""
+
+    def __init__(self, operation_name: str):
+        self.operation_name = operation_name
+        self._specs: Dict[str, MutationSpec] = {}
+        # Cache por instancia (lru_cache no metodo prenderia o self)
+        self.compile_batch = lru_cache(maxsize=256)(self._compile_batch)
+
+    def register(self, field: str, input_type: str, selection: str) -> MutationSpec:
+        spec = MutationSpec(field=field, input_type=input_type, selection=" ".join(selection.split()))
+        self._specs[field] = spec
+        self.compile_batch.cache_clear()
+        return spec
+
+    def get(self, field: str) -> MutationSpec:
+        return self._specs[field]
+
+    def _compile_batch(self, fields: Tuple[str, ...]) -> CompiledDocument:
+        """
+        Documento com uma mutation por item, na ordem recebida:
+            mutation PipefyBatch($m0: CreateCardInput!, ...) { m0: createCard(input: $m0) {...} ... }
+        Cada combinacao de tipos gera um documento (e um hash) proprio e estavel.
+        """
+        specs = [self._specs[field] for field in fields]
+        definitions = ", ".join(f"$m{i}: {spec.input_type}" for i, spec in enumerate(specs))
+        body = " ".join(spec.aliased(f"m{i}", f"m{i}") for i, spec in enumerate(specs))
+        return _compile(f"mutation {self.operation_name}({definitions}) {{ {body} }}")
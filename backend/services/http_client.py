@@ -0,0 +1,157 @@
+"""
+Camada HTTP compartilhada das integracoes (Pipefy e Calendly).
+Um httpx.AsyncClient por upstream, criado uma vez e reutilizado: as conexoes
+ficam em keep-alive no pool, e so a primeira chamada paga o handshake TCP+TLS.
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from services.metrics import Counter, Histogram
+from services.observability import get_logger
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "0.25"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "4"))
+
+# Status que valem uma nova tentativa (rate limit e falhas do servidor)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Os unicos que garantem que a requisicao nao foi processada: so estes repetem metodos
+# nao idempotentes (um 502/504 pode chegar depois de o createCard ter sido gravado)
+NOT_PROCESSED_STATUS_CODES = {429, 503}
+# Metodos que podem ser repetidos mesmo se a requisicao ja chegou ao servidor
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# --- Metricas por upstream ---
+UPSTREAM_LATENCY = Histogram(
+    "sdr_upstream_request_duration_seconds",
+    "Latencia de cada tentativa HTTP por upstream",
+    ["upstream"],
+)
+UPSTREAM_REQUESTS = Counter(
+    "sdr_upstream_requests_total",
+    "Tentativas HTTP por upstream e status (ou 'error' para falha de transporte)",
+    ["upstream", "status"],
+)
+UPSTREAM_RETRIES = Counter(
+    "sdr_upstream_retries_total",
+    "Novas tentativas feitas por upstream",
+    ["upstream"],
+)
+UPSTREAM_ERRORS = Counter(
+    "sdr_upstream_errors_total",
+    "Tentativas que falharam (transporte, 429 ou 5xx), por upstream",
+    ["upstream", "kind"],
+)
+
+log = get_logger("http_client")
+
+# Um cliente (e portanto um pool de conexoes) por upstream, criado sob demanda
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """Retorna o cliente compartilhado do upstream, criando na primeira chamada."""
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+        )
+        _clients[upstream] = client
+    return client
+
+
+def maybe_processed(error: Exception) -> bool:
+    """
+    A falha deixa em duvida se o upstream processou a requisicao? (timeout de leitura,
+    conexao caida no meio, 500/502/504). Nesses casos uma escrita nao idempotente nao
+    deve ser repetida as cegas.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 and status not in NOT_PROCESSED_STATUS_CODES
+    if isinstance(error, httpx.TransportError):
+        return not isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+    return False
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Tempo de espera antes da proxima tentativa.
+    Respeita o Retry-After quando o servidor manda; senao usa backoff exponencial
+    com "full jitter" (espera aleatoria entre 0 e o teto da tentativa).
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass  # Retry-After em formato de data: cai no backoff normal
+    ceiling = min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+async def request(upstream: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Faz uma requisicao pelo pool do upstream, com retry em 429/5xx.
+    Falhas de conexao sao repetidas sempre (a requisicao nem saiu);
+    timeouts de leitura so sao repetidos em metodos idempotentes.
+    Metodos nao idempotentes (ex: POST de mutation no Pipefy) so repetem em 429/503;
+    em 500/502/504 a escrita pode ja ter acontecido, entao a resposta volta para quem chamou.
+    Retorna a ultima resposta recebida; quem chama decide o que fazer com o status.
+    """
+    client = get_client(upstream)
+    method = method.upper()
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream=upstream)
+            UPSTREAM_REQUESTS.inc(upstream=upstream, status="error")
+            UPSTREAM_ERRORS.inc(upstream=upstream, kind="transport")
+            if attempt >= HTTP_MAX_RETRIES or not (not maybe_processed(e) or method in IDEMPOTENT_METHODS):
+                raise
+            log.warning("Falha de transporte no upstream, tentando de novo", extra={"upstream": upstream, "error": repr(e), "attempt": attempt + 1})
+            UPSTREAM_RETRIES.inc(upstream=upstream)
+            await asyncio.sleep(_backoff_delay(attempt))
+            continue
+
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream=upstream)
+        UPSTREAM_REQUESTS.inc(upstream=upstream, status=str(response.status_code))
+        if response.status_code in RETRY_STATUS_CODES:
+            UPSTREAM_ERRORS.inc(upstream=upstream, kind=str(response.status_code))
+        retryable = response.status_code in RETRY_STATUS_CODES and (
+            method in IDEMPOTENT_METHODS or response.status_code in NOT_PROCESSED_STATUS_CODES
+        )
+        if retryable and attempt < HTTP_MAX_RETRIES:
+            log.warning("Upstream respondeu com erro, tentando de novo", extra={"upstream": upstream, "status": response.status_code, "attempt": attempt + 1})
+            UPSTREAM_RETRIES.inc(upstream=upstream)
+            await asyncio.sleep(_backoff_delay(attempt, response.headers.get("Retry-After")))
+            continue
+        return response
+
+    return response  # inalcancavel, o loop sempre retorna ou levanta
+
+
+async def aclose_all():
+    """Fecha todos os pools (chamado no shutdown da aplicacao)."""
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,373 @@
+"""
+Fila de jobs local e duravel (SQLite) para tirar as escritas no CRM do caminho da requisicao.
+
+- enqueue() grava o job e retorna na hora; um pool de workers (asyncio) executa em background
+- chave de idempotencia: enfileirar de novo com a mesma chave devolve o job ja existente
+  (pending, running ou succeeded); se ele morreu (dead), o mesmo job volta para a fila
+  com as tentativas zeradas, em vez de travar aquela chave para sempre
+- falhou? nova tentativa com backoff exponencial (+ jitter); esgotou as tentativas,
+  o job vai para a tabela dead_letter
+- erro do proprio SQLite (ex: banco travado) nao derruba o worker: ele loga e espera
+- dependencia ainda nao pronta (JobNotReady)? o job volta para a fila depois de
+  JOB_NOT_READY_DELAY_SECONDS sem gastar tentativa
+- cada job em execucao tem um "lease": se o processo morrer no meio, outro worker
+  (deste ou de outro processo) retoma o job quando o lease vence
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services.metrics import Counter, Gauge
+from services.observability import get_logger
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+JOB_QUEUE_DB_PATH = os.getenv("JOB_QUEUE_DB_PATH", "jobs.db")
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "2"))
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "300"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+# Espera entre checagens de um job que depende de outro ainda nao concluido
+JOB_NOT_READY_DELAY_SECONDS = float(os.getenv("JOB_NOT_READY_DELAY_SECONDS", "2"))
+# wait_for: de quanto em quanto tempo reler o job (quando quem executa e outro processo)
+JOB_WAIT_POLL_SECONDS = 0.1
+
+FINISHED_STATUSES = ("succeeded", "dead")
+
+JOBS_PROCESSED = Counter(
+    "sdr_jobs_processed_total",
+    "Execucoes de jobs por tipo e resultado (succeeded, retry, deferred, dead)",
+    ["kind", "result"],
+)
+JOBS_RUNNING = Gauge(
+    "sdr_jobs_running",
+    "Jobs em execucao neste processo",
+)
+
+log = get_logger("job_queue")
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class PermanentJobError(Exception):
+    """Erro que nao adianta repetir: o job vai direto para a dead letter."""
+
+
+class JobNotReady(Exception):
+    """O job depende de algo que ainda nao terminou: volta para a fila sem gastar tentativa."""
+
+
+class JobQueue:
+    """Fila de jobs em SQLite com pool de workers assincronos."""
+
+    def __init__(self, path: str = JOB_QUEUE_DB_PATH, concurrency: int = JOB_WORKER_CONCURRENCY):
+        self.path = path
+        self.concurrency = concurrency
+        self._handlers: Dict[str, Handler] = {}
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        # job_id -> evento de "o job mudou de estado" para quem esta em wait_for
+        self._watchers: Dict[str, asyncio.Event] = {}
+
+    # --- Banco ---
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Conexao aberta so no primeiro uso (importar o modulo nao cria o arquivo)
+        if self._connection is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    idempotency_key TEXT UNIQUE,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    next_run_at REAL NOT NULL,
+                    locked_until REAL,
+                    last_error TEXT,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, next_run_at);
+                CREATE TABLE IF NOT EXISTS dead_letter (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    failed_at REAL NOT NULL
+                );
+                """
+            )
+            self._connection = conn
+        return self._connection
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        (job_id, kind, payload, key, status, attempts, max_attempts, next_run_at,
+         _locked_until, last_error, result, created_at, updated_at) = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "payload": json.loads(payload),
+            "idempotency_key": key,
+            "status": status,
+            "attempts": attempts,
+            "max_attempts": max_attempts,
+            "next_run_at": next_run_at,
+            "last_error": last_error,
+            "result": json.loads(result) if result else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _insert(self, kind: str, payload: Dict[str, Any], key: Optional[str], max_attempts: int) -> Dict[str, Any]:
+        now = time.time()
+        encoded = json.dumps(payload, ensure_ascii=False)
+        # Transacao de escrita: o SELECT e o INSERT/UPDATE nao disputam com outro processo
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = None
+            if key is not None:
+                row = self._conn.execute("SELECT id, status FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, payload, idempotency_key, status, max_attempts, next_run_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'pending', ?, ?, ?, ?)",
+                    (job_id, kind, encoded, key, max_attempts, now, now, now),
+                )
+            else:
+                job_id = row[0]
+                if row[1] == "dead":
+                    # Mesmo id: quem ja aponta para este job (ex: o update da reuniao) volta a andar
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'pending', payload = ?, attempts = 0, max_attempts = ?, next_run_at = ?, "
+                        "locked_until = NULL, updated_at = ? WHERE id = ?",
+                        (encoded, max_attempts, now, now, job_id),
+                    )
+                    self._conn.execute("DELETE FROM dead_letter WHERE job_id = ?", (job_id,))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return self._get(job_id)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Pega o proximo job pronto (ou com lease vencido) e marca como running, numa transacao."""
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE (status = 'pending' AND next_run_at <= ?) "
+                "OR (status = 'running' AND locked_until < ?) ORDER BY next_run_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                self._conn.execute("COMMIT")
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, row[0]),
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return self._get(row[0])
+
+    def _complete(self, job_id: str, result: Optional[Dict[str, Any]]):
+        self._conn.execute(
+            "UPDATE jobs SET status = 'succeeded', result = ?, last_error = NULL, locked_until = NULL, updated_at = ? WHERE id = ?",
+            (json.dumps(result or {}, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def _fail(self, job: Dict[str, Any], error: str, permanent: bool) -> str:
+        now = time.time()
+        if permanent or job["attempts"] >= job["max_attempts"]:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'dead', last_error = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+                    (error, now, job["id"]),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_letter (job_id, kind, payload, attempts, last_error, failed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job["id"], job["kind"], json.dumps(job["payload"], ensure_ascii=False), job["attempts"], error, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return "dead"
+
+        # Backoff exponencial com jitter: base * 2^(tentativa-1), entre 50% e 100% do valor
+        delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * (2 ** (job["attempts"] - 1)))
+        delay *= random.uniform(0.5, 1.0)
+        self._conn.execute(
+            "UPDATE jobs SET status = 'pending', last_error = ?, next_run_at = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+            (error, now + delay, now, job["id"]),
+        )
+        return "retry"
+
+    def _defer(self, job: Dict[str, Any], error: str):
+        """Devolve o job para a fila sem contar a tentativa (desfaz o incremento do _claim)."""
+        now = time.time()
+        delay = JOB_NOT_READY_DELAY_SECONDS * random.uniform(0.5, 1.0)
+        self._conn.execute(
+            "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), last_error = ?, next_run_at = ?, "
+            "locked_until = NULL, updated_at = ? WHERE id = ?",
+            (error, now + delay, now, job["id"]),
+        )
+
+    # --- API publica ---
+
+    def register_handler(self, kind: str, handler: Handler):
+        """Registra a funcao que executa os jobs de um tipo."""
+        self._handlers[kind] = handler
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], idempotency_key: Optional[str] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> Dict[str, Any]:
+        """
+        Grava o job e retorna na hora. Com idempotency_key repetida, devolve o job existente
+        (ou, se ele estava dead, o mesmo job de volta na fila com o novo payload).
+        """
+        job = await asyncio.to_thread(self._run, self._insert, kind, payload, idempotency_key, max_attempts)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._run, self._get, job_id)
+
+    async def wait_for(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Espera o job terminar (succeeded ou dead) por ate `timeout` segundos e devolve o estado
+        dele nesse momento (pode ainda estar pending/running). Nao cancela nem muda o job.
+        Executado por este processo, acorda na hora; por outro, percebe relendo o banco.
+        """
+        deadline = time.monotonic() + timeout
+        event = self._watchers.setdefault(job_id, asyncio.Event())
+        try:
+            while True:
+                event.clear()
+                job = await self.get_job(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, JOB_WAIT_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._watchers.get(job_id) is event:
+                del self._watchers[job_id]
+
+    def _notify_watchers(self, job_id: str):
+        event = self._watchers.get(job_id)
+        if event is not None:
+            event.set()
+
+    async def _execute(self, job: Dict[str, Any]):
+        handler = self._handlers.get(job["kind"])
+        JOBS_RUNNING.inc()
+        try:
+            if handler is None:
+                raise PermanentJobError(f"Nenhum handler registrado para '{job['kind']}'")
+            result = await handler(job["payload"])
+            await asyncio.to_thread(self._run, self._complete, job["id"], result)
+            JOBS_PROCESSED.inc(kind=job["kind"], result="succeeded")
+        except JobNotReady as e:
+            await asyncio.to_thread(self._run, self._defer, job, str(e) or repr(e))
+            JOBS_PROCESSED.inc(kind=job["kind"], result="deferred")
+            log.debug("Job adiado", extra={"job_id": job["id"], "kind": job["kind"], "error": str(e)})
+        except Exception as e:
+            outcome = await asyncio.to_thread(self._run, self._fail, job, str(e) or repr(e), isinstance(e, PermanentJobError))
+            JOBS_PROCESSED.inc(kind=job["kind"], result=outcome)
+            log.warning("Job falhou", extra={"job_id": job["id"], "kind": job["kind"], "attempt": job["attempts"], "error": str(e), "outcome": outcome})
+        finally:
+            JOBS_RUNNING.dec()
+            self._notify_watchers(job["id"])
+
+    async def _worker(self):
+        errors = 0
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(self._run, self._claim)
+            except sqlite3.Error as e:
+                # Banco ocupado/indisponivel: o worker nao morre, espera (com backoff) e tenta de novo
+                errors += 1
+                delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_POLL_INTERVAL_SECONDS * (2 ** (errors - 1)))
+                log.error("Falha ao buscar job na fila", extra={"error": repr(e), "retry_in": round(delay, 2)})
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            errors = 0
+            if job is None:
+                # Nada pronto: espera um enqueue (wakeup) ou o intervalo de polling
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._execute(job)
+            except sqlite3.Error as e:
+                # Nao deu para gravar o resultado: o job fica running e volta quando o lease vencer
+                log.error("Falha ao gravar o resultado do job", extra={"job_id": job["id"], "kind": job["kind"], "error": repr(e)})
+
+    async def start(self):
+        """Sobe o pool de workers (chamado no startup da API)."""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, grace_seconds: float = 0.0):
+        """
+        Para os workers. Com grace_seconds, os jobs em execucao tem ate esse tempo para
+        terminar (nenhum job novo e pego); os interrompidos sao retomados quando o lease vencer.
+        """
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if grace_seconds > 0 and self._workers:
+            await asyncio.wait(self._workers, timeout=grace_seconds)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Fechar a conexao faz o checkpoint do WAL (some o jobs.db-wal/-shm)
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Fila compartilhada pelo processo
+job_queue = JobQueue()
@@ -0,0 +1,420 @@
+"""
+Extracao local (sem LLM) dos dados do lead: nome, e-mail, empresa e necessidade.
+
+Cada mensagem do usuario passa por regex pre-compiladas ("meu nome e X", "sou o X da
+empresa Y", e-mails...) e por uma checagem de contexto: se o agente acabou de perguntar
+um dado so ("Qual o nome da sua empresa?"), a resposta curta do usuario vira esse dado.
+Gazetteers (cargos, areas, nacionalidades, lugares, adjetivos, sufixos de empresa, palavras
+que nao sao nome) evitam falsos positivos como "sou o gerente" ou "sou casado" virar nome e
+"sou do RH da Acme", "sou do Rio de Janeiro" ou "trabalho em casa" virar empresa. Empresa
+so vale com cara de nome proprio (maiuscula, numero ou sufixo como "Ltda").
+
+Cada dado tem uma origem: "explicit" (e-mail, "meu nome e X", "minha empresa se chama Y")
+pode corrigir um valor ja preenchido; "pattern" (padroes mais soltos, como "sou da X") e
+"answer" (resposta curta a pergunta do agente) so preenchem o que ainda esta vazio.
+
+Com os dados em maos:
+- o que ja foi coletado vai para o modelo como contexto estruturado (ele nao pergunta de novo);
+- com os 4 dados e sem a "pergunta direta" feita, ela e feita localmente;
+- com a pergunta direta respondida com um "sim"/"nao" claro, o JSON create_lead e montado
+  aqui, sem round trip ao LLM.
+Qualquer caso ambiguo continua indo para o LLM.
+
+Os dados ficam por sessao num LRU em memoria; num miss (outro worker, restart) eles sao
+recalculados a partir do historico, que e deterministico e custa microssegundos.
+"""
+
+import json
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from services.metrics import Counter
+from services.response_cache import normalize_text
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+LEAD_FAST_PATH_ENABLED = os.getenv("LEAD_FAST_PATH_ENABLED", "true").lower() == "true"
+LEAD_STATE_CACHE_SIZE = int(os.getenv("LEAD_STATE_CACHE_SIZE", "10000"))
+
+FIELDS = ("name", "email", "company", "need")
+FIELD_LABELS = {"name": "Nome", "email": "E-mail", "company": "Empresa", "need": "Necessidade"}
+
+LEAD_FIELDS_EXTRACTED = Counter(
+    "sdr_lead_fields_extracted_total",
+    "Dados do lead extraidos localmente, por campo e origem (explicit, pattern ou answer)",
+    ["field", "source"],
+)
+LEAD_FAST_PATH = Counter(
+    "sdr_lead_fast_path_total",
+    "Turnos resolvidos sem LLM (create_lead, direct_question) ou enviados ao LLM (llm)",
+    ["result"],
+)
+
+# --- Gazetteers ---
+# Palavras que aparecem depois de "sou o/a" mas nao sao nome
+_ROLE_WORDS = {
+    "gerente", "diretor", "diretora", "ceo", "cto", "cfo", "coo", "dono", "dona", "socio", "socia",
+    "fundador", "fundadora", "analista", "coordenador", "coordenadora", "responsavel", "head",
+    "lider", "supervisor", "supervisora", "consultor", "consultora", "engenheiro", "engenheira",
+    "desenvolvedor", "desenvolvedora", "proprietario", "proprietaria", "presidente", "vendedor",
+}
+# Areas/departamentos: "sou do RH da Acme" -> a empresa e o que vem depois do "da"
+_DEPARTMENT_WORDS = {
+    "rh", "ti", "marketing", "financeiro", "financas", "comercial", "vendas", "compras", "juridico",
+    "operacoes", "logistica", "suporte", "atendimento", "produto", "engenharia", "administrativo",
+    "contabilidade", "diretoria", "recursos", "humanos", "time", "setor", "departamento", "area",
+}
+# Nacionalidades, origens e outras descricoes que seguem o "sou" sem ser nome
+_DESCRIPTOR_WORDS = {
+    "brasileiro", "brasileira", "portugues", "portuguesa", "argentino", "argentina", "americano",
+    "americana", "estrangeiro", "estrangeira", "paulista", "paulistano", "paulistana", "carioca",
+    "mineiro", "mineira", "gaucho", "gaucha", "baiano", "baiana", "nordestino", "nordestina",
+    "novo", "nova", "novato", "novata", "estudante", "autonomo", "autonoma", "freelancer",
+    "empresario", "empresaria", "empreendedor", "empreendedora", "advogado", "advogada",
+    "medico", "medica", "professor", "professora", "contador", "contadora", "vendedora",
+    "casado", "casada", "solteiro", "solteira", "divorciado", "divorciada", "apaixonado",
+    "apaixonada", "formado", "formada", "aposentado", "aposentada", "feliz", "fa", "curioso",
+    "curiosa", "iniciante", "leigo", "leiga", "especialista", "responsavel",
+}
+_NOT_NAME_WORDS = _ROLE_WORDS | _DEPARTMENT_WORDS | _DESCRIPTOR_WORDS | {
+    "a", "o", "da", "do", "de", "na", "no", "um", "uma", "cliente", "interessado", "interessada",
+    "sim", "nao", "oi", "ola", "bom", "boa", "dia", "tarde", "noite", "tudo", "bem", "obrigado",
+    "obrigada", "eu", "aqui", "empresa", "quero", "gostaria", "preciso", "claro", "ok", "sou",
+}
+# Adjetivos e predicados que seguem "empresa e ..." sem ser o nome dela
+_ADJECTIVE_WORDS = {
+    "pequena", "pequeno", "grande", "media", "medio", "nova", "novo", "familiar", "antiga",
+    "antigo", "jovem", "local", "nacional", "internacional", "multinacional", "privada",
+    "publica", "propria", "minha", "nossa", "essa", "esta", "uma", "um", "bem", "muito",
+    "bastante", "super", "startup", "casa", "home", "remoto", "remota", "equipe", "campo",
+}
+# Lugares: "sou do Rio de Janeiro" e origem, nao empresa
+_PLACE_WORDS = {
+    "brasil", "portugal", "exterior", "interior", "capital", "nordeste", "norte", "sul", "sudeste",
+    "centro oeste", "acre", "alagoas", "amapa", "amazonas", "bahia", "ceara", "distrito federal",
+    "espirito santo", "goias", "maranhao", "mato grosso", "mato grosso do sul", "minas",
+    "minas gerais", "para", "paraiba", "parana", "pernambuco", "piaui", "rio de janeiro",
+    "rio grande do norte", "rio grande do sul", "rondonia", "roraima", "santa catarina",
+    "sao paulo", "sergipe", "tocantins", "rio", "sp", "rj", "mg", "rs", "sc", "pr", "ba", "df",
+    "brasilia", "belo horizonte", "porto alegre", "curitiba", "florianopolis", "recife",
+    "salvador", "fortaleza", "manaus", "belem", "goiania", "vitoria", "campinas", "santos",
+    "niteroi", "natal", "joao pessoa", "maceio", "aracaju", "teresina", "sao luis", "cuiaba",
+    "campo grande", "londrina", "joinville", "ribeirao preto", "lisboa", "porto",
+}
+# Terminacoes de adjetivo/participio: "sou Casado", "sou Apaixonado por IA"
+_PREDICATE_ENDINGS = ("ado", "ada", "ido", "ida", "oso", "osa", "vel", "ivo", "iva")
+# Sufixos que indicam que a palavra seguinte ainda faz parte do nome da empresa
+_COMPANY_SUFFIXES = {
+    "ltda", "ltda.", "s.a.", "s/a", "sa", "me", "eireli", "epp", "inc", "inc.", "llc", "corp",
+    "tecnologia", "tech", "solucoes", "soluções", "group", "grupo", "digital", "software",
+    "sistemas", "consultoria", "servicos", "serviços", "brasil",
+}
+# Necessidades genericas demais (ex: "quero saber mais") nao contam
+_GENERIC_NEEDS = ("saber mais", "saber sobre", "conhecer", "entender melhor", "falar com", "agendar", "seguir", "conversar")
+
+# --- Regex pre-compiladas ---
+_WORD = r"[A-Za-zÀ-ÖØ-öø-ÿ][\wÀ-ÖØ-öø-ÿ'-]*"
+_CAP_WORD = r"[A-ZÀ-ÖØ-Þ][\wÀ-ÖØ-öø-ÿ'-]*"
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_NAME_RE = re.compile(
+    r"(?i:\b(?P<trigger>meu nome (?:e|é)|me chamo|pode me chamar de|aqui (?:e|é)(?: [oa])?|sou (?:[oa] )?))"
+    rf"\s*(?P<value>{_CAP_WORD}(?:\s+(?:(?:d[aeo]s?)\s+)?{_CAP_WORD}){{0,3}})"
+)
+_EXPLICIT_NAME_RE = re.compile(r"(?i)^(?:meu nome|me chamo|pode me chamar)")
+# Depois de "sou X": "por", "com"... indicam predicado ("sou Apaixonado por IA")
+_PREDICATE_TAIL_RE = re.compile(r"(?i)^\s+(?:por|com|em|para|pelo|pela|no|na|de|do|da)\b")
+_COMPANY_RE = re.compile(
+    r"(?i:\b(?P<trigger>(?:d|n|pel)[ao] empresa|empresa (?:e|é|chamada|se chama)|empresa:|trabalho (?:n[ao]|em|pel[ao])"
+    r"|(?:sou|venho) d[ao](?: empresa)?|represento [ao]))"
+    r"\s+(?P<value>\S.*)"
+)
+_EXPLICIT_COMPANY_RE = re.compile(r"(?i)(?:chamada|se chama|:)$")
+_LEADING_ARTICLE_RE = re.compile(r"(?i)^(?:(?:a|o|as|os|uma|um)\s+)?(?:empresa\s+)?")
+_NEED_RE = re.compile(
+    r"(?i:\b(?:precis(?:o|amos) (?:de )?|(?:quero|queremos|gostaria(?:mos)?) (?:de )?"
+    r"|(?:nosso|meu) (?:maior )?(?:desafio|problema|objetivo|foco) (?:e|é|hoje e|hoje é) "
+    r"|(?:estamos|estou) com (?:dificuldades?|problemas?) (?:em|de|com|para) "
+    r"|(?:buscamos|procuramos|procuro|busco) ))"
+    r"(.+?)(?:[.!?\n]|$)"
+)
+
+_ASKED_SLOT_RES = {
+    "email": re.compile(r"\be ?mail\b"),
+    "name": re.compile(r"\bseu nome\b|\bcomo (?:voce )?se chama\b|\bcom quem (?:eu )?falo\b|\bcomo posso te chamar\b"),
+    "company": re.compile(
+        r"\bnome da (?:sua )?empresa\b|\bqual (?:e )?(?:a )?(?:sua )?(?:empresa|companhia)\b|\bem que empresa\b"
+        r"|\bde qual empresa\b|\bonde (?:voce )?trabalha\b"
+    ),
+    "need": re.compile(r"\bdesafio|\bnecessidade|\bdor\b|\bproblema|\bcomo podemos (?:te )?ajudar|\bo que (?:voce )?(?:precisa|busca)"),
+}
+_DIRECT_QUESTION_RE = re.compile(
+    r"\b(?:gostaria de (?:seguir|agendar|marcar|conversar)|podemos agendar|quer agendar|tem interesse em (?:seguir|agendar|uma conversa))\b"
+)
+_YES_RE = re.compile(r"^(?:sim|claro|com certeza|quero|queremos|pode ser|pode|vamos|bora|ok|perfeito|gostaria|tenho interesse|isso|fechado)\b")
+_NO_RE = re.compile(r"^(?:nao|agora nao|sem interesse|no momento nao|prefiro nao|obrigad[oa] mas nao)\b")
+
+
+@dataclass
+class LeadSlots:
+    """Dados do lead ja identificados na conversa."""
+
+    values: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name in FIELDS if not self.values.get(name)]
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    def context_message(self) -> Optional[Dict[str, str]]:
+        """Mensagem de sistema com os dados ja coletados (None se ainda nao ha nenhum)."""
+        if not self.values:
+            return None
+        known = "; ".join(f"{FIELD_LABELS[name]}: {self.values[name]}" for name in FIELDS if self.values.get(name))
+        missing = ", ".join(FIELD_LABELS[name].lower() for name in self.missing) or "nenhum"
+        return {
+            "role": "system",
+            "content": (
+                f"Dados do lead já identificados nesta conversa (não pergunte de novo): {known}. "
+                f"Ainda faltam: {missing}."
+            ),
+        }
+
+
+def _clean(value: str) -> str:
+    return value.strip(" \t\n,.;:!?\"'()")
+
+
+def _valid_name(value: str) -> bool:
+    words = value.split()
+    return 0 < len(words) <= 4 and normalize_text(words[0]) not in _NOT_NAME_WORDS and all(
+        re.fullmatch(_WORD, word) for word in words
+    )
+
+
+def _name_predicate(value: str, tail: str) -> bool:
+    """ "sou Casado", "sou Apaixonado por IA": adjetivo ou predicado depois de um "sou" sem artigo."""
+    first = normalize_text(value.split()[0])
+    return first.endswith(_PREDICATE_ENDINGS) or bool(_PREDICATE_TAIL_RE.match(tail))
+
+
+def _valid_company(value: str) -> bool:
+    """Empresa so com cara de nome proprio: maiuscula, numero ou sufixo; nunca lugar ou adjetivo."""
+    words = value.split()
+    if not words:
+        return False
+    normalized = normalize_text(value)
+    if normalized in _PLACE_WORDS or normalized in _NOT_NAME_WORDS:
+        return False
+    if any(word.lower() in _COMPANY_SUFFIXES for word in words[1:]):
+        return True
+    first = words[0]
+    return (first[:1].isupper() or first[:1].isdigit()) and normalize_text(first) not in _ADJECTIVE_WORDS | _NOT_NAME_WORDS
+
+
+def _trim_company(value: str) -> str:
+    """Corta o nome da empresa no primeiro pedaco que claramente nao faz parte dele."""
+    kept: List[str] = []
+    words = value.split()
+    for index, word in enumerate(words):
+        bare = _clean(word)
+        suffix = word.lower() in _COMPANY_SUFFIXES or bare.lower() in _COMPANY_SUFFIXES
+        # "Padaria do Zé": preposicao so continua o nome se vier outra palavra maiuscula
+        connector = bare in ("da", "do", "de", "das", "dos") and index + 1 < len(words) and words[index + 1][:1].isupper()
+        if index > 0 and not (bare[:1].isupper() or bare[:1].isdigit() or suffix or connector or bare == "&"):
+            break
+        if bare:
+            kept.append(word if word.lower() in _COMPANY_SUFFIXES else bare)
+        # Pontuacao fecha o nome (menos em sufixos como "Ltda." e "S.A.")
+        if len(kept) == 5 or (word[-1:] in ",;.!?" and word.lower() not in _COMPANY_SUFFIXES):
+            break
+    return " ".join(kept)
+
+
+def _strip_department(value: str) -> str:
+    """ "RH da Acme" / "time de vendas da Acme" -> "Acme"; so a area ("RH") vira ""."""
+    words = value.split()
+    if not words or normalize_text(words[0]) not in _DEPARTMENT_WORDS:
+        return value
+    while words and (normalize_text(words[0]) in _DEPARTMENT_WORDS or words[0] in ("da", "do", "de", "das", "dos")):
+        words.pop(0)
+    return " ".join(words)
+
+
+def _valid_need(value: str) -> bool:
+    normalized = normalize_text(value)
+    return len(normalized) >= 8 and not normalized.startswith(_GENERIC_NEEDS)
+
+
+def asked_slot(assistant_message: str) -> Optional[str]:
+    """Qual dado o agente pediu na mensagem (so quando pediu exatamente um)."""
+    normalized = normalize_text(assistant_message)
+    asked = [name for name, pattern in _ASKED_SLOT_RES.items() if pattern.search(normalized)]
+    return asked[0] if len(asked) == 1 else None
+
+
+def extract_fields(text: str, asked: Optional[str] = None) -> List[Tuple[str, str, str]]:
+    """
+    Dados encontrados numa mensagem do usuario: lista de (campo, valor, origem).
+    `asked` e o dado que o agente tinha acabado de pedir, se for so um.
+    """
+    found: List[Tuple[str, str, str]] = []
+
+    email = _EMAIL_RE.search(text)
+    if email:
+        found.append(("email", email.group(0).rstrip("."), "explicit"))
+
+    company_value = None
+    company = _COMPANY_RE.search(text)
+    if company:
+        value = _trim_company(_LEADING_ARTICLE_RE.sub("", _strip_department(company.group("value")), count=1))
+        if _valid_company(value):
+            company_value = value
+            source = "explicit" if _EXPLICIT_COMPANY_RE.search(company.group("trigger")) else "pattern"
+            found.append(("company", company_value, source))
+
+    name = _NAME_RE.search(text)
+    if name:
+        value = name.group("value")
+        trigger = name.group("trigger").strip()
+        # "sou o Joao da Acme": o "da Acme" e a empresa, nao sobrenome
+        if company_value:
+            value = re.sub(rf"\s+d[aeo]s?\s+{re.escape(company_value)}.*$", "", value)
+        else:
+            tail = re.search(r"\s+d[ao]\s+(.+)$", value)
+            if tail and any(word.lower() in _COMPANY_SUFFIXES for word in tail.group(1).split()):
+                company_value = tail.group(1)
+                found.append(("company", company_value, "pattern"))
+                value = value[:tail.start()]
+        bare_sou = normalize_text(trigger) == "sou"
+        if _valid_name(value) and not (bare_sou and _name_predicate(value, text[name.end():])):
+            found.append(("name", value, "explicit" if _EXPLICIT_NAME_RE.match(trigger) else "pattern"))
+
+    need = _NEED_RE.search(text)
+    if need and _valid_need(need.group(1)):
+        found.append(("need", _clean(need.group(1)), "pattern"))
+
+    # Resposta direta a pergunta do agente ("Qual o seu nome?" -> "Robert Emanuel")
+    if asked and asked not in {name for name, _, _ in found}:
+        answer = _clean(text)
+        if asked == "name" and _valid_name(answer):
+            found.append(("name", answer.title() if answer.islower() else answer, "answer"))
+        elif asked == "company" and 0 < len(answer) <= 60 and len(answer.split()) <= 6 and "@" not in answer:
+            answer = re.sub(r"(?i)^(?:(?:e|é|a|o|na|no|da|do)\s+)+", "", answer)
+            if answer and normalize_text(answer) not in _NOT_NAME_WORDS:
+                found.append(("company", answer, "answer"))
+        elif asked == "need" and _valid_need(answer) and not _YES_RE.match(normalize_text(answer)):
+            found.append(("need", answer[:300], "answer"))
+    return found
+
+
+def interest_answer(text: str) -> Optional[bool]:
+    """True/False para um "sim"/"nao" claro a pergunta direta; None se for ambiguo."""
+    normalized = normalize_text(text)
+    if _NO_RE.match(normalized):
+        return False
+    if _YES_RE.match(normalized) and "?" not in text:
+        return True
+    return None
+
+
+class LeadExtractor:
+    """Estado da extracao por sessao (LRU), atualizado so com as mensagens novas."""
+
+    def __init__(self, max_sessions: int = LEAD_STATE_CACHE_SIZE):
+        self.max_sessions = max_sessions
+        # session_id -> (mensagens ja processadas, ultima mensagem processada, dados)
+        self._sessions: "OrderedDict[str, Tuple[int, Optional[Dict[str, str]], LeadSlots]]" = OrderedDict()
+
+    def _scan(self, slots: LeadSlots, history: List[Dict[str, str]], start: int):
+        for index in range(start, len(history)):
+            message = history[index]
+            if message.get("role") != "user":
+                continue
+            previous = history[index - 1] if index > 0 else None
+            asked = asked_slot(previous.get("content") or "") if previous and previous.get("role") == "assistant" else None
+            for name, value, source in extract_fields(message.get("content") or "", asked):
+                # So o explicito corrige ("na verdade meu e-mail e..."); o resto so preenche o vazio
+                if source == "explicit" or not slots.values.get(name):
+                    if slots.values.get(name) != value:
+                        LEAD_FIELDS_EXTRACTED.inc(field=name, source=source)
+                    slots.values[name] = value
+
+    def update(self, session_id: Optional[str], history: List[Dict[str, str]]) -> LeadSlots:
+        """Dados do lead depois do historico atual (incremental quando ha session_id)."""
+        if session_id is None:
+            slots = LeadSlots()
+            self._scan(slots, history, 0)
+            return slots
+
+        entry = self._sessions.get(session_id)
+        start, slots = 0, LeadSlots()
+        if entry is not None:
+            processed, last, cached = entry
+            # So reaproveita se o historico ainda e o mesmo ate onde ja foi lido
+            if 0 < processed <= len(history) and history[processed - 1] == last:
+                start, slots = processed, LeadSlots(dict(cached.values))
+        self._scan(slots, history, start)
+
+        self._sessions[session_id] = (len(history), history[-1] if history else None, slots)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return slots
+
+
+def create_lead_payload(slots: LeadSlots, interest_confirmed: bool) -> str:
+    """O mesmo JSON create_lead que o modelo devolveria."""
+    data = {name: slots.values[name] for name in FIELDS}
+    data["interest_confirmed"] = interest_confirmed
+    return json.dumps({"action": "create_lead", "data": data}, ensure_ascii=False)
+
+
+def direct_question(slots: LeadSlots) -> str:
+    first_name = slots.values["name"].split()[0]
+    return (
+        f"Obrigado, {first_name}! Anotei seus dados e o desafio da {slots.values['company']}. "
+        "Você gostaria de seguir com uma conversa com um especialista da Verzel para aprofundar isso?"
+    )
+
+
+def fast_path_reply(slots: LeadSlots, history: List[Dict[str, str]]) -> Optional[str]:
+    """
+    Resposta local para o turno atual, quando da para dispensar o LLM:
+    - pergunta direta respondida com sim/nao claro e os 4 dados → JSON create_lead
+    - 4 dados completos nesta mensagem e pergunta direta ainda nao feita → a pergunta direta
+    None = segue para o LLM.
+    """
+    if not LEAD_FAST_PATH_ENABLED or not slots.complete or not history or history[-1].get("role") != "user":
+        return None
+    # Lead ja criado nesta conversa: nao dispara de novo
+    if any(m.get("role") == "assistant" and "create_lead" in (m.get("content") or "") for m in history):
+        return None
+
+    last_user = history[-1].get("content") or ""
+    previous = history[-2] if len(history) > 1 and history[-2].get("role") == "assistant" else None
+    asked_directly = [
+        m for m in history if m.get("role") == "assistant" and _DIRECT_QUESTION_RE.search(normalize_text(m.get("content") or ""))
+    ]
+
+    if previous is not None and asked_directly and asked_directly[-1] is previous:
+        interest = interest_answer(last_user)
+        if interest is not None:
+            return create_lead_payload(slots, interest)
+        return None
+
+    # Os dados acabaram de ficar completos com esta mensagem (e ela nao e uma pergunta ao agente)
+    if not asked_directly and "?" not in last_user:
+        asked = asked_slot(previous.get("content") or "") if previous else None
+        if extract_fields(last_user, asked):
+            return direct_question(slots)
+    return None
+
+
+# Estado compartilhado pelo processo
+lead_extractor = LeadExtractor()
@@ -0,0 +1,78 @@
+"""
+Cache assincrono para metadados que quase nunca mudam (ex: usuario e tipo de evento do Calendly).
+
+- TTL: depois de ttl_seconds a entrada fica "velha", mas ainda e servida
+  por ate max_stale_seconds enquanto um refresh roda em background
+  (stale-while-revalidate), entao quem chama nunca espera por uma entrada velha.
+- Single-flight: chamadas concorrentes para a mesma chave compartilham a mesma
+  busca em andamento, em vez de cada uma ir ao upstream.
+- Resultados None (falha na busca) nao sao guardados.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from services.metrics import Counter
+
+METADATA_CACHE_LOOKUPS = Counter(
+    "sdr_metadata_cache_lookups_total",
+    "Consultas ao cache de metadados: hit, stale (servido velho + refresh), miss",
+    ["cache", "result"],
+)
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+class MetadataCache:
+    """Cache TTL com refresh em background e deduplicacao de buscas concorrentes."""
+
+    def __init__(self, name: str, ttl_seconds: float, max_stale_seconds: float):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        # chave -> (momento em que foi buscado, valor)
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        # chave -> busca em andamento (compartilhada por quem chegar enquanto ela roda)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def _load(self, key: str, loader: Loader) -> Any:
+        try:
+            value = await loader()
+            if value is not None:
+                self._entries[key] = (time.monotonic(), value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def _start_load(self, key: str, loader: Loader) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, loader))
+            self._inflight[key] = task
+        return task
+
+    async def get(self, key: str, loader: Loader) -> Optional[Any]:
+        """Retorna o valor da chave, buscando com `loader` so quando necessario."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age <= self.ttl_seconds:
+                METADATA_CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+                return entry[1]
+            if age <= self.ttl_seconds + self.max_stale_seconds:
+                # Velho, mas aceitavel: devolve ja e atualiza em background
+                METADATA_CACHE_LOOKUPS.inc(cache=self.name, result="stale")
+                self._start_load(key, loader)
+                return entry[1]
+
+        METADATA_CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+        # shield: se quem chamou for cancelado, a busca continua para os outros que esperam por ela
+        return await asyncio.shield(self._start_load(key, loader))
+
+    def invalidate(self, key: Optional[str] = None):
+        """Descarta uma chave (ou tudo), forcando nova busca na proxima chamada."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
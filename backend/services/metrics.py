@@ -0,0 +1,245 @@
+"""
+Metricas em memoria no formato de texto do Prometheus.
+Implementacao minima (Counter, Gauge e Histogram com labels) para nao trazer
+uma dependencia extra so para expor o /metrics.
+
+Com varios workers (serve.py), cada processo tem as proprias metricas. Com METRICS_DIR,
+cada worker grava um snapshot delas nesse diretorio a cada METRICS_FLUSH_SECONDS, e o
+/metrics de qualquer worker junta os snapshots de todos, com o label worker="<pid>"
+(some com sum without(worker) no Prometheus). Sem METRICS_DIR, o /metrics mostra so o
+processo que respondeu.
+"""
+
+import asyncio
+import glob
+import json
+import math
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Buckets padrao de latencia, em segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Todas as metricas criadas ficam registradas aqui, na ordem de criacao
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape_label_value(value: str) -> str:
+    """Escapes do formato de exposicao: barra invertida, aspas e quebra de linha."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(text: str) -> str:
+    """No HELP so barra invertida e quebra de linha sao escapadas."""
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    """Monta o trecho {a="1",b="2"} de uma amostra."""
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Base comum: nome, descricao, labels e um lock para atualizacoes de threads diferentes."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self, workers: Optional[List[Tuple[str, List[Tuple[Tuple[str, ...], Any]]]]] = None) -> List[str]:
+        """
+        Linhas do formato de exposicao. Sem `workers`, as series deste processo; com
+        `workers` ([(pid, series)]), as de cada worker, com o label worker.
+        """
+        lines = [f"# HELP {self.name} {_escape_help(self.description)}", f"# TYPE {self.name} {self.kind}"]
+        if workers is None:
+            for key, value in self.snapshot():
+                lines.extend(self._lines(self.labelnames, key, value))
+        else:
+            names = self.labelnames + ("worker",)
+            for pid, series in workers:
+                for key, value in series:
+                    lines.extend(self._lines(names, tuple(key) + (pid,), value))
+        return lines
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        """Copia das series (labels -> valor), para renderizar ou gravar no snapshot do worker."""
+        raise NotImplementedError
+
+    def _lines(self, names: Sequence[str], key: Tuple[str, ...], value: Any) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contador que so aumenta."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def _lines(self, names: Sequence[str], key: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(names, key)} {_format_value(value)}"]
+
+
+class Gauge(Counter):
+    """Valor que sobe e desce (ex: tamanho de fila)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Histograma com buckets cumulativos, soma e contagem por combinacao de labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Para cada combinacao de labels: [contagem por bucket..., soma, total]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return [(key, list(series)) for key, series in self._series.items()]
+
+    def _lines(self, names: Sequence[str], key: Tuple[str, ...], value: Any) -> List[str]:
+        lines = []
+        cumulative = 0.0
+        for index, bound in enumerate(self.buckets):
+            cumulative += value[index]
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(names, key, le)} {_format_value(cumulative)}")
+        lines.append(f"{self.name}_sum{_format_labels(names, key)} {_format_value(value[-2])}")
+        lines.append(f"{self.name}_count{_format_labels(names, key)} {_format_value(value[-1])}")
+        return lines
+
+
+# --- Snapshots por worker (METRICS_DIR) ---
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"worker-{pid}.json")
+
+
+def write_snapshot():
+    """Grava as metricas deste processo em METRICS_DIR (troca atomica: quem le nunca ve meio arquivo)."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    data = {metric.name: [[list(key), value] for key, value in metric.snapshot()] for metric in _REGISTRY}
+    path = _snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def remove_snapshot(pid: int):
+    """Apaga o snapshot de um worker que saiu (o supervisor chama; gauges dele nao ficam para tras)."""
+    if not METRICS_DIR:
+        return
+    try:
+        os.remove(_snapshot_path(pid))
+    except FileNotFoundError:
+        pass
+
+
+def clear_snapshots():
+    """Apaga os snapshots de uma execucao anterior (o supervisor chama antes de criar os workers)."""
+    for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.json*")) if METRICS_DIR else []:
+        os.remove(path)
+
+
+def _worker_series() -> List[Tuple[str, Optional[Dict[str, list]]]]:
+    """[(pid, metricas gravadas)] de todos os workers; None = este processo (estado ao vivo)."""
+    own = str(os.getpid())
+    workers: List[Tuple[str, Optional[Dict[str, list]]]] = [(own, None)]
+    for path in sorted(glob.glob(os.path.join(METRICS_DIR, "worker-*.json"))):
+        pid = os.path.basename(path)[len("worker-"):-len(".json")]
+        if pid == own:
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                workers.append((pid, json.load(f)))
+        except (OSError, ValueError):
+            continue  # worker saindo: o arquivo sumiu entre o glob e o open
+    return workers
+
+
+async def run_snapshot_loop():
+    """Grava o snapshot deste worker a cada METRICS_FLUSH_SECONDS (roda no lifespan; so com METRICS_DIR)."""
+    if not METRICS_DIR:
+        return
+    while True:
+        await asyncio.to_thread(write_snapshot)
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+
+
+def render_latest() -> str:
+    """Texto completo de todas as metricas, no formato de exposicao do Prometheus."""
+    workers = _worker_series() if METRICS_DIR else None
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        if workers is None:
+            lines.extend(metric.render())
+        else:
+            lines.extend(metric.render([
+                (pid, metric.snapshot() if data is None else data.get(metric.name, []))
+                for pid, data in workers
+            ]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,206 @@
+"""
+Observabilidade: logging estruturado sem bloquear o event loop e spans de latencia por etapa.
+
+- Logging: os loggers da API so colocam o registro numa fila em memoria (QueueHandler);
+  uma thread separada (QueueListener) formata e escreve no stdout. Saida em JSON, uma linha
+  por evento (LOG_FORMAT=json), ou texto. LOG_SAMPLE_RATE amostra DEBUG/INFO no caminho
+  quente; WARNING e acima sempre saem.
+- Spans: `with span("openai_chat"):` mede a etapa em sdr_stage_duration_seconds{stage,outcome}
+  e conta as falhas em sdr_stage_errors_total{stage}.
+- RequestTimingMiddleware: latencia total por rota em sdr_http_request_duration_seconds e a
+  etapa "request_parse" (chegada da requisicao ate o endpoint comecar: leitura do corpo,
+  JSON e validacao do Pydantic), marcada com request_parsed() no inicio do endpoint.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from services.metrics import Counter, Histogram
+from services.settings import load_env
+
+load_env()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+STAGE_LATENCY = Histogram(
+    "sdr_stage_duration_seconds",
+    "Latencia de cada etapa do atendimento (parse, OpenAI, gatilho, Pipefy, Calendly)",
+    ["stage", "outcome"],
+)
+STAGE_ERRORS = Counter(
+    "sdr_stage_errors_total",
+    "Etapas que terminaram em erro",
+    ["stage"],
+)
+HTTP_LATENCY = Histogram(
+    "sdr_http_request_duration_seconds",
+    "Latencia das requisicoes recebidas pela API, por rota",
+    ["method", "route", "status"],
+)
+
+# Atributos padrao do LogRecord: o que sobrar (vindo de extra=...) vira campo do JSON
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# Momento em que a requisicao atual chegou (setado pelo middleware)
+_request_started: ContextVar[Optional[float]] = ContextVar("request_started", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por evento: ts, level, logger, msg + campos passados em extra=."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                event[key] = value
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar so uma fracao dos registros abaixo de WARNING."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging():
+    """Liga o logger "sdr" a fila + thread de escrita (idempotente)."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger("sdr")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Para a thread de escrita, esvaziando o que ainda estiver na fila."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger("sdr").handlers.clear()
+
+
+def _restart_logging_in_child():
+    """Depois de um fork (serve.py) a thread de escrita nao existe no filho: recria fila e thread."""
+    global _listener
+    if _listener is not None:
+        _listener = None
+        logging.getLogger("sdr").handlers.clear()
+        configure_logging()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_logging_in_child)
+
+
+def get_logger(name: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(f"sdr.{name}")
+
+
+log = get_logger("observability")
+
+
+class Span:
+    """Etapa em andamento; chame fail() quando ela "falhar" sem levantar excecao (ex: retorno {"error"})."""
+
+    __slots__ = ("stage", "outcome")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.outcome = "ok"
+
+    def fail(self):
+        self.outcome = "error"
+
+
+@contextmanager
+def span(stage: str) -> Iterator[Span]:
+    current = Span(stage)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.fail()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, stage=stage, outcome=current.outcome)
+        if current.outcome == "error":
+            STAGE_ERRORS.inc(stage=stage)
+        log.debug("span", extra={"stage": stage, "outcome": current.outcome, "duration_ms": round(elapsed * 1000, 2)})
+
+
+def request_parsed():
+    """Fecha a etapa "request_parse" da requisicao atual (chamar no inicio do endpoint)."""
+    started = _request_started.get()
+    if started is not None:
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage="request_parse", outcome="ok")
+
+
+class RequestTimingMiddleware:
+    """Middleware ASGI puro (sem BaseHTTPMiddleware, que atrapalha o streaming)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        token = _request_started.set(started)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_started.reset(token)
+            # Template da rota (ex: /sessions/{session_id}) para nao explodir a cardinalidade
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route, status=str(status["code"]))
@@ -1,82 +1,235 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
-from typing import List, Dict
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Optional, Tuple
 
-# Carregar as variaveis do arquivo .env
-load_dotenv()
+from services.admission import PRIORITY_BACKGROUND, AdmissionRejected, admission, conversation_priority
+from services.context_manager import ContextManager, SUMMARY_MAX_TOKENS, count_message_tokens
+from services.lead_extraction import LEAD_FAST_PATH, fast_path_reply, lead_extractor
+from services.observability import get_logger, span
+from services.prompts import build_messages, get_template, prefix_cache, record_usage
+from services.response_cache import response_cache
+from services.session_store import get_session_store
+from services.settings import get_settings
+from services.trigger_detection import CREATE_LEAD_TOOL, OPENAI_LEAD_TOOL_CALLING, tool_call_to_trigger
 
-# Pegar a chave de API do arquivo .env
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    # Garantir que o app falhe se a chave nao for encontrada
-    raise ValueError("OPENAI_API_KEY nao encontrada no arquivo .env")
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
-# Inicializar o cliente da OpenAI com a sua chave
-client = OpenAI(api_key=api_key)
+log = get_logger("openai_service")
 
 # Pegar o modelo do .env, ou usa um padrao se nao for definido
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_MODEL = get_settings().openai_model
 
-def generate_response(history: List[Dict[str, str]]) -> str:
+# Cliente ASSINCRONO da OpenAI, unico e compartilhado por todo o processo: ele mantem
+# o pool de conexoes HTTP aberto entre as requisicoes, em vez de abrir um novo a cada
+# mensagem. Criado no primeiro uso (get_client), nao no import: o SDK leva ~0.5s so
+# para importar, e turnos que nao chamam o LLM (cache, fast path) nao precisam dele.
+_client: Optional["AsyncOpenAI"] = None
+
+
+def preload_sdk():
+    """Importa o SDK da OpenAI (o lifespan chama numa thread, fora do caminho da requisicao)."""
+    import openai  # noqa: F401
+
+
+def get_client() -> "AsyncOpenAI":
+    """Cliente compartilhado, criado na primeira chamada com a chave do Settings."""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        settings = get_settings()
+        settings.require_openai()
+        _client = AsyncOpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url)
+    return _client
+
+
+async def close_client():
+    """Fecha o pool do cliente, se ele chegou a ser criado."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+# Controla a criatividade (0.0 = robotico, 1.0 = criativo); tambem faz parte da chave do cache
+OPENAI_TEMPERATURE = 0.7
+
+# Resposta devolvida ao cliente quando a chamada a OpenAI falha
+ERROR_REPLY = "Desculpe, ocorreu um erro ao processar sua solicitação."
+
+
+class StreamError(Exception):
+    """A geracao em streaming falhou (antes ou no meio do texto): quem consome sinaliza o erro."""
+
+
+async def summarize_history(previous_summary: Optional[str], messages: List[Dict[str, str]]) -> str:
+    """
+    Atualiza o resumo rolante da conversa: resumo anterior + mensagens novas → resumo novo.
+    Usado pelo ContextManager em background, nunca no caminho da resposta.
+    """
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Resumo anterior: {previous_summary}\n\nNovas mensagens:\n{transcript}"
+
+    messages = [get_template("summary").message, {"role": "user", "content": transcript}]
+    # Resumo e trabalho de fundo: entra na fila de admissao com a menor prioridade
+    async with admission.admit(PRIORITY_BACKGROUND, count_message_tokens(messages)) as ticket:
+        with span("openai_summary"):
+            response = await get_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0,
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+        ticket.settle(response.usage.total_tokens if response.usage else None)
+    return response.choices[0].message.content.strip()
+
+# Mesma lista em todas as chamadas: as tools abrem o prefixo do prompt no provedor
+_LEAD_TOOLS = {"tools": [CREATE_LEAD_TOOL]}
+
+def _lead_tools() -> Dict:
+    """Com OPENAI_LEAD_TOOL_CALLING, oferece a tool create_lead (o lead volta como tool call estruturado)."""
+    return _LEAD_TOOLS if OPENAI_LEAD_TOOL_CALLING else {}
+
+def _message_text(message) -> str:
+    """Texto da resposta; um tool call create_lead vira o mesmo JSON que o modelo escreveria."""
+    for call in message.tool_calls or []:
+        if call.function.name == CREATE_LEAD_TOOL["function"]["name"]:
+            converted = tool_call_to_trigger(call.function.arguments)
+            if converted is not None:
+                return converted
+    return message.content or ""
+
+# Orcamento de tokens do historico + cache de resumos (um por processo)
+context_manager = ContextManager(summarizer=summarize_history)
+
+async def _build_messages(history: Optional[List[Dict[str, str]]], session_id: Optional[str]) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """
+    Prepara o turno. Retorna (resposta local, mensagens):
+    - resposta local: quando a extracao de dados do lead ja resolve o turno sem LLM
+      (JSON create_lead ou a pergunta direta); nesse caso nao ha mensagens
+    - mensagens: system prompt + historico cortado no orcamento de tokens + dados do lead ja coletados
+      (nessa ordem, para o inicio do prompt se repetir entre turnos; ver services/prompts.py)
+    O historico vem do cliente ou, se vier um session_id, do session store.
+    """
+    if session_id is not None:
+        history = await get_session_store().get_history(session_id)
+    history = history or []
+
+    with span("lead_extraction"):
+        slots = lead_extractor.update(session_id, history)
+        local_reply = fast_path_reply(slots, history)
+    if local_reply is not None:
+        LEAD_FAST_PATH.inc(result="create_lead" if local_reply.startswith("{") else "direct_question")
+        return local_reply, []
+    LEAD_FAST_PATH.inc(result="llm")
+
+    context = await context_manager.prepare(history)
+    # Dados ja coletados vao no fim: o modelo nao pergunta de novo e o inicio do prompt nao muda
+    lead_context = slots.context_message()
+    return None, build_messages(context.messages, [lead_context] if lead_context is not None else None)
+
+async def generate_response(history: Optional[List[Dict[str, str]]] = None, session_id: Optional[str] = None) -> str:
     """
     Envia o HISTORICO da conversa para a OpenAI e retorna a resposta da IA.
+    O historico vem do cliente (history) ou do session store (session_id).
     """
-    
-    # Aqui fica o "Prompt do Sistema", onde defini a personalidade e objetivos da IA
-    system_prompt = {
-        "role": "system",
-        "content": """
-        Você é um agente SDR (Sales Development Representative) da Verzel, 
-        uma empresa de tecnologia e inovação.
-        Seu objetivo é conversar naturalmente e coletar 4 informações:
-        1. Nome
-        2. E-mail
-        3. Nome da Empresa
-        4. A necessidade ou desafio que o cliente enfrenta (need/dor).
-        
-        Seja sempre amigável, profissional. Siga o script:
-        1. Apresente-se e ao serviço.
-        2. Faça perguntas de descoberta para coletar as 4 informações.
-        3. Faça a "pergunta direta" (ex: "Você gostaria de seguir com uma conversa...?") 
-        
-        IMPORTANTE: Assim que você tiver coletado com sucesso TODAS as 4 informações (nome, e-mail, empresa, necessidade),
-        E o cliente confirmar interesse na "pergunta direta", você DEVE responder APENAS com
-        um JSON valido, e nada mais.
-        
-        O JSON deve ter o seguinte formato:
-        {
-            "action": "create_lead",
-            "data": {
-                "name": "Nome coletado",
-                "email": "email@coletado.com",
-                "company": "Empresa Coletada",
-                "need": "Necessidade coletada",
-                interest_confirmed: true
-            }
-        }
-        
-        Se o cliente NAO confirmar interesse na "pergunta direta", responda educadamente,
-        agradeca e retorne um JSON similar com "interest_confirmed": false.
-        
-        Enquanto voce nao tiver os 4 dados E a resposta da "pergunta direta",
-        continue a conversa normalmente,
-        """
-    }
-    
     # Montar a lista de mensagens, comecando pelo prompt do sistema
-    messages_to_send = [system_prompt] + history
+    local_reply, messages_to_send = await _build_messages(history, session_id)
+    if local_reply is not None:
+        return local_reply
+
+    # Turnos de abertura repetidos ("Oi", "Olá") saem do cache, sem chamar a OpenAI
+    cached, cache_keys = await response_cache.lookup(OPENAI_MODEL, OPENAI_TEMPERATURE, messages_to_send)
+    if cached is not None:
+        return cached
     
     try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages_to_send,
-            temperature=0.7 # Controla a criatividade (0.0 = robotico, 1.0 = criativo)
-        )
+        # Espera a vez na admissao (rate limit de requisicoes/tokens e concorrencia);
+        # fila cheia ou prazo vencido levantam AdmissionRejected (429 na API)
+        async with admission.admit(conversation_priority(messages_to_send), count_message_tokens(messages_to_send)) as ticket:
+            tools = _lead_tools()
+            prefix_cache.observe(messages_to_send, tools.get("tools"))
+            # await libera o event loop enquanto a OpenAI responde, em vez de prender uma thread
+            with span("openai_chat"):
+                response = await get_client().chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages_to_send,
+                    temperature=OPENAI_TEMPERATURE,
+                    **tools
+                )
+            ticket.settle(response.usage.total_tokens if response.usage else None)
+            record_usage(response.usage)
     
         # Extrair e retorna de texto da IA
-        ai_response = response.choices[0].message.content
+        ai_response = _message_text(response.choices[0].message)
+        await response_cache.store(cache_keys, ai_response)
         return ai_response
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        print(f"Erro ao gerar resposta da OpenAI: {e}")
-        return "Desculpe, ocorreu um erro ao processar sua solicitação."
\ No newline at end of file
+        log.error("Erro ao gerar resposta da OpenAI", extra={"error": str(e)})
+        return ERROR_REPLY
+
+async def generate_response_stream(history: Optional[List[Dict[str, str]]] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Versao em streaming do generate_response: devolve os pedacos de texto
+    da IA conforme a OpenAI vai gerando, em vez de esperar a resposta inteira.
+    Uma falha da OpenAI levanta StreamError (o texto ja enviado nao ganha um ERROR_REPLY colado).
+    """
+    local_reply, messages_to_send = await _build_messages(history, session_id)
+    if local_reply is not None:
+        yield local_reply
+        return
+
+    cached, cache_keys = await response_cache.lookup(OPENAI_MODEL, OPENAI_TEMPERATURE, messages_to_send)
+    if cached is not None:
+        yield cached
+        return
+
+    # A admissao vale para o stream inteiro; o span cobre a geracao (do pedido ate o ultimo chunk)
+    async with admission.admit(conversation_priority(messages_to_send), count_message_tokens(messages_to_send)) as ticket:
+        tools = _lead_tools()
+        prefix_cache.observe(messages_to_send, tools.get("tools"))
+        with span("openai_stream") as stage:
+            try:
+                stream = await get_client().chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages_to_send,
+                    temperature=OPENAI_TEMPERATURE,
+                    stream=True,
+                    # O ultimo chunk traz o usage (tokens e cached_tokens), como na resposta inteira
+                    stream_options={"include_usage": True},
+                    **tools
+                )
+                parts: List[str] = []
+                usage = None
+                # Argumentos do tool call create_lead chegam em pedacos, por indice
+                tool_names: Dict[int, str] = {}
+                tool_arguments: Dict[int, List[str]] = {}
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    # Alguns chunks (ex: o ultimo) vem sem choices ou sem conteudo
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    for call in delta.tool_calls or []:
+                        if call.function and call.function.name:
+                            tool_names[call.index] = call.function.name
+                        if call.function and call.function.arguments:
+                            tool_arguments.setdefault(call.index, []).append(call.function.arguments)
+                    if delta.content:
+                        parts.append(delta.content)
+                        yield delta.content
+                ticket.settle(usage.total_tokens if usage else None)
+                record_usage(usage)
+                for index, name in tool_names.items():
+                    if name == CREATE_LEAD_TOOL["function"]["name"]:
+                        converted = tool_call_to_trigger("".join(tool_arguments.get(index, [])))
+                        if converted is not None:
+                            yield converted
+                            return
+                await response_cache.store(cache_keys, "".join(parts))
+            except Exception as e:
+                stage.fail()
+                log.error("Erro ao gerar resposta em streaming da OpenAI", extra={"error": str(e)})
+                raise StreamError(str(e)) from e
@@ -1,33 +1,204 @@
+import asyncio
 import os
-import requests
-from dotenv import load_dotenv
+import time
+import httpx
+from typing import Dict, List, Optional, Set, Tuple
 
-# Carregar as variaveis do arquivo .env
-load_dotenv()
+from services import http_client
+from services.graphql_documents import SLOT, DocumentRegistry, InputTemplate
+from services.metrics import Counter, Histogram
+from services.observability import get_logger, span
+from services.settings import get_settings
+
+log = get_logger("pipefy_service")
+
+_settings = get_settings()
 
 # Pegar as senhas do Pipefy do arquivo .env
-PIPEFY_API_KEY = os.getenv("PIPEFY_API_KEY")
-PIPE_ID = os.getenv("PIPE_ID")
-PHASE_ID = os.getenv("PHASE_ID")
+PIPEFY_API_KEY = _settings.pipefy_api_key
+PIPE_ID = _settings.pipe_id
+PHASE_ID = _settings.phase_id
 
 # Pegar os IDs dos 7 campos do Pipefy do arquivo .env
-FIELD_NAME = os.getenv("PIPEFY_FIELD_NAME")
-FIELD_EMAIL = os.getenv("PIPEFY_FIELD_EMAIL")
-FIELD_COMPANY = os.getenv("PIPEFY_FIELD_COMPANY")
-FIELD_NEED = os.getenv("PIPEFY_FIELD_NEED")
-FIELD_INTEREST = os.getenv("PIPEFY_FIELD_INTEREST")
-FIELD_MEETING_LINK = os.getenv("PIPEFY_FIELD_MEETING_LINK")
-FIELD_MEETING_TIME = os.getenv("PIPEFY_FIELD_MEETING_TIME")
+FIELD_NAME = _settings.pipefy_field_name
+FIELD_EMAIL = _settings.pipefy_field_email
+FIELD_COMPANY = _settings.pipefy_field_company
+FIELD_NEED = _settings.pipefy_field_need
+FIELD_INTEREST = _settings.pipefy_field_interest
+FIELD_MEETING_LINK = _settings.pipefy_field_meeting_link
+FIELD_MEETING_TIME = _settings.pipefy_field_meeting_time
 
 # O "endereço" da API do Pipefy
-PIPEFY_GRAPHQL_URL = "https://api.pipefy.com/graphql"
+PIPEFY_GRAPHQL_URL = _settings.pipefy_graphql_url
+
+# Batching: mutations que chegam dentro de uma janela curta (ou ate N delas)
+# vao juntas num unico documento GraphQL, com um alias por mutation
+PIPEFY_BATCH_WINDOW_MS = float(os.getenv("PIPEFY_BATCH_WINDOW_MS", "50"))
+PIPEFY_BATCH_MAX_SIZE = int(os.getenv("PIPEFY_BATCH_MAX_SIZE", "10"))
+
+# Persisted queries (APQ): manda so o hash do documento + variables; se o servidor
+# nao conhecer o hash, reenvia com o texto. Desligado por padrao.
+PIPEFY_PERSISTED_QUERIES = os.getenv("PIPEFY_PERSISTED_QUERIES", "false").lower() == "true"
+
+# Mutations usadas, registradas uma vez: os valores vao sempre em "variables"
+documents = DocumentRegistry("PipefyBatch")
+documents.register("createCard", "CreateCardInput!", "card { id title url }")
+documents.register("updateFieldsValues", "UpdateFieldsValuesInput!", "clientMutationId success")
+# Ja deixa compilados os documentos de uma mutation so (o caso mais comum)
+for _field in ("createCard", "updateFieldsValues"):
+    documents.compile_batch((_field,))
+
+# Inputs com os IDs fixos ja serializados: por chamada so entram os valores (SLOT)
+_CARD_INPUT = InputTemplate({
+    "pipe_id": PIPE_ID,
+    "phase_id": PHASE_ID,
+    "fields_attributes": [
+        {"field_id": FIELD_NAME, "field_value": SLOT},
+        {"field_id": FIELD_EMAIL, "field_value": SLOT},
+        {"field_id": FIELD_COMPANY, "field_value": SLOT},
+        {"field_id": FIELD_NEED, "field_value": SLOT},
+        {"field_id": FIELD_INTEREST, "field_value": SLOT},
+    ],
+})
+_MEETING_INPUT = InputTemplate({
+    "nodeId": SLOT,  # ID do Card a ser atualizado
+    "values": [
+        {"fieldId": FIELD_MEETING_LINK, "value": SLOT},
+        {"fieldId": FIELD_MEETING_TIME, "value": SLOT},
+    ],
+})
+
+PIPEFY_MUTATIONS = Counter(
+    "sdr_pipefy_mutations_total",
+    "Mutations enviadas ao Pipefy, por tipo",
+    ["kind"],
+)
+PIPEFY_BATCH_SIZE = Histogram(
+    "sdr_pipefy_batch_size",
+    "Quantidade de mutations por requisicao ao Pipefy",
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+PIPEFY_BATCH_LATENCY = Histogram(
+    "sdr_pipefy_batch_request_seconds",
+    "Latencia da requisicao HTTP de cada lote",
+)
+PIPEFY_MUTATION_LATENCY = Histogram(
+    "sdr_pipefy_mutation_seconds",
+    "Tempo de cada mutation do submit ao resultado (espera da janela + requisicao)",
+    ["kind"],
+)
+
+def _pipefy_headers() -> Dict[str, str]:
+    """Cabecalhos de autorizacao da API do Pipefy."""
+    return {
+        "Authorization": f"Bearer {PIPEFY_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+# (tipo da mutation, input dela ja serializado, future do chamador, momento do submit)
+_Pending = Tuple[str, str, asyncio.Future, float]
+
+def _is_persisted_query_miss(body: dict) -> bool:
+    return any("PersistedQueryNotFound" in str(err.get("message", "")) for err in body.get("errors") or [])
+
+async def _post_document(fields: Tuple[str, ...], inputs: List[str]) -> dict:
+    """Envia um documento pre-compilado com os inputs ja serializados (via hash, se APQ estiver ligado)."""
+    document = documents.compile_batch(fields)
+    if PIPEFY_PERSISTED_QUERIES:
+        content = document.request_body(inputs, persisted=True)
+        response = await http_client.request("pipefy", "POST", PIPEFY_GRAPHQL_URL, content=content, headers=_pipefy_headers())
+        response.raise_for_status()
+        body = response.json()
+        if not _is_persisted_query_miss(body):
+            return body
+    content = document.request_body(inputs)
+    response = await http_client.request("pipefy", "POST", PIPEFY_GRAPHQL_URL, content=content, headers=_pipefy_headers())
+    response.raise_for_status()
+    return response.json()
+
+class PipefyBatcher:
+    """
+    Junta mutations pendentes e envia como um documento so (pre-compilado no registro):
+        mutation PipefyBatch($m0: CreateCardInput!, $m1: ...) { m0: createCard(input: $m0) {...} m1: ... }
+    com os inputs em {"m0": ..., "m1": ...}.
+    O resultado de cada alias (e os erros cujo path comeca nele) volta para quem pediu,
+    no mesmo formato de uma resposta individual: {"data": {<tipo>: ...}, "errors": [...]}.
+    """
+
+    def __init__(self, window_seconds: float, max_size: int):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.Task] = None
+        # Referencias para as tasks de envio nao serem coletadas pelo GC no meio
+        self._sending: Set[asyncio.Task] = set()
+
+    async def submit(self, kind: str, encoded_input: str) -> dict:
+        """Enfileira a mutation (tipo + input ja serializado) no lote atual e espera o resultado dela."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((kind, encoded_input, future, time.perf_counter()))
+        if len(self._pending) >= self.max_size:
+            self._dispatch(self._pending[:self.max_size])
+            del self._pending[:self.max_size]
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    def _dispatch(self, batch: List[_Pending]):
+        task = asyncio.create_task(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window_seconds)
+        self._timer = None
+        while self._pending:
+            self._dispatch(self._pending[:self.max_size])
+            del self._pending[:self.max_size]
+
+    async def _send(self, batch: List[_Pending]):
+        # Agrupado por tipo (sort estavel: a ordem dentro de cada tipo se mantem). Assim o
+        # documento depende so de quantas mutations de cada tipo ha no lote, nao da ordem de
+        # chegada: com 2 tipos e lotes de ate 10 sao 65 documentos, em vez de ate 2^10 por tamanho
+        batch = sorted(batch, key=lambda item: item[0])
+        fields = tuple(kind for kind, _, _, _ in batch)
+        inputs = [item_input for _, item_input, _, _ in batch]
+        PIPEFY_BATCH_SIZE.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            body = await _post_document(fields, inputs)
+        except Exception as e:
+            # Falha do lote inteiro (HTTP/transporte): todos os chamadores recebem o erro
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            PIPEFY_BATCH_LATENCY.observe(time.perf_counter() - started)
+
+        data = body.get("data") or {}
+        errors = body.get("errors") or []
+        for i, (kind, _, future, submitted_at) in enumerate(batch):
+            alias = f"m{i}"
+            # Erros sem path (ex: documento invalido) valem para todas as mutations do lote
+            item_errors = [err for err in errors if not err.get("path") or err["path"][0] == alias]
+            result = {"data": {kind: data.get(alias) or {}}}
+            if item_errors:
+                result["errors"] = item_errors
+            PIPEFY_MUTATIONS.inc(kind=kind)
+            PIPEFY_MUTATION_LATENCY.observe(time.perf_counter() - submitted_at, kind=kind)
+            if not future.done():
+                future.set_result(result)
+
+# Batcher compartilhado pelo processo
+_batcher = PipefyBatcher(PIPEFY_BATCH_WINDOW_MS / 1000, PIPEFY_BATCH_MAX_SIZE)
 
 # Função para criar um card no Pipefy
-def create_pipefy_card(lead_data: dict) -> dict:
+async def create_pipefy_card(lead_data: dict) -> dict:
     """
     Cria um novo card no Pipefy com os dados do lead qualificado.
     """
-    print(f"Iniciando criacao de card no Pipefy para: {lead_data.get('email')}")
+    log.info("Iniciando criacao de card no Pipefy", extra={"email": lead_data.get("email")})
     
     # Pegar os dados do JSON da IA
     # Utilizacao do .get() para evitar erros de campos inexistentes
@@ -39,125 +210,69 @@ def create_pipefy_card(lead_data: dict) -> dict:
     interest = str(lead_data.get("interest_confirmed", False)).lower()
     
     # Agora vamos dizer para o Pipefy criar o card com esses dados
-    mutation = f"""
-    mutation {{
-      createCard(input: {{
-        pipe_id: {PIPE_ID},
-        phase_id: {PHASE_ID},
-        fields_attributes: [
-          {{field_id: "{FIELD_NAME}", field_value: "{name}"}},
-          {{field_id: "{FIELD_EMAIL}", field_value: "{email}"}},
-          {{field_id: "{FIELD_COMPANY}", field_value: "{company}"}},
-          {{field_id: "{FIELD_NEED}", field_value: "{need}"}},
-          {{field_id: "{FIELD_INTEREST}", field_value: "{interest}"}}
-        ]
-      }}) {{
-        card {{
-          id
-          title
-          url
-        }}
-      }}
-    }}
-    """
-    
-    # Preparar a "autorizacao"
-    headers = {
-        "Authorization": f"Bearer {PIPEFY_API_KEY}",
-        "Content-Type": "application/json"     
-    }       
-    
-    # Preparar os dados para envio
-    payload = {
-        "query": mutation
-    }
+    # (documento e parte fixa do input ja estao prontos; aqui so entram os valores)
+    card_input = _CARD_INPUT.render(name, email, company, need, interest)
     
     try:
-        # Envia a requisicao para a API do Pipefy
-        response = requests.post(PIPEFY_GRAPHQL_URL, json=payload, headers=headers) 
-        
-        # Levanta um erro se a requisicao falhar (ex: API Key invalida)
-        response.raise_for_status()
-        
-        response_json = response.json()
+        # Envia pelo batcher: junta com outras mutations da mesma janela numa requisicao so
+        # (erros HTTP, ex: API Key invalida, chegam aqui como excecao)
+        with span("pipefy_create_card"):
+            response_json = await _batcher.submit("createCard", card_input)
         
         # Verifica se o *GraphQL* retornou algum erro (ex: PIPE_ID invalido)
         if "errors" in response_json:
-            print(f"Erro do Pipefy ao criar card: {response_json['errors']}")
+            log.error("Erro do Pipefy ao criar card", extra={"errors": response_json["errors"]})
             return {"error": response_json["errors"]} 
         card_data = response_json.get("data", {}).get("createCard", {}).get("card", {})
-        print(f"Card criado com sucesso no Pipefy! ID: {card_data.get('id')}")
+        log.info("Card criado com sucesso no Pipefy", extra={"card_id": card_data.get("id")})
         return card_data
-    except requests.exceptions.HTTPError as http_err:
-        print(f"Erro HTTP ao chamar API Pipefy: {http_err}")
-        print(f"Resposta: {response.text}")
-        return {"error": str(http_err)}
+    # "ambiguous": o Pipefy pode ter criado o card mesmo assim (timeout de leitura, 500/502/504)
+    except httpx.HTTPStatusError as http_err:
+        log.error("Erro HTTP ao chamar API Pipefy", extra={"error": str(http_err), "response": http_err.response.text})
+        return {"error": str(http_err), "ambiguous": http_client.maybe_processed(http_err)}
     except Exception as e:
-        print(f"Erro inesperado no pipefy_service: {e}")
-        return {"error": str(e)}
+        log.error("Erro inesperado no pipefy_service", extra={"error": str(e)})
+        return {"error": str(e), "ambiguous": http_client.maybe_processed(e)}
 
 # Função para atualizar o card do Pipefy com as informacoes da reuniao
-def update_pipefy_card_meeting_info(card_id: str, meeting_link: str, meeting_datetime: str) -> bool:
+async def update_pipefy_card_meeting_info(card_id: str, meeting_link: str, meeting_datetime: str) -> bool:
     """
     Atualiza um card existente no Pipefy com o link e a daata/hora da reuniao
     Retorna True se foi bem-sucedido, False caso contrario.
     """
-    print(f"Atualizando card {card_id} no Pipefy com informações da reunião...")
+    log.info("Atualizando card no Pipefy com informações da reunião", extra={"card_id": card_id})
     
     # Precisamos garantir que os IDS dos campos de link e data/hora foram carregados
     if not FIELD_MEETING_LINK or not FIELD_MEETING_TIME:
-      print(f"Erro: IDs dos campos de reunião não encontrados no .env")
+      log.error("IDs dos campos de reunião não encontrados no .env")
       return False
     
-    # A query GrapgQL para ATUALIZAR um card
+    # O input da mutation de ATUALIZAR um card
     # DIZEMOS: "Para o card com este ID, atualize estes campos com estes valores"
-    mutation = f"""
-        mutation {{
-          updateFieldsValues(input: {{
-            nodeId: "{card_id}",  # ID do Card a ser atualizado
-            values: [
-              {{ fieldId: "{FIELD_MEETING_LINK}", value: "{meeting_link}" }},
-              {{ fieldId: "{FIELD_MEETING_TIME}", value: "{meeting_datetime}" }}
-            ]
-          }}) {{
-            clientMutationId
-            success
-          }}
-        }}
-    """
-    
-    headers = {
-        "Authorization": f"Bearer {PIPEFY_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "query": mutation
-    }
+    update_input = _MEETING_INPUT.render(card_id, meeting_link, meeting_datetime)
     
     try :
-      response = requests.post(PIPEFY_GRAPHQL_URL, json=payload, headers=headers)
-      response.raise_for_status() # Verifica erros HTTP
-      response_json = response.json()
+      # Tambem vai pelo batcher (erros HTTP chegam como excecao)
+      with span("pipefy_update_card"):
+          response_json = await _batcher.submit("updateFieldsValues", update_input)
       
       # Verifica erros do GraphQL
       if "errors" in response_json:
-            print(f"Erro do GraphQL ao atualizar card {card_id}: {response_json['errors']}")
+            log.error("Erro do GraphQL ao atualizar card", extra={"card_id": card_id, "errors": response_json["errors"]})
             return False
           
       update_result = response_json.get("data", {}).get("updateFieldsValues", {})      
       if update_result and update_result.get("success") is True:
-          print(f"Card {card_id} atualizado com sucesso no Pipefy.")
+          log.info("Card atualizado com sucesso no Pipefy", extra={"card_id": card_id})
           return True
       else:
           # Se a chave 'success' não existir ou for false, algo deu errado
-          print(f"Falha ao atualizar card {card_id}, resposta inesperada ou não sucedida: {response_json}")
+          log.error("Falha ao atualizar card, resposta inesperada ou não sucedida", extra={"card_id": card_id, "response": response_json})
           return False
              
-    except requests.exceptions.HTTPError as http_err:
-        print(f"Erro HTTP ao atualizar card {card_id} no Pipefy: {http_err}")
-        print(f"Resposta: {response.text}")
+    except httpx.HTTPStatusError as http_err:
+        log.error("Erro HTTP ao atualizar card no Pipefy", extra={"card_id": card_id, "error": str(http_err), "response": http_err.response.text})
         return False
     except Exception as e:
-        print(f"Erro inesperado ao atualizar card {card_id} no pipefy_service: {e}")
+        log.error("Erro inesperado ao atualizar card no pipefy_service", extra={"card_id": card_id, "error": str(e)})
         return False
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Montagem do prompt enviado a OpenAI, pensada para o cache de prefixo do provedor.
+
+A OpenAI reaproveita o processamento do inicio do prompt quando ele e identico, byte a
+byte, a um prompt recente (a partir de 1024 tokens, em blocos de 128): menos latencia
+ate o primeiro token e tokens de entrada mais baratos. Para isso o prompt sai sempre
+na mesma ordem:
+1. prefixo estatico: tools + system prompt versionado (SDR_PROMPT_VERSION), compilado uma
+   vez no import (texto normalizado, um unico dict reaproveitado por todas as chamadas);
+2. historico: so cresce no fim a cada turno, entao o prompt do turno anterior e prefixo
+   do atual. O resumo rolante fica logo depois do system prompt: ele so muda quando a
+   janela do historico anda (o que ja quebra o prefixo), entao no fim nao acertaria mais;
+3. partes dinamicas (dados do lead ja coletados) sempre no fim.
+
+Tambem estima localmente quantos tokens de cada prompt devem vir do cache do provedor
+(prefixos vistos nos ultimos PROMPT_CACHE_TTL_SECONDS) e registra o numero real quando
+a resposta traz usage.prompt_tokens_details.cached_tokens.
+"""
+
+import hashlib
+import json
+import os
+import textwrap
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.context_manager import TOKENS_PER_MESSAGE, count_tokens
+from services.metrics import Counter
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+SDR_PROMPT_VERSION = os.getenv("SDR_PROMPT_VERSION", "v2")
+# Quanto tempo um prefixo continua no cache do provedor sem uso (a OpenAI fala em 5-10 min)
+PROMPT_CACHE_TTL_SECONDS = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "300"))
+PROMPT_PREFIX_CACHE_SIZE = int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "20000"))
+
+# Regras do cache de prompt da OpenAI: prompt minimo e granularidade do prefixo reaproveitado
+PROVIDER_CACHE_MIN_TOKENS = 1024
+PROVIDER_CACHE_BLOCK_TOKENS = 128
+
+PROMPT_TOKENS = Counter(
+    "sdr_prompt_tokens_total",
+    "Tokens de prompt enviados a OpenAI: cached/uncached, por estimativa local ou informados pelo provedor",
+    ["kind", "source"],
+)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """Prompt versionado, compilado uma vez: a mensagem pronta e o hash do texto."""
+
+    name: str
+    version: str
+    message: Dict[str, str]
+    fingerprint: str
+
+
+_TEMPLATES: Dict[Tuple[str, str], PromptTemplate] = {}
+_ACTIVE: Dict[str, str] = {}
+
+
+def register(name: str, version: str, text: str, role: str = "system", normalize: bool = True) -> PromptTemplate:
+    """
+    Compila e registra uma versao do prompt. normalize tira a indentacao do codigo e os
+    espacos nas pontas (tokens que nao mudam nada para o modelo); normalize=False mantem
+    o texto byte a byte (versoes antigas, para o cache de respostas continuar valendo).
+    """
+    content = textwrap.dedent(text).strip() if normalize else text
+    template = PromptTemplate(
+        name=name,
+        version=version,
+        message={"role": role, "content": content},
+        fingerprint=hashlib.sha256(content.encode()).hexdigest()[:12],
+    )
+    _TEMPLATES[(name, version)] = template
+    return template
+
+
+def activate(name: str, version: str):
+    if (name, version) not in _TEMPLATES:
+        versions = ", ".join(sorted(v for n, v in _TEMPLATES if n == name))
+        raise ValueError(f"Versao de prompt invalida para {name}: {version} (use {versions})")
+    _ACTIVE[name] = version
+
+
+def get_template(name: str, version: Optional[str] = None) -> PromptTemplate:
+    """Versao pedida do prompt, ou a ativa. A mensagem e compartilhada: nao altere o dict."""
+    return _TEMPLATES[(name, version or _ACTIVE[name])]
+
+
+# --- Templates ---
+
+# v1: o prompt original, byte a byte (inclusive a indentacao de 8 espacos e a chave sem aspas)
+register("sdr_system", "v1", """
+        Você é um agente SDR (Sales Development Representative) da Verzel, 
+        uma empresa de tecnologia e inovação.
+        Seu objetivo é conversar naturalmente e coletar 4 informações:
+        1. Nome
+        2. E-mail
+        3. Nome da Empresa
+        4. A necessidade ou desafio que o cliente enfrenta (need/dor).
+        
+        Seja sempre amigável, profissional. Siga o script:
+        1. Apresente-se e ao serviço.
+        2. Faça perguntas de descoberta para coletar as 4 informações.
+        3. Faça a "pergunta direta" (ex: "Você gostaria de seguir com uma conversa...?") 
+        
+        IMPORTANTE: Assim que você tiver coletado com sucesso TODAS as 4 informações (nome, e-mail, empresa, necessidade),
+        E o cliente confirmar interesse na "pergunta direta", você DEVE responder APENAS com
+        um JSON valido, e nada mais.
+        
+        O JSON deve ter o seguinte formato:
+        {
+            "action": "create_lead",
+            "data": {
+                "name": "Nome coletado",
+                "email": "email@coletado.com",
+                "company": "Empresa Coletada",
+                "need": "Necessidade coletada",
+                interest_confirmed: true
+            }
+        }
+        
+        Se o cliente NAO confirmar interesse na "pergunta direta", responda educadamente,
+        agradeca e retorne um JSON similar com "interest_confirmed": false.
+        
+        Enquanto voce nao tiver os 4 dados E a resposta da "pergunta direta",
+        continue a conversa normalmente,
+        """
+, normalize=False)
+
+# v2: mesmo conteudo, sem a indentacao, com o JSON numa linha so e explicando as
+# mensagens de sistema que vao no fim (dados do lead ja coletados)
+register("sdr_system", "v2", """
+    Você é um agente SDR (Sales Development Representative) da Verzel, uma empresa de tecnologia e inovação.
+    Seu objetivo é conversar naturalmente e coletar 4 informações:
+    1. Nome
+    2. E-mail
+    3. Nome da Empresa
+    4. A necessidade ou desafio que o cliente enfrenta (need/dor).
+
+    Seja sempre amigável, profissional. Siga o script:
+    1. Apresente-se e ao serviço.
+    2. Faça perguntas de descoberta para coletar as 4 informações.
+    3. Faça a "pergunta direta" (ex: "Você gostaria de seguir com uma conversa...?")
+
+    Mensagens de sistema no fim da conversa trazem os dados do lead já identificados e os que ainda faltam:
+    use-as e não pergunte de novo o que o cliente já informou.
+
+    IMPORTANTE: Assim que você tiver coletado com sucesso TODAS as 4 informações (nome, e-mail, empresa, necessidade),
+    E o cliente confirmar interesse na "pergunta direta", você DEVE responder APENAS com um JSON valido, e nada mais.
+
+    O JSON deve ter o seguinte formato:
+    {"action": "create_lead", "data": {"name": "Nome coletado", "email": "email@coletado.com", "company": "Empresa Coletada", "need": "Necessidade coletada", "interest_confirmed": true}}
+
+    Se o cliente NAO confirmar interesse na "pergunta direta", responda educadamente,
+    agradeca e retorne um JSON similar com "interest_confirmed": false.
+
+    Enquanto voce nao tiver os 4 dados E a resposta da "pergunta direta", continue a conversa normalmente.
+""")
+
+# Prompt usado so para resumir os turnos antigos da conversa
+register("summary", "v1", (
+    "Resuma a conversa abaixo entre um agente SDR e um cliente em poucas frases, em português. "
+    "Preserve SEMPRE os dados já coletados (nome, e-mail, empresa, necessidade), "
+    "se o cliente já confirmou ou recusou interesse e o que ficou pendente."
+))
+
+activate("sdr_system", SDR_PROMPT_VERSION)
+activate("summary", "v1")
+
+
+# --- Montagem ---
+
+def build_messages(
+    history: List[Dict[str, str]], dynamic: Optional[List[Dict[str, str]]] = None
+) -> List[Dict[str, str]]:
+    """Prefixo estatico (system prompt ativo) + historico + partes dinamicas no fim."""
+    messages = [get_template("sdr_system").message]
+    messages.extend(history)
+    if dynamic:
+        messages.extend(dynamic)
+    return messages
+
+
+def _tools_tokens(tools: Optional[List[Dict[str, Any]]]) -> Tuple[str, int]:
+    """As tools vao antes das mensagens no prompt do provedor: entram no inicio do prefixo."""
+    if not tools:
+        return "", 0
+    serialized = json.dumps(tools, sort_keys=True, ensure_ascii=False)
+    return serialized, count_tokens(serialized)
+
+
+class PrefixCacheEstimator:
+    """
+    Estimativa local do cache de prompt do provedor: guarda o hash encadeado de cada
+    prefixo (tools + mensagens) enviado nos ultimos ttl segundos e, para um prompt novo,
+    procura o maior prefixo ja visto. Conservadora: conta so prefixos que terminam em
+    fronteira de mensagem (o provedor pode aproveitar um pedaco da mensagem seguinte).
+    """
+
+    def __init__(self, ttl: float = PROMPT_CACHE_TTL_SECONDS, max_size: int = PROMPT_PREFIX_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # hash do prefixo -> ultima vez que foi enviado
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        # Ultima lista de tools vista e a serializacao dela (as tools sao constantes do modulo)
+        self._tools_cache: Tuple[Optional[List[Dict[str, Any]]], str, int] = (None, "", 0)
+
+    def _tools(self, tools: Optional[List[Dict[str, Any]]]) -> Tuple[str, int]:
+        if self._tools_cache[0] is not tools:
+            self._tools_cache = (tools, *_tools_tokens(tools))
+        return self._tools_cache[1], self._tools_cache[2]
+
+    def observe(self, messages: List[Dict[str, str]], tools: Optional[List[Dict[str, Any]]] = None) -> Tuple[int, int]:
+        """Registra o prompt e retorna (tokens que devem vir do cache, tokens do prompt)."""
+        now = time.monotonic()
+        serialized_tools, total = self._tools(tools)
+        digest = hashlib.sha1(serialized_tools.encode())
+        cached_prefix = 0
+        for message in messages:
+            content = message.get("content") or ""
+            digest.update(f"\x00{message.get('role')}\x00{content}".encode())
+            total += count_tokens(content) + TOKENS_PER_MESSAGE
+            prefix_hash = digest.copy().hexdigest()
+            seen_at = self._seen.get(prefix_hash)
+            if seen_at is not None and now - seen_at <= self.ttl:
+                cached_prefix = total
+            self._seen[prefix_hash] = now
+            self._seen.move_to_end(prefix_hash)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+        if total < PROVIDER_CACHE_MIN_TOKENS or cached_prefix < PROVIDER_CACHE_MIN_TOKENS:
+            cached = 0
+        else:
+            cached = cached_prefix // PROVIDER_CACHE_BLOCK_TOKENS * PROVIDER_CACHE_BLOCK_TOKENS
+        PROMPT_TOKENS.inc(cached, kind="cached", source="estimate")
+        PROMPT_TOKENS.inc(total - cached, kind="uncached", source="estimate")
+        return cached, total
+
+
+def record_usage(usage: Any):
+    """Tokens de prompt em cache segundo o proprio provedor (usage da resposta), se vierem."""
+    if usage is None or not usage.prompt_tokens:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    PROMPT_TOKENS.inc(cached, kind="cached", source="provider")
+    PROMPT_TOKENS.inc(usage.prompt_tokens - cached, kind="uncached", source="provider")
+
+
+# Estimador compartilhado pelo processo
+prefix_cache = PrefixCacheEstimator()
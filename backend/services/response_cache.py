@@ -0,0 +1,179 @@
+"""
+Cache de respostas da OpenAI para turnos repetidos.
+A maioria das conversas comeca igual ("Oi", "Olá, quero saber mais"), e pagar
+um round trip inteiro ao LLM para cada uma delas nao faz sentido.
+
+- chave exata: hash do system prompt + modelo + temperatura + mensagens (normalizadas)
+- chave "normalizada" (opcional): so para o primeiro turno curto do usuario,
+  ignorando caixa, acentos e pontuacao ("Oi!" == "oi")
+- turnos que podem gerar o JSON create_lead nunca passam pelo cache
+- com SHARED_CACHE_PATH, um miss em memoria ainda consulta o cache SQLite
+  compartilhado entre os workers (ver services/shared_cache.py)
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from services.metrics import Counter
+from services.shared_cache import get_shared_cache
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# Ate quantos turnos do usuario a conversa ainda e considerada "abertura"
+RESPONSE_CACHE_MAX_USER_TURNS = int(os.getenv("RESPONSE_CACHE_MAX_USER_TURNS", "2"))
+# Match normalizado so vale para a primeira mensagem, se ela for curta
+RESPONSE_CACHE_FUZZY_ENABLED = os.getenv("RESPONSE_CACHE_FUZZY_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_FUZZY_MAX_CHARS = int(os.getenv("RESPONSE_CACHE_FUZZY_MAX_CHARS", "60"))
+
+CACHE_LOOKUPS = Counter(
+    "sdr_response_cache_lookups_total",
+    "Consultas ao cache de respostas: hit_exact, hit_normalized, hit_shared, miss ou bypass",
+    ["result"],
+)
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Minusculas, sem acentos, sem pontuacao e com espacos colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def is_cacheable(messages: List[Dict[str, str]]) -> bool:
+    """
+    Decide se o turno pode usar o cache. Fica de fora qualquer conversa que ja
+    passou da abertura ou que ja tem um e-mail: a partir dai a resposta pode ser
+    o JSON create_lead, que depende dos dados daquela pessoa.
+    """
+    user_turns = 0
+    for message in messages:
+        if message.get("role") == "system":
+            continue
+        content = message.get("content") or ""
+        if message.get("role") == "user":
+            user_turns += 1
+        if _EMAIL_RE.search(content) or "create_lead" in content:
+            return False
+    return 0 < user_turns <= RESPONSE_CACHE_MAX_USER_TURNS
+
+
+def is_storable(response: str) -> bool:
+    """So guarda respostas de texto: nada que pareca JSON (gatilho) ou venha vazio."""
+    stripped = (response or "").lstrip()
+    return bool(stripped) and stripped[0] not in "{`"
+
+
+def _digest(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()).hexdigest()
+
+
+def make_keys(model: str, temperature: float, messages: List[Dict[str, str]]) -> Tuple[str, Optional[str]]:
+    """
+    Retorna (chave exata, chave normalizada ou None).
+    `messages` ja inclui o system prompt, entao mudar o prompt invalida o cache.
+    """
+    exact = _digest([model, temperature, [[m.get("role"), (m.get("content") or "").strip()] for m in messages]])
+
+    fuzzy = None
+    conversation = [m for m in messages if m.get("role") != "system"]
+    if (
+        RESPONSE_CACHE_FUZZY_ENABLED
+        and len(conversation) == 1
+        and len(conversation[0].get("content") or "") <= RESPONSE_CACHE_FUZZY_MAX_CHARS
+    ):
+        system = [(m.get("content") or "").strip() for m in messages if m.get("role") == "system"]
+        fuzzy = _digest([model, temperature, system, normalize_text(conversation[0]["content"])])
+    return exact, fuzzy
+
+
+class ResponseCache:
+    """LRU com TTL: cada entrada expira em ttl_seconds e, cheio, sai a menos usada."""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _get_shared(self, key: str) -> Optional[str]:
+        """Segunda camada: o cache compartilhado entre processos (se ligado)."""
+        shared = get_shared_cache()
+        if shared is None:
+            return None
+        value = await shared.get("response", key)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    async def lookup(self, model: str, temperature: float, messages: List[Dict[str, str]]) -> Tuple[Optional[str], Optional[Tuple[str, Optional[str]]]]:
+        """
+        Procura a resposta para este turno.
+        Retorna (resposta ou None, chaves para guardar depois ou None se o turno nao e cacheavel).
+        """
+        if not RESPONSE_CACHE_ENABLED or not is_cacheable(messages):
+            CACHE_LOOKUPS.inc(result="bypass")
+            return None, None
+
+        exact, fuzzy = make_keys(model, temperature, messages)
+        cached = self.get(exact)
+        if cached is not None:
+            CACHE_LOOKUPS.inc(result="hit_exact")
+            return cached, None
+        if fuzzy is not None:
+            cached = self.get(fuzzy)
+            if cached is not None:
+                CACHE_LOOKUPS.inc(result="hit_normalized")
+                return cached, None
+        for key in (exact, fuzzy):
+            if key is not None:
+                cached = await self._get_shared(key)
+                if cached is not None:
+                    CACHE_LOOKUPS.inc(result="hit_shared")
+                    return cached, None
+        CACHE_LOOKUPS.inc(result="miss")
+        return None, (exact, fuzzy)
+
+    async def store(self, keys: Optional[Tuple[str, Optional[str]]], response: str):
+        """Guarda a resposta nas chaves devolvidas pelo lookup (se o turno era cacheavel)."""
+        if keys is None or not is_storable(response):
+            return
+        shared = get_shared_cache()
+        for key in keys:
+            if key is None:
+                continue
+            self.set(key, response)
+            if shared is not None:
+                await shared.set("response", key, response, self.ttl_seconds)
+
+
+# Cache compartilhado pelo processo
+response_cache = ResponseCache()
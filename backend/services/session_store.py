@@ -0,0 +1,226 @@
+"""
+Armazenamento de conversas no servidor.
+O frontend cria uma sessao e manda so a mensagem nova; o historico fica aqui.
+Dois backends plugaveis (escolhidos por SESSION_STORE no .env):
+- "memory": dicionario em memoria com LRU + TTL (padrao, zero dependencias)
+- "sqlite": arquivo SQLite, sobrevive a restart do processo
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# --- Limites (podem ser ajustados pelo .env) ---
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(60 * 60 * 24)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "200"))
+
+
+class SessionNotFound(Exception):
+    """A sessao nao existe ou ja expirou."""
+
+
+class SessionStore(ABC):
+    """Interface comum dos backends de sessao."""
+
+    @abstractmethod
+    async def create(self, history: Optional[List[Dict[str, str]]] = None) -> str:
+        """Cria uma sessao (opcionalmente com um historico inicial) e retorna o ID."""
+
+    @abstractmethod
+    async def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        """Retorna o historico da sessao. Levanta SessionNotFound se nao existir."""
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """Adiciona mensagens ao fim do historico. Levanta SessionNotFound se nao existir."""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        """Remove a sessao (nao faz nada se ela nao existir)."""
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Sessoes em um OrderedDict: a ordem e a de uso mais recente (LRU).
+    Quando passa de max_sessions, a sessao usada ha mais tempo e descartada;
+    sessoes paradas ha mais de ttl_seconds expiram.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl_seconds: int = SESSION_TTL_SECONDS, max_messages: int = SESSION_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        # session_id -> (ultimo uso, historico)
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _touch(self, session_id: str) -> List[Dict[str, str]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            raise SessionNotFound(session_id)
+        last_used, history = entry
+        if time.monotonic() - last_used > self.ttl_seconds:
+            del self._sessions[session_id]
+            raise SessionNotFound(session_id)
+        self._sessions[session_id] = (time.monotonic(), history)
+        self._sessions.move_to_end(session_id)
+        return history
+
+    def _evict(self):
+        # Remove do inicio (menos usadas) enquanto estiver acima do limite ou expirado
+        now = time.monotonic()
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - last_used > self.ttl_seconds:
+                del self._sessions[session_id]
+            else:
+                break
+
+    async def create(self, history: Optional[List[Dict[str, str]]] = None) -> str:
+        session_id = uuid.uuid4().hex
+        self._sessions[session_id] = (time.monotonic(), list(history or [])[-self.max_messages:])
+        self._evict()
+        return session_id
+
+    async def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        return list(self._touch(session_id))
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        history = self._touch(session_id)
+        history.extend(messages)
+        if len(history) > self.max_messages:
+            del history[:len(history) - self.max_messages]
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Sessoes em um arquivo SQLite. As consultas rodam em thread (asyncio.to_thread)
+    para nao bloquear o event loop; um lock serializa o acesso a conexao.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, max_sessions: int = SESSION_MAX_SESSIONS, ttl_seconds: int = SESSION_TTL_SECONDS, max_messages: int = SESSION_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at);
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+            """
+        )
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _touch(self, session_id: str):
+        row = self._conn.execute("SELECT updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            raise SessionNotFound(session_id)
+        if time.time() - row[0] > self.ttl_seconds:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            raise SessionNotFound(session_id)
+        self._conn.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (time.time(), session_id))
+
+    def _insert_messages(self, session_id: str, messages: List[Dict[str, str]]):
+        row = self._conn.execute("SELECT COALESCE(MAX(seq), -1) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        next_seq = row[0] + 1
+        self._conn.executemany(
+            "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+            [(session_id, next_seq + i, m["role"], m["content"]) for i, m in enumerate(messages)],
+        )
+        # Mantem so as ultimas max_messages mensagens da sessao
+        self._conn.execute(
+            "DELETE FROM messages WHERE session_id = ? AND seq <= ?",
+            (session_id, next_seq + len(messages) - 1 - self.max_messages),
+        )
+
+    def _create(self, history: List[Dict[str, str]]) -> str:
+        session_id = uuid.uuid4().hex
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.execute("INSERT INTO sessions (id, updated_at) VALUES (?, ?)", (session_id, time.time()))
+            if history:
+                self._insert_messages(session_id, history)
+            # Expira as sessoes paradas e descarta as menos usadas acima do limite
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return session_id
+
+    def _get_history(self, session_id: str) -> List[Dict[str, str]]:
+        self._touch(session_id)
+        rows = self._conn.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def _append(self, session_id: str, messages: List[Dict[str, str]]):
+        self._conn.execute("BEGIN")
+        try:
+            self._touch(session_id)
+            self._insert_messages(session_id, messages)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _delete(self, session_id: str):
+        self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def create(self, history: Optional[List[Dict[str, str]]] = None) -> str:
+        return await asyncio.to_thread(self._run, self._create, list(history or [])[-self.max_messages:])
+
+    async def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        return await asyncio.to_thread(self._run, self._get_history, session_id)
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        await asyncio.to_thread(self._run, self._append, session_id, messages)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._run, self._delete, session_id)
+
+
+_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    """Retorna o store configurado em SESSION_STORE (criado uma vez por processo)."""
+    global _store
+    if _store is None:
+        if SESSION_STORE == "sqlite":
+            _store = SqliteSessionStore()
+        elif SESSION_STORE == "memory":
+            _store = InMemorySessionStore()
+        else:
+            raise ValueError(f"SESSION_STORE invalido: {SESSION_STORE} (use 'memory' ou 'sqlite')")
+    return _store
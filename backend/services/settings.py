@@ -0,0 +1,125 @@
+"""
+Configuracao central da aplicacao.
+
+- O .env e lido uma unica vez (load_env), em vez de um load_dotenv() por modulo.
+- Credenciais, IDs e URLs das integracoes (OpenAI, Pipefy, Calendly) e as origens do
+  CORS ficam num objeto Settings validado pelo Pydantic, montado no primeiro uso
+  (get_settings) e reaproveitado pelo processo todo. Formato invalido (ex: URL sem
+  http://) falha ja nesse primeiro uso; a checagem que derruba o boot (OPENAI_API_KEY
+  ausente) roda no startup, pelo lifespan, e nao no import.
+- Ajustes finos (timeouts, limites, tamanhos de cache) continuam como constantes no
+  modulo de cada servico, lidas do ambiente ja carregado aqui.
+"""
+
+import os
+from functools import lru_cache
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+DEFAULT_CORS_ORIGINS = (
+    "http://localhost:5173,"  # A origem do frontend React/Vite
+    "http://127.0.0.1:5173,"  # As vezes o navegador usa esse
+    "https://ai-sdr-agent-api.vercel.app"
+)
+
+# Integracoes opcionais: sem elas a API sobe, mas o fluxo correspondente falha
+_INTEGRATION_FIELDS = {
+    "pipefy_api_key": "PIPEFY_API_KEY",
+    "pipe_id": "PIPE_ID",
+    "phase_id": "PHASE_ID",
+    "pipefy_field_name": "PIPEFY_FIELD_NAME",
+    "pipefy_field_email": "PIPEFY_FIELD_EMAIL",
+    "pipefy_field_company": "PIPEFY_FIELD_COMPANY",
+    "pipefy_field_need": "PIPEFY_FIELD_NEED",
+    "pipefy_field_interest": "PIPEFY_FIELD_INTEREST",
+    "calendly_api_key": "CALENDLY_API_KEY",
+}
+
+_env_loaded = False
+
+
+class SettingsError(ValueError):
+    """Configuracao ausente ou invalida."""
+
+
+def load_env():
+    """Carrega o .env no os.environ (so na primeira chamada; variaveis ja definidas ganham)."""
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+
+class Settings(BaseModel):
+    """Credenciais e enderecos das integracoes, lidos do ambiente."""
+
+    model_config = ConfigDict(frozen=True)
+
+    openai_api_key: Optional[str] = None
+    # Permite apontar para um servidor local (ex: benchmarks/stub_llm_server.py)
+    openai_base_url: Optional[str] = None
+    openai_model: str = "gpt-3.5-turbo"
+
+    pipefy_api_key: Optional[str] = None
+    pipe_id: Optional[str] = None
+    phase_id: Optional[str] = None
+    pipefy_field_name: Optional[str] = None
+    pipefy_field_email: Optional[str] = None
+    pipefy_field_company: Optional[str] = None
+    pipefy_field_need: Optional[str] = None
+    pipefy_field_interest: Optional[str] = None
+    pipefy_field_meeting_link: Optional[str] = None
+    pipefy_field_meeting_time: Optional[str] = None
+    pipefy_graphql_url: str = "https://api.pipefy.com/graphql"
+
+    calendly_api_key: Optional[str] = None
+    # Sobrescrevivel para apontar para um servidor local (ex: benchmarks/fake_upstreams.py)
+    calendly_api_url: str = "https://api.calendly.com"
+
+    cors_origins: List[str] = Field(default_factory=lambda: DEFAULT_CORS_ORIGINS.split(","))
+
+    @field_validator("openai_base_url", "pipefy_graphql_url", "calendly_api_url")
+    @classmethod
+    def _http_url(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and not value.startswith(("http://", "https://")):
+            raise ValueError("precisa comecar com http:// ou https://")
+        return value.rstrip("/") if value else value
+
+    @field_validator("cors_origins", mode="before")
+    @classmethod
+    def _split_origins(cls, value):
+        if isinstance(value, str):
+            return [origin.strip().rstrip("/") for origin in value.split(",") if origin.strip()]
+        return value
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        load_env()
+        # VAR= no .env vale como nao definida (cai no padrao do modelo)
+        values = {name: os.getenv(name.upper(), "").strip() for name in cls.model_fields}
+        values = {name: value for name, value in values.items() if value}
+        try:
+            return cls.model_validate(values)
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, err['loc'])).upper()}: {err['msg']}" for err in e.errors())
+            raise SettingsError(f"Configuracao invalida no .env: {problems}") from e
+
+    def require_openai(self):
+        """Garante que o app nao sobe sem a chave da OpenAI."""
+        if not self.openai_api_key:
+            raise SettingsError("OPENAI_API_KEY nao encontrada no arquivo .env")
+
+    def missing_integrations(self) -> List[str]:
+        """Variaveis das integracoes (Pipefy, Calendly) que nao foram definidas."""
+        return [env for field, env in _INTEGRATION_FIELDS.items() if not getattr(self, field)]
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Settings do processo, montado (e validado) no primeiro uso."""
+    return Settings.from_env()
+
+
+load_env()
@@ -0,0 +1,80 @@
+"""
+Cache chave/valor compartilhado entre processos, num arquivo SQLite em modo WAL.
+
+Com varios workers (serve.py) cada processo tem os proprios caches em memoria; este
+arquivo e a segunda camada que todos enxergam (ex: a resposta de abertura gerada por um
+worker serve para os outros). Em WAL as leituras nao bloqueiam as escritas, e as consultas
+rodam em thread (asyncio.to_thread) para nao prender o event loop.
+
+Desligado por padrao: defina SHARED_CACHE_PATH (o serve.py faz isso com mais de um worker).
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+# A cada quantas escritas as entradas vencidas sao apagadas
+SHARED_CACHE_PURGE_EVERY = int(os.getenv("SHARED_CACHE_PURGE_EVERY", "500"))
+
+
+class SharedCache:
+    """Tabela (namespace, chave) -> valor com expiracao, num arquivo SQLite."""
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _get(self, namespace: str, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, namespace: str, key: str, value: str, ttl_seconds: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl_seconds),
+        )
+        self._writes += 1
+        if self._writes % SHARED_CACHE_PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._run, self._get, namespace, key)
+
+    async def set(self, namespace: str, key: str, value: str, ttl_seconds: float):
+        await asyncio.to_thread(self._run, self._set, namespace, key, value, ttl_seconds)
+
+
+_shared_cache: Optional[SharedCache] = None
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """Cache compartilhado (aberto uma vez por processo, depois do fork) ou None se desligado."""
+    global _shared_cache
+    if _shared_cache is None and SHARED_CACHE_PATH:
+        _shared_cache = SharedCache()
+    return _shared_cache
@@ -0,0 +1,254 @@
+"""
+Deteccao do gatilho create_lead nas respostas da IA.
+
+Antes: json.loads em toda resposta, com a excecao fazendo papel de if, e qualquer JSON
+embrulhado em texto ou em bloco de codigo (```json) passava direto para o usuario.
+Agora, em tres etapas:
+1. checagem barata: sem "create_lead" no texto nao ha o que parsear (a grande maioria
+   das respostas e texto normal e sai aqui, sem json.loads);
+2. extrator tolerante: acha o objeto JSON dentro de bloco de codigo ou no meio do texto
+   (casando chaves, respeitando strings) e conserta chaves sem aspas, como o
+   `interest_confirmed: true` que o modelo copiava do prompt;
+3. validacao pelo modelo Pydantic do payload (TypeAdapter compilado uma vez).
+
+No stream, TriggerStreamGate decide token a token o que pode sair para o cliente e o que
+fica retido por poder ser o gatilho.
+
+Tambem define a tool `create_lead` para function calling: com OPENAI_LEAD_TOOL_CALLING=true
+o modelo devolve o lead como tool call estruturado, que e convertido para o mesmo JSON.
+"""
+
+import json
+import os
+import re
+from typing import Dict, Literal, Optional
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from services.metrics import Counter
+from services.observability import get_logger
+
+# --- Configuracao (pode ser ajustada pelo .env) ---
+OPENAI_LEAD_TOOL_CALLING = os.getenv("OPENAI_LEAD_TOOL_CALLING", "false").lower() == "true"
+
+TRIGGER_MARKER = "create_lead"
+
+TRIGGER_DETECTIONS = Counter(
+    "sdr_trigger_detection_total",
+    "Respostas da IA com o marcador create_lead: trigger (valido) ou invalid (nao validou)",
+    ["result"],
+)
+
+log = get_logger("trigger_detection")
+
+
+class LeadData(BaseModel):
+    """Dados do lead no gatilho create_lead."""
+
+    name: str = Field(min_length=1, description="Nome do cliente")
+    email: str = Field(min_length=3, description="E-mail do cliente")
+    company: str = Field("", description="Nome da empresa do cliente")
+    need: str = Field("", description="Necessidade ou desafio do cliente")
+    interest_confirmed: bool = Field(False, description="Se o cliente confirmou interesse na pergunta direta")
+
+
+class CreateLeadTrigger(BaseModel):
+    action: Literal["create_lead"]
+    data: LeadData
+
+
+# Validadores montados uma vez no import (o schema do pydantic-core fica compilado)
+_TRIGGER_ADAPTER = TypeAdapter(CreateLeadTrigger)
+_LEAD_ADAPTER = TypeAdapter(LeadData)
+
+# Tool para function calling: o schema vem do proprio modelo Pydantic
+CREATE_LEAD_TOOL = {
+    "type": "function",
+    "function": {
+        "name": TRIGGER_MARKER,
+        "description": (
+            "Registra o lead quando os 4 dados (nome, e-mail, empresa, necessidade) foram coletados "
+            "e o cliente respondeu a pergunta direta sobre seguir com uma conversa."
+        ),
+        "parameters": LeadData.model_json_schema(),
+    },
+}
+
+# Caracteres depois de um "{" no meio da linha em que o marcador ainda indica o gatilho
+# (cobre `{"action": "create_lead"` com espacos e quebras de linha)
+_MARKER_WINDOW = 48
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+# Chave sem aspas logo depois de { ou , (ex: `interest_confirmed: true`)
+_BARE_KEY_RE = re.compile(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)")
+
+
+def _balanced_object(text: str, start: int) -> Optional[str]:
+    """O objeto {...} que comeca em text[start], casando chaves fora de strings."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
+
+
+def _loads(candidate: str) -> Optional[dict]:
+    try:
+        value = json.loads(candidate)
+    except json.JSONDecodeError:
+        # Segunda chance: aspas nas chaves que vieram sem
+        try:
+            value = json.loads(_BARE_KEY_RE.sub(r'\1"\2"\3', candidate))
+        except json.JSONDecodeError:
+            return None
+    return value if isinstance(value, dict) else None
+
+
+def extract_json_object(text: str) -> Optional[dict]:
+    """
+    Primeiro objeto JSON com o marcador do gatilho: o texto inteiro, um bloco de codigo
+    ou um {...} no meio da prosa. None se nao houver.
+    """
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        parsed = _loads(stripped)
+        if parsed is not None:
+            return parsed
+
+    fence = _FENCE_RE.search(text)
+    if fence:
+        parsed = _loads(fence.group(1))
+        if parsed is not None:
+            return parsed
+
+    # JSON no meio do texto: tenta cada "{" antes do marcador
+    marker = text.find(TRIGGER_MARKER)
+    start = text.rfind("{", 0, marker)
+    while start != -1:
+        candidate = _balanced_object(text, start)
+        if candidate is not None and TRIGGER_MARKER in candidate:
+            parsed = _loads(candidate)
+            if parsed is not None:
+                return parsed
+        start = text.rfind("{", 0, start)
+    return None
+
+
+def detect_trigger(ai_response: str) -> Optional[Dict]:
+    """
+    Dados do lead (validados) se a resposta for o gatilho create_lead; None se for texto normal.
+    """
+    # 1. Checagem barata: texto normal nem chega ao parser (o total de respostas ja e
+    # contado pelo span trigger_detection)
+    if not ai_response or TRIGGER_MARKER not in ai_response:
+        return None
+
+    # 2. Extrator tolerante + 3. validacao
+    payload = extract_json_object(ai_response)
+    if payload is None:
+        TRIGGER_DETECTIONS.inc(result="invalid")
+        log.warning("Resposta menciona create_lead mas nao tem JSON valido", extra={"response": ai_response[:500]})
+        return None
+    try:
+        trigger = _TRIGGER_ADAPTER.validate_python(payload)
+    except ValidationError as e:
+        TRIGGER_DETECTIONS.inc(result="invalid")
+        log.warning("Gatilho create_lead fora do schema", extra={"errors": e.errors(include_url=False), "response": ai_response[:500]})
+        return None
+    TRIGGER_DETECTIONS.inc(result="trigger")
+    return trigger.data.model_dump()
+
+
+def tool_call_to_trigger(arguments: str) -> Optional[str]:
+    """
+    Converte os argumentos do tool call create_lead no mesmo JSON que o modelo escreveria
+    como texto, para o resto do fluxo (sessao, /chat, stream) nao precisar saber a diferenca.
+    """
+    try:
+        lead = _LEAD_ADAPTER.validate_json(arguments)
+    except ValidationError as e:
+        log.warning("Tool call create_lead fora do schema", extra={"errors": e.errors(include_url=False)})
+        return None
+    return json.dumps({"action": TRIGGER_MARKER, "data": lead.model_dump()}, ensure_ascii=False)
+
+
+class TriggerStreamGate:
+    """
+    Filtro do stream: o texto sai token a token e so passa a ser acumulado (buffering)
+    quando pode ser o gatilho:
+    - "{" ou "```" no inicio da resposta ou de uma linha (so espacos antes);
+    - "{" no meio da linha com o marcador create_lead logo em seguida (_MARKER_WINDOW).
+    Um "{" qualquer na prosa sai com no maximo _MARKER_WINDOW caracteres de atraso, e uma
+    crase de codigo inline nao segura nada.
+    """
+
+    def __init__(self):
+        self.buffering = False
+        self._held = ""
+        # O texto retido comeca no inicio de uma linha?
+        self._line_start = True
+
+    def _hold(self, text: str, start: int, line_start: bool) -> str:
+        self._held, self._line_start = text[start:], line_start
+        return text[:start]
+
+    def _start_buffering(self, text: str, start: int) -> str:
+        self.buffering = True
+        self._held = text[start:]
+        return text[:start]
+
+    def feed(self, token: str) -> str:
+        """Recebe o proximo pedaco e devolve o texto que ja pode ir para o cliente."""
+        if self.buffering:
+            self._held += token
+            return ""
+        text = self._held + token
+        line_start = self._line_start
+        line_begin = 0  # onde comeca a linha atual (os espacos iniciais ficam retidos com ela)
+        for index, char in enumerate(text):
+            if char == "\n":
+                line_start, line_begin = True, index + 1
+            elif line_start and char in " \t\r":
+                continue
+            elif line_start and char == "{":
+                return self._start_buffering(text, index)
+            elif line_start and char == "`":
+                if text.startswith("```", index):
+                    return self._start_buffering(text, index)
+                if "```".startswith(text[index:]):
+                    # "`" ou "``" no fim do pedaco: so o proximo diz se e um bloco de codigo
+                    return self._hold(text, line_begin, True)
+                line_start = False
+            elif char == "{":
+                window = text[index:index + _MARKER_WINDOW]
+                if TRIGGER_MARKER in window:
+                    return self._start_buffering(text, index)
+                if len(window) < _MARKER_WINDOW:
+                    return self._hold(text, index, False)
+            else:
+                line_start = False
+        if line_start:
+            # Linha so com espacos ate aqui: o proximo pedaco ainda pode abrir um JSON nela
+            return self._hold(text, line_begin, True)
+        return self._hold(text, len(text), False)
+
+    def flush(self) -> str:
+        """Texto ainda retido (no fim do stream: o JSON acumulado ou a prosa em espera)."""
+        held, self._held = self._held, ""
+        return held
@@ -0,0 +1,185 @@
+"""Admissao das chamadas a OpenAI: token buckets, concorrencia, fila, prazo e prioridade."""
+
+import asyncio
+
+import pytest
+
+from services import admission
+from services.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Relogio manual para os buckets (so nos testes sem event loop)."""
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture(autouse=True)
+def no_completion_estimate(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_COMPLETION_TOKENS_ESTIMATE", 0)
+
+
+def test_bucket_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(60)  # 1 por segundo
+    bucket.take(60)
+    assert bucket.time_until(1) == pytest.approx(1.0)
+    clock[0] += 30
+    assert bucket.time_until(30) == 0.0
+    assert bucket.time_until(31) == pytest.approx(1.0)
+    clock[0] += 3600
+    assert bucket.time_until(60) == 0.0
+    bucket.take(1)
+    assert bucket.tokens == pytest.approx(59.0)
+
+
+def test_bucket_caps_oversized_requests_at_capacity(clock):
+    bucket = TokenBucket(600)
+    assert bucket.time_until(10_000) == 0.0
+    bucket.take(10_000)
+    assert bucket.tokens == 0.0
+    assert bucket.time_until(10_000) == pytest.approx(60.0)
+
+
+def test_bucket_give_back_settles_real_usage(clock):
+    bucket = TokenBucket(1000)
+    bucket.take(500)
+    bucket.give_back(300)  # gastou 200 de 500 estimados
+    assert bucket.tokens == pytest.approx(800.0)
+    bucket.give_back(-900)  # gastou bem mais que o estimado
+    assert bucket.tokens == pytest.approx(-100.0)
+    bucket.give_back(10_000)
+    assert bucket.tokens == pytest.approx(1000.0)
+
+
+def test_disabled_bucket_never_waits(clock):
+    bucket = TokenBucket(0)
+    assert not bucket.enabled
+    bucket.take(1_000_000)
+    assert bucket.time_until(1_000_000) == 0.0
+
+
+def test_retry_after_header_rounds_up():
+    assert AdmissionRejected("deadline", 0.2).retry_after_header == "1"
+    assert AdmissionRejected("deadline", 2.1).retry_after_header == "3"
+
+
+def test_concurrency_limit_and_queue_full():
+    controller = AdmissionController(rpm=0, tpm=0, max_concurrency=1, queue_size=1, max_wait_seconds=5)
+
+    async def scenario():
+        release = asyncio.Event()
+        order = []
+
+        async def call(label):
+            async with controller.admit(1, 10):
+                order.append(label)
+                await release.wait()
+
+        first = asyncio.create_task(call("a"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(call("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit(1, 10):
+                pass
+        assert excinfo.value.reason == "queue_full"
+        assert order == ["a"] and controller.in_flight == 1
+        release.set()
+        await asyncio.gather(first, second)
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert controller.in_flight == 0
+
+
+def test_deadline_rejects_when_tokens_run_out():
+    controller = AdmissionController(rpm=0, tpm=600, max_concurrency=0, queue_size=10, max_wait_seconds=0.05)
+
+    async def scenario():
+        async with controller.admit(1, 600) as ticket:
+            ticket.settle(600)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit(1, 100):
+                pass
+        return excinfo.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == "deadline"
+    assert rejected.retry_after >= 1.0
+
+
+def test_settle_returns_unused_tokens():
+    controller = AdmissionController(rpm=0, tpm=600, max_concurrency=0, queue_size=10, max_wait_seconds=0.05)
+
+    async def scenario():
+        async with controller.admit(1, 600) as ticket:
+            ticket.settle(100)
+        # Sobrou o que nao foi usado: a proxima chamada entra sem esperar
+        async with controller.admit(1, 400):
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_higher_priority_is_admitted_first():
+    controller = AdmissionController(rpm=0, tpm=0, max_concurrency=1, queue_size=10, max_wait_seconds=5)
+
+    async def scenario():
+        release = asyncio.Event()
+        order = []
+
+        async def call(label, priority):
+            async with controller.admit(priority, 10):
+                order.append(label)
+                if label == "busy":
+                    await release.wait()
+
+        busy = asyncio.create_task(call("busy", 1))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(call("summary", admission.PRIORITY_BACKGROUND)),
+            asyncio.create_task(call("new", 1)),
+            asyncio.create_task(call("closing", 4)),
+            asyncio.create_task(call("new-2", 1)),
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(busy, *waiting)
+        return order
+
+    assert asyncio.run(scenario()) == ["busy", "closing", "new", "new-2", "summary"]
+
+
+def test_cancelled_waiter_does_not_hold_a_slot():
+    controller = AdmissionController(rpm=0, tpm=0, max_concurrency=1, queue_size=10, max_wait_seconds=5)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def call():
+            async with controller.admit(1, 10):
+                await release.wait()
+
+        busy = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        gave_up = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        gave_up.cancel()
+        release.set()
+        await busy
+        with pytest.raises(asyncio.CancelledError):
+            await gave_up
+        async with controller.admit(1, 10):
+            return controller.in_flight
+
+    assert asyncio.run(scenario()) == 1
+    assert controller.in_flight == 0
+
+
+def test_conversation_priority_grows_with_user_turns():
+    turns = [{"role": "user", "content": "oi"}, {"role": "assistant", "content": "ola"}] * 8
+    assert admission.conversation_priority([]) == 1
+    assert admission.conversation_priority(turns[:3]) == 2
+    assert admission.conversation_priority(turns) == admission.PRIORITY_MAX
@@ -0,0 +1,138 @@
+"""Livro de reservas: idempotencia por chave e exclusao por horario, inclusive entre processos."""
+
+import asyncio
+import time
+
+import pytest
+
+import main
+from services import booking
+from services.booking import BookingLedger, SlotTaken
+
+SLOT = 4_000_000_000.0  # bem no futuro: a limpeza de reservas antigas nao toca nele
+
+
+def _action(calls, label, delay=0.0):
+    async def run():
+        calls.append(label)
+        await asyncio.sleep(delay)
+        return {"booked_by": label}
+    return run
+
+
+def test_two_ledgers_same_key_book_once(tmp_path):
+    """Dois workers (dois ledgers no mesmo arquivo) com a mesma chave: um agenda, o outro repete."""
+    path = str(tmp_path / "bookings.db")
+    first, second = BookingLedger(path=path), BookingLedger(path=path)
+    calls = []
+
+    async def scenario():
+        return await asyncio.gather(
+            first.book_once("key", "fp", SLOT, _action(calls, "A", delay=0.3)),
+            second.book_once("key", "fp", SLOT, _action(calls, "B", delay=0.3)),
+        )
+
+    (response_a, replayed_a), (response_b, replayed_b) = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert response_a == response_b
+    assert sorted([replayed_a, replayed_b]) == [False, True]
+
+
+def test_two_ledgers_different_keys_same_slot(tmp_path):
+    path = str(tmp_path / "bookings.db")
+    first, second = BookingLedger(path=path), BookingLedger(path=path)
+    calls = []
+
+    async def scenario():
+        return await asyncio.gather(
+            first.book_once("key-a", "fp-a", SLOT, _action(calls, "A", delay=0.2)),
+            second.book_once("key-b", "fp-b", SLOT, _action(calls, "B", delay=0.2)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sum(isinstance(result, SlotTaken) for result in results) == 1
+
+
+def test_replay_from_another_ledger_uses_stored_response(tmp_path):
+    path = str(tmp_path / "bookings.db")
+    calls = []
+    response, replayed = asyncio.run(BookingLedger(path=path).book_once("key", "fp", SLOT, _action(calls, "A")))
+    assert not replayed
+    again, replayed = asyncio.run(BookingLedger(path=path).book_once("key", "fp", SLOT, _action(calls, "B")))
+    assert replayed and again == response
+    assert calls == ["A"]
+
+
+def test_mismatched_body_is_rejected(tmp_path):
+    ledger = BookingLedger(path=str(tmp_path / "bookings.db"))
+    asyncio.run(ledger.book_once("key", "fp", SLOT, _action([], "A")))
+    with pytest.raises(booking.IdempotencyMismatch):
+        asyncio.run(ledger.book_once("key", "other", SLOT, _action([], "B")))
+
+
+def test_failed_action_releases_the_slot(tmp_path):
+    ledger = BookingLedger(path=str(tmp_path / "bookings.db"))
+
+    async def failing():
+        raise RuntimeError("calendly fora")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(ledger.book_once("key-a", "fp", SLOT, failing))
+    response, replayed = asyncio.run(ledger.book_once("key-b", "fp", SLOT, _action([], "B")))
+    assert response == {"booked_by": "B"} and not replayed
+
+
+def test_expired_response_does_not_book_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(booking, "BOOKING_IDEMPOTENCY_TTL_SECONDS", 0.05)
+    ledger = BookingLedger(path=str(tmp_path / "bookings.db"))
+    calls = []
+    asyncio.run(ledger.book_once("key", "fp", SLOT, _action(calls, "A")))
+    time.sleep(0.1)
+    with pytest.raises(SlotTaken):
+        asyncio.run(ledger.book_once("key", "fp", SLOT, _action(calls, "B")))
+    assert calls == ["A"]
+
+
+def _schedule_request():
+    return main.ScheduleRequest(
+        slot_info={"start_time": "2096-10-01T14:00:00Z"},
+        lead_data={"name": "Ana", "email": "ana@acme.com"},
+        pipefy_card_id="123",
+    )
+
+
+@pytest.fixture
+def released(monkeypatch):
+    calls = []
+
+    async def release(slot_info):
+        calls.append(slot_info)
+
+    monkeypatch.setattr(main, "release_meeting_slot", release)
+    return calls
+
+
+def test_enqueue_failure_keeps_the_created_meeting(monkeypatch, released):
+    async def created(slot_info, lead_data):
+        return {"meeting_link": "https://calendly.com/x", "meeting_datetime": slot_info["start_time"]}
+
+    async def broken_queue(**kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(main, "create_meeting", created)
+    monkeypatch.setattr(main, "enqueue_meeting_update", broken_queue)
+    result = asyncio.run(main._book_meeting(_schedule_request()))
+    assert result["status"] == "success" and result["pipefy_update_job_id"] is None
+    assert released == []
+
+
+def test_create_meeting_failure_releases_the_slot(monkeypatch, released):
+    async def calendly_down(slot_info, lead_data):
+        raise RuntimeError("calendly fora")
+
+    monkeypatch.setattr(main, "create_meeting", calendly_down)
+    with pytest.raises(RuntimeError):
+        asyncio.run(main._book_meeting(_schedule_request()))
+    assert len(released) == 1
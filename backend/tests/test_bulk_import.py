@@ -0,0 +1,33 @@
+"""Checkpoint do bulk_import: marca d'agua, falhas e retomada."""
+
+from bulk_import import Checkpoint
+
+
+def test_failures_do_not_stall_watermark(tmp_path):
+    path = str(tmp_path / "leads.ckpt")
+    checkpoint = Checkpoint(path, "leads.csv")
+    for index in range(1000):
+        checkpoint.mark(index, failed=index % 100 == 0)
+    assert checkpoint.watermark == 1000
+    assert checkpoint.done == set()
+    assert checkpoint.failed == set(range(0, 1000, 100))
+    checkpoint.save()
+
+    resumed = Checkpoint(path, "leads.csv")
+    assert [index for index in range(1000) if not resumed.is_done(index)] == list(range(0, 1000, 100))
+
+    # Retentativa bem-sucedida sai da lista de falhas sem crescer o conjunto de concluidos
+    resumed.mark(0)
+    resumed.mark(100, failed=True)
+    assert resumed.is_done(0) and not resumed.is_done(100)
+    assert resumed.done == set() and 0 not in resumed.failed
+
+
+def test_out_of_order_window(tmp_path):
+    checkpoint = Checkpoint(None, "leads.csv")
+    checkpoint.mark(2)
+    checkpoint.mark(1, failed=True)
+    assert checkpoint.watermark == 0 and checkpoint.done == {1, 2}
+    checkpoint.mark(0)
+    assert checkpoint.watermark == 3 and checkpoint.done == set()
+    assert not checkpoint.is_done(1) and checkpoint.is_done(2)
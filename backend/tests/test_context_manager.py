@@ -0,0 +1,82 @@
+"""Orcamento do historico: nenhum turno sai do contexto sem estar no resumo."""
+
+import asyncio
+
+from services.context_manager import CONTEXT_TURNS_DROPPED, SUMMARY_MAX_TOKENS, ContextManager, count_message_tokens
+
+
+def _history(turns, words=60):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"mensagem {i} " + "palavra " * words}
+        for i in range(turns)
+    ]
+
+
+def _unsummarized(result, history):
+    """Mensagens do historico enviadas (sem o resumo); precisam ser um sufixo continuo dele."""
+    sent = [m for m in result.messages if not m["content"].startswith("Resumo da conversa")]
+    assert sent == history[len(history) - len(sent):]
+    return sent
+
+
+def _manager(summarizer, history, ratio=2.0, wait=1.0):
+    # Orcamento em que o historico passa do limite, mas cabe no orcamento folgado (ratio)
+    budget = SUMMARY_MAX_TOKENS + count_message_tokens(history) * 2 // 3
+    return ContextManager(summarizer, budget=budget, overflow_ratio=ratio, summary_wait=wait)
+
+
+def test_first_overflow_keeps_every_turn_while_summary_runs():
+    history = _history(12)
+    release = asyncio.Event()
+
+    async def slow_summarizer(previous, messages):
+        await release.wait()
+        return "resumo"
+
+    async def scenario():
+        manager = _manager(slow_summarizer, history)
+        first = await manager.prepare(history)
+        assert manager._pending, "o resumo deveria estar rodando em background"
+        release.set()
+        await manager.drain(1)
+        second = await manager.prepare(history)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.messages == history
+    assert second.messages[0]["content"] == "Resumo da conversa até aqui: resumo"
+    assert len(_unsummarized(second, history)) < len(history)
+
+
+def test_waits_for_summary_beyond_loose_budget():
+    history = _history(12)
+    folded = []
+
+    async def summarizer(previous, messages):
+        folded.append(len(messages))
+        await asyncio.sleep(0.01)
+        return "resumo"
+
+    async def scenario():
+        return await _manager(summarizer, history, ratio=1.0).prepare(history)
+
+    result = asyncio.run(scenario())
+    assert folded and result.messages[0]["content"].startswith("Resumo da conversa")
+    assert result.folded_messages == folded[0]
+    _unsummarized(result, history)
+
+
+def test_drops_turns_only_as_last_resort():
+    history = _history(12)
+    before = CONTEXT_TURNS_DROPPED.value()
+
+    async def broken_summarizer(previous, messages):
+        raise RuntimeError("LLM fora")
+
+    async def scenario():
+        return await _manager(broken_summarizer, history, ratio=1.0, wait=0.5).prepare(history)
+
+    result = asyncio.run(scenario())
+    dropped = CONTEXT_TURNS_DROPPED.value() - before
+    assert dropped > 0
+    assert len(_unsummarized(result, history)) == len(history) - dropped
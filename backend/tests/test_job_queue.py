@@ -0,0 +1,195 @@
+"""Fila de jobs: retry, dead letter, adiamento, revivida por chave e erros do SQLite."""
+
+import asyncio
+import sqlite3
+
+import httpx
+import pytest
+
+from services import crm_jobs, http_client, job_queue as job_queue_module, pipefy_service
+from services.job_queue import JobNotReady, JobQueue, PermanentJobError
+
+
+@pytest.fixture(autouse=True)
+def fast_queue(monkeypatch):
+    monkeypatch.setattr(job_queue_module, "JOB_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(job_queue_module, "JOB_NOT_READY_DELAY_SECONDS", 0.01)
+    monkeypatch.setattr(job_queue_module, "JOB_POLL_INTERVAL_SECONDS", 0.01)
+
+
+def _run(queue, scenario):
+    async def main():
+        await queue.start()
+        try:
+            return await scenario()
+        finally:
+            await queue.stop()
+    return asyncio.run(main())
+
+
+def _dead_letters(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT job_id, attempts FROM dead_letter").fetchall()
+
+
+def test_retry_until_success(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.db"), concurrency=2)
+    calls = []
+
+    async def flaky(payload):
+        calls.append(payload)
+        if len(calls) < 3:
+            raise RuntimeError("falha temporaria")
+        return {"ok": True}
+
+    queue.register_handler("flaky", flaky)
+
+    async def scenario():
+        job = await queue.enqueue("flaky", {"n": 1})
+        return await queue.wait_for(job["id"], 5)
+
+    job = _run(queue, scenario)
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 3
+    assert job["result"] == {"ok": True}
+
+
+def test_dead_letter_after_max_attempts(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path=path, concurrency=1)
+
+    async def broken(payload):
+        raise RuntimeError("sempre falha")
+
+    queue.register_handler("broken", broken)
+
+    async def scenario():
+        job = await queue.enqueue("broken", {}, max_attempts=2)
+        return await queue.wait_for(job["id"], 5)
+
+    job = _run(queue, scenario)
+    assert job["status"] == "dead"
+    assert job["last_error"] == "sempre falha"
+    assert _dead_letters(path) == [(job["id"], 2)]
+
+
+def test_permanent_error_skips_retries(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path=path, concurrency=1)
+
+    async def rejected(payload):
+        raise PermanentJobError("nao adianta repetir")
+
+    queue.register_handler("rejected", rejected)
+
+    async def scenario():
+        job = await queue.enqueue("rejected", {})
+        return await queue.wait_for(job["id"], 5)
+
+    job = _run(queue, scenario)
+    assert job["status"] == "dead"
+    assert _dead_letters(path) == [(job["id"], 1)]
+
+
+def test_not_ready_does_not_spend_attempts(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.db"), concurrency=1)
+    calls = []
+
+    async def waits(payload):
+        calls.append(payload)
+        if len(calls) <= 5:
+            raise JobNotReady("dependencia pendente")
+        return {}
+
+    queue.register_handler("waits", waits)
+
+    async def scenario():
+        job = await queue.enqueue("waits", {}, max_attempts=2)
+        return await queue.wait_for(job["id"], 5)
+
+    job = _run(queue, scenario)
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 1
+    assert len(calls) == 6
+
+
+def test_same_key_returns_job_and_revives_dead(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path=path, concurrency=1)
+    healthy = []
+
+    async def handler(payload):
+        if not healthy:
+            raise PermanentJobError("upstream fora")
+        return {"value": payload["value"]}
+
+    queue.register_handler("keyed", handler)
+
+    async def scenario():
+        first = await queue.enqueue("keyed", {"value": 1}, idempotency_key="k")
+        dead = await queue.wait_for(first["id"], 5)
+        healthy.append(True)
+        revived = await queue.enqueue("keyed", {"value": 2}, idempotency_key="k")
+        done = await queue.wait_for(revived["id"], 5)
+        again = await queue.enqueue("keyed", {"value": 3}, idempotency_key="k")
+        return first, dead, revived, done, again
+
+    first, dead, revived, done, again = _run(queue, scenario)
+    assert dead["status"] == "dead"
+    assert revived["id"] == first["id"] and revived["attempts"] == 0
+    assert done["status"] == "succeeded" and done["result"] == {"value": 2}
+    assert again["id"] == first["id"] and again["status"] == "succeeded"
+    assert _dead_letters(path) == []
+
+
+def test_worker_survives_claim_errors(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.db"), concurrency=1)
+    claim = queue._claim
+    failures = []
+
+    def flaky_claim():
+        if len(failures) < 2:
+            failures.append(True)
+            raise sqlite3.OperationalError("database is locked")
+        return claim()
+
+    queue._claim = flaky_claim
+
+    async def ok(payload):
+        return {"ok": True}
+
+    queue.register_handler("ok", ok)
+
+    async def scenario():
+        job = await queue.enqueue("ok", {})
+        return await queue.wait_for(job["id"], 5)
+
+    assert _run(queue, scenario)["status"] == "succeeded"
+    assert len(failures) == 2
+
+
+@pytest.mark.parametrize(
+    "respond, ambiguous",
+    [
+        (lambda request: httpx.Response(502), True),
+        (lambda request: httpx.Response(504), True),
+        (lambda request: httpx.Response(400), False),
+        (lambda request: httpx.Response(200, json={"errors": [{"message": "PIPE_ID invalido"}]}), False),
+    ],
+)
+def test_create_card_not_retried_when_outcome_is_unknown(monkeypatch, respond, ambiguous):
+    monkeypatch.setattr(http_client, "HTTP_MAX_RETRIES", 0)
+    monkeypatch.setattr(pipefy_service, "PIPEFY_PERSISTED_QUERIES", False)
+    monkeypatch.setitem(http_client._clients, "pipefy", httpx.AsyncClient(transport=httpx.MockTransport(respond)))
+    lead = {"name": "Ana", "email": "ana@acme.com", "company": "Acme", "need": "CRM", "interest_confirmed": True}
+
+    with pytest.raises(PermanentJobError if ambiguous else RuntimeError) as excinfo:
+        asyncio.run(crm_jobs._handle_create_card({"lead_data": lead}))
+    assert isinstance(excinfo.value, PermanentJobError) == ambiguous
+
+
+def test_read_timeout_is_ambiguous_but_connect_error_is_not():
+    request = httpx.Request("POST", "https://api.pipefy.com/graphql")
+    assert http_client.maybe_processed(httpx.ReadTimeout("timeout", request=request))
+    assert not http_client.maybe_processed(httpx.ConnectError("recusada", request=request))
+    assert not http_client.maybe_processed(httpx.HTTPStatusError("503", request=request, response=httpx.Response(503)))
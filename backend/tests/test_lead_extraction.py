@@ -0,0 +1,129 @@
+"""Extracao local dos dados do lead: padroes, falsos positivos e sobrescrita."""
+
+import json
+
+import pytest
+
+from services.lead_extraction import LeadExtractor, extract_fields, fast_path_reply
+
+
+def _fields(text, asked=None):
+    return {name: (value, source) for name, value, source in extract_fields(text, asked)}
+
+
+@pytest.mark.parametrize(
+    "text, field, value",
+    [
+        ("Meu nome é Ana Souza", "name", "Ana Souza"),
+        ("Me chamo Robert Emanuel", "name", "Robert Emanuel"),
+        ("Oi, sou o João da Silva", "name", "João da Silva"),
+        ("Sou Ana", "name", "Ana"),
+        ("trabalho na Acme Tecnologia", "company", "Acme Tecnologia"),
+        ("Trabalho pela Verzel", "company", "Verzel"),
+        ("minha empresa se chama Acme", "company", "Acme"),
+        ("sou da Acme Ltda", "company", "Acme Ltda"),
+        ("A empresa é a Acme", "company", "Acme"),
+        ("Trabalho na empresa X", "company", "X"),
+        ("sou do RH da Acme", "company", "Acme"),
+        ("trabalho na acme tecnologia", "company", "acme tecnologia"),
+        ("meu e-mail é ana@acme.com.br.", "email", "ana@acme.com.br"),
+        ("Precisamos de automatizar o atendimento no WhatsApp.", "need", "automatizar o atendimento no WhatsApp"),
+    ],
+)
+def test_extracts(text, field, value):
+    assert _fields(text)[field][0] == value
+
+
+@pytest.mark.parametrize(
+    "text, field",
+    [
+        ("Trabalho em casa", "company"),
+        ("Nossa empresa é pequena", "company"),
+        ("Nossa empresa é pequena, temos 10 pessoas", "company"),
+        ("Sou do Rio de Janeiro", "company"),
+        ("Trabalho em São Paulo", "company"),
+        ("Sou do Brasil", "company"),
+        ("sou do RH", "company"),
+        ("Sou Casado", "name"),
+        ("Sou Apaixonado por IA", "name"),
+        ("Sou brasileiro", "name"),
+        ("sou o gerente de vendas", "name"),
+        ("quero saber mais", "need"),
+    ],
+)
+def test_rejects(text, field):
+    assert field not in _fields(text)
+
+
+@pytest.mark.parametrize(
+    "text, field, source",
+    [
+        ("Meu nome é Ana", "name", "explicit"),
+        ("Sou a Ana", "name", "pattern"),
+        ("minha empresa se chama Acme", "company", "explicit"),
+        ("Empresa: Acme", "company", "explicit"),
+        ("sou da Acme", "company", "pattern"),
+        ("ana@acme.com", "email", "explicit"),
+    ],
+)
+def test_source_confidence(text, field, source):
+    assert _fields(text)[field][1] == source
+
+
+@pytest.mark.parametrize(
+    "asked, text, field, value",
+    [
+        ("Qual o seu nome?", "robert emanuel", "name", "Robert Emanuel"),
+        ("Qual o nome da sua empresa?", "na acme", "company", "acme"),
+        ("Qual o seu maior desafio hoje?", "integrar o CRM com o site", "need", "integrar o CRM com o site"),
+    ],
+)
+def test_answer_to_question(asked, text, field, value):
+    history = [{"role": "assistant", "content": asked}, {"role": "user", "content": text}]
+    assert LeadExtractor().update(None, history).values[field] == value
+
+
+def test_later_loose_match_does_not_overwrite():
+    history = [
+        {"role": "user", "content": "Meu nome é Ana Souza e trabalho na Acme Tecnologia"},
+        {"role": "assistant", "content": "Prazer, Ana!"},
+        {"role": "user", "content": "Sou a Bia do financeiro, trabalho pela Verzel também"},
+    ]
+    values = LeadExtractor().update(None, history).values
+    assert values["name"] == "Ana Souza"
+    assert values["company"] == "Acme Tecnologia"
+
+
+def test_explicit_match_corrects_value():
+    history = [
+        {"role": "user", "content": "Sou a Ana, meu e-mail é ana@acme.com"},
+        {"role": "assistant", "content": "Obrigado, Ana!"},
+        {"role": "user", "content": "Na verdade meu nome é Ana Paula e o e-mail é anapaula@acme.com"},
+    ]
+    values = LeadExtractor().update(None, history).values
+    assert values["name"] == "Ana Paula"
+    assert values["email"] == "anapaula@acme.com"
+
+
+def test_fast_path_creates_lead():
+    history = [
+        {
+            "role": "user",
+            "content": "Meu nome é Ana Souza, trabalho na Acme Tecnologia, ana@acme.com. "
+            "Precisamos de automatizar o atendimento.",
+        },
+    ]
+    extractor = LeadExtractor()
+    question = fast_path_reply(extractor.update("s1", history), history)
+    assert question and "especialista" in question
+
+    history += [{"role": "assistant", "content": question}, {"role": "user", "content": "Sim, claro"}]
+    payload = json.loads(fast_path_reply(extractor.update("s1", history), history))
+    assert payload["action"] == "create_lead"
+    assert payload["data"] == {
+        "name": "Ana Souza",
+        "email": "ana@acme.com",
+        "company": "Acme Tecnologia",
+        "need": "automatizar o atendimento",
+        "interest_confirmed": True,
+    }
@@ -0,0 +1,57 @@
+"""Formato de exposicao do /metrics: escapes e juncao dos snapshots dos workers."""
+
+import json
+import os
+
+from services import metrics
+from services.metrics import Counter, Histogram
+
+
+def _lines(name):
+    return [line for line in metrics.render_latest().splitlines() if line.startswith(name)]
+
+
+def test_label_values_and_help_are_escaped():
+    counter = Counter("test_escape_total", "linha 1\nlinha \\2", ["path"])
+    counter.inc(path='a"b\\c\nd')
+    text = metrics.render_latest()
+    assert "# HELP test_escape_total linha 1\\nlinha \\\\2" in text
+    assert 'test_escape_total{path="a\\"b\\\\c\\nd"} 1.0' in text
+
+
+def test_snapshots_of_all_workers_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    counter = Counter("test_workers_total", "Contador de teste", ["route"])
+    histogram = Histogram("test_workers_seconds", "Latencia de teste", buckets=(0.1, 1.0))
+    counter.inc(route="/chat")
+    histogram.observe(0.5)
+
+    # Outro worker: grava o proprio snapshot como se fosse outro pid
+    other = {
+        "test_workers_total": [[["/chat"], 3.0]],
+        "test_workers_seconds": [[[], [1.0, 0.0, 0.0, 0.05, 1.0]]],
+    }
+    (tmp_path / "worker-99999.json").write_text(json.dumps(other))
+    # O snapshot deste processo e ignorado em favor do estado ao vivo
+    metrics.write_snapshot()
+    counter.inc(route="/chat")
+
+    own = os.getpid()
+    assert _lines("test_workers_total{") == [
+        f'test_workers_total{{route="/chat",worker="{own}"}} 2.0',
+        'test_workers_total{route="/chat",worker="99999"} 3.0',
+    ]
+    assert f'test_workers_seconds_bucket{{worker="{own}",le="1.0"}} 1.0' in metrics.render_latest()
+    assert 'test_workers_seconds_count{worker="99999"} 1.0' in metrics.render_latest()
+
+    metrics.remove_snapshot(99999)
+    assert "99999" not in metrics.render_latest()
+    metrics.clear_snapshots()
+    assert not list(tmp_path.iterdir())
+
+
+def test_without_metrics_dir_only_this_process(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", "")
+    counter = Counter("test_single_total", "Contador de teste")
+    counter.inc()
+    assert _lines("test_single_total ") == ["test_single_total 1.0"]
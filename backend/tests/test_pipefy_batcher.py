@@ -0,0 +1,49 @@
+"""Batcher do Pipefy: um documento por contagem de tipos e resultado certo para cada chamador."""
+
+import asyncio
+import json
+
+import httpx
+
+from services import http_client, pipefy_service
+from services.pipefy_service import PipefyBatcher
+
+
+def _mock_pipefy(monkeypatch, queries):
+    def respond(request):
+        body = json.loads(request.content)
+        queries.append(body["query"])
+        data = {}
+        for alias, variables in body["variables"].items():
+            if "pipe_id" in variables:
+                data[alias] = {"card": {"id": variables["fields_attributes"][0]["field_value"]}}
+            else:
+                data[alias] = {"success": True, "clientMutationId": variables["nodeId"]}
+        return httpx.Response(200, json={"data": data})
+
+    monkeypatch.setattr(pipefy_service, "PIPEFY_PERSISTED_QUERIES", False)
+    monkeypatch.setitem(http_client._clients, "pipefy", httpx.AsyncClient(transport=httpx.MockTransport(respond)))
+
+
+def test_interleaved_kinds_share_one_document(monkeypatch):
+    queries = []
+    _mock_pipefy(monkeypatch, queries)
+    render_card = lambda name: pipefy_service._CARD_INPUT.render(name, "e", "c", "n", "true")
+    render_update = lambda card: pipefy_service._MEETING_INPUT.render(card, "link", "hora")
+
+    async def scenario(order):
+        batcher = PipefyBatcher(window_seconds=0.01, max_size=10)
+        calls = [
+            batcher.submit("createCard", render_card(label)) if kind == "c" else batcher.submit("updateFieldsValues", render_update(label))
+            for kind, label in order
+        ]
+        return await asyncio.gather(*calls)
+
+    first = asyncio.run(scenario([("c", "A"), ("u", "1"), ("c", "B"), ("u", "2")]))
+    second = asyncio.run(scenario([("u", "3"), ("u", "4"), ("c", "C"), ("c", "D")]))
+
+    assert queries[0] == queries[1]
+    assert [r["data"].get("createCard", {}).get("card", {}).get("id") for r in first] == ["A", None, "B", None]
+    assert [r["data"].get("updateFieldsValues", {}).get("clientMutationId") for r in first] == [None, "1", None, "2"]
+    assert [r["data"].get("updateFieldsValues", {}).get("clientMutationId") for r in second[:2]] == ["3", "4"]
+    assert [r["data"]["createCard"]["card"]["id"] for r in second[2:]] == ["C", "D"]
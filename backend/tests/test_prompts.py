@@ -0,0 +1,54 @@
+"""Prompts versionados e registro do usage informado pela OpenAI."""
+
+import asyncio
+import hashlib
+import json
+
+import httpx
+from openai import AsyncOpenAI
+
+from services import openai_service
+from services.prompts import PROMPT_TOKENS, get_template
+
+# sha256 do system prompt original (services/openai_service.py antes dos templates)
+BASELINE_V1_SHA256 = "efba1de335b8d25c98a8a03b42c1fcc70c01371af3674911fa3f596f27cb5507"
+
+
+def test_v1_is_the_original_prompt_byte_for_byte():
+    content = get_template("sdr_system", "v1").message["content"]
+    assert hashlib.sha256(content.encode()).hexdigest() == BASELINE_V1_SHA256
+
+
+def _sse(*chunks):
+    lines = [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"]
+    return "".join(lines).encode()
+
+
+def test_stream_records_provider_usage(monkeypatch):
+    requests = []
+
+    def respond(request):
+        requests.append(json.loads(request.content))
+        base = {"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "m"}
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_sse(
+            {**base, "choices": [{"index": 0, "delta": {"content": "Olá, "}, "finish_reason": None}]},
+            {**base, "choices": [{"index": 0, "delta": {"content": "tudo bem?"}, "finish_reason": "stop"}]},
+            {**base, "choices": [], "usage": {
+                "prompt_tokens": 1500, "completion_tokens": 5, "total_tokens": 1505,
+                "prompt_tokens_details": {"cached_tokens": 1280},
+            }},
+        ))
+
+    client = AsyncOpenAI(api_key="test", base_url="http://openai.test/v1", http_client=httpx.AsyncClient(transport=httpx.MockTransport(respond)))
+    monkeypatch.setattr(openai_service, "_client", client)
+    cached_before = PROMPT_TOKENS.value(kind="cached", source="provider")
+    uncached_before = PROMPT_TOKENS.value(kind="uncached", source="provider")
+
+    async def collect():
+        history = [{"role": "user", "content": "Quero entender como funciona a automação de atendimento de vocês"}]
+        return [part async for part in openai_service.generate_response_stream(history)]
+
+    assert "".join(asyncio.run(collect())) == "Olá, tudo bem?"
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    assert PROMPT_TOKENS.value(kind="cached", source="provider") - cached_before == 1280
+    assert PROMPT_TOKENS.value(kind="uncached", source="provider") - uncached_before == 220
@@ -0,0 +1,111 @@
+"""Stream do /chat: o que fica retido por poder ser o gatilho, erros e turno parcial salvo."""
+
+import asyncio
+import json
+
+import pytest
+
+import main
+from services.openai_service import StreamError
+from services.trigger_detection import TriggerStreamGate
+
+TRIGGER = '{"action": "create_lead", "data": {"name": "Ana", "email": "ana@acme.com"}}'
+
+
+def _run_gate(tokens):
+    gate = TriggerStreamGate()
+    emitted = "".join(gate.feed(token) for token in tokens)
+    return emitted, gate.buffering, gate.flush()
+
+
+@pytest.mark.parametrize("split", ["whole", "chars", "words"])
+@pytest.mark.parametrize(
+    "reply, emitted, buffering",
+    [
+        (
+            "Use {nome} no template e `pip install` no terminal, depois rode o comando de novo.",
+            "Use {nome} no template e `pip install` no terminal, depois rode o comando de novo.",
+            False,
+        ),
+        ("Temos planos {mensal, anual} para sua empresa, com suporte completo e treinamento.", None, False),
+        (TRIGGER, "", True),
+        ("  " + TRIGGER, "  ", True),
+        ("Perfeito!\n" + TRIGGER, "Perfeito!\n", True),
+        ("Perfeito! " + TRIGGER, "Perfeito! ", True),
+        ("Segue:\n```json\n" + TRIGGER + "\n```", "Segue:\n", True),
+        ("Linha um\n  recuada\n\nfim", "Linha um\n  recuada\n\nfim", False),
+    ],
+)
+def test_gate(split, reply, emitted, buffering):
+    if split == "whole":
+        tokens = [reply]
+    elif split == "chars":
+        tokens = list(reply)
+    else:
+        tokens = [part + " " for part in reply.split(" ")]
+        tokens[-1] = tokens[-1][:-1]
+    sent, is_buffering, held = _run_gate(tokens)
+    assert is_buffering == buffering
+    assert sent + held == reply
+    if emitted is not None:
+        assert sent == emitted
+    if not buffering and split == "whole":
+        assert held == ""
+
+
+class _Store:
+    def __init__(self):
+        self.appended = []
+
+    async def append(self, session_id, messages):
+        self.appended.append((session_id, messages))
+
+
+def _events(raw_events):
+    parsed = []
+    for raw in raw_events:
+        event, data = raw.strip().split("\n")
+        parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+def _fake_stream(tokens, fail=False):
+    async def generate(history=None, session_id=None):
+        for token in tokens:
+            yield token
+        if fail:
+            raise StreamError("conexao caiu")
+    return generate
+
+
+def test_error_event_instead_of_error_text(monkeypatch):
+    store = _Store()
+    monkeypatch.setattr(main, "generate_response_stream", _fake_stream(["Olá, ", "tudo"], fail=True))
+    monkeypatch.setattr(main, "get_session_store", lambda: store)
+
+    async def collect():
+        return [event async for event in main._chat_event_stream(session_id="s1")]
+
+    events = _events(asyncio.run(collect()))
+    assert events == [
+        ("token", {"text": "Olá, "}),
+        ("token", {"text": "tudo"}),
+        ("error", {"message": main.ERROR_REPLY}),
+    ]
+    assert store.appended == [("s1", [{"role": "assistant", "content": "Olá, tudo"}])]
+
+
+def test_partial_turn_saved_on_disconnect(monkeypatch):
+    store = _Store()
+    monkeypatch.setattr(main, "generate_response_stream", _fake_stream(["Primeira parte. ", "Segunda parte."]))
+    monkeypatch.setattr(main, "get_session_store", lambda: store)
+
+    async def disconnect_after_first_event():
+        events = main._chat_event_stream(session_id="s1")
+        first = await events.__anext__()
+        await events.aclose()
+        return first
+
+    first = asyncio.run(disconnect_after_first_event())
+    assert _events([first]) == [("token", {"text": "Primeira parte. "})]
+    assert store.appended == [("s1", [{"role": "assistant", "content": "Primeira parte. "}])]
@@ -13,6 +13,10 @@ function ChatWindow() {
     const [availableSlots, setAvailableSlots] = useState([]); // Guarda os horarios recebidos
     const [currentLeadData, setCurrentLeadData] = useState(null); // Guarda os dados do lead para agendamento
     const [currentPipefyCardId, setCurrentPipefyCardId] = useState(null); // Guarda o ID do card para agendamento
+    const [currentPipefyJobId, setCurrentPipefyJobId] = useState(null); // Ou o job que esta criando o card em background
+
+    // ID da sessao no backend: o historico fica no servidor e so mandamos a mensagem nova
+    const sessionIdRef = useRef(null);
 
     // Referencia para rolar a lista de mensagens para baixo
     const messagesEndRef = useRef(null);
@@ -23,6 +27,26 @@ function ChatWindow() {
     // Rola para baixo sempre que novas mensagens chegam
     useEffect(scrollToBottom, [messages]);
 
+    // Cria uma sessao no backend (opcionalmente com o historico ja exibido, para restaurar uma sessao expirada)
+    const createSession = async (seedHistory = []) => {
+      const response = await fetch(`${API_URL}/sessions`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ history: seedHistory }),
+      });
+      if (!response.ok) throw new Error(`Erro ao criar sessão: ${response.statusText}`);
+      const data = await response.json();
+      sessionIdRef.current = data.session_id;
+      return data.session_id;
+    };
+
+    // Envia so a mensagem nova para a sessao
+    const postSessionMessage = (sessionId, message) => fetch(`${API_URL}/sessions/${sessionId}/messages`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message }),
+    });
+
     // Funcao para quando o usuario envia uma mensagem
     const handleSendMessage = async () => {
 
@@ -38,18 +62,16 @@ function ChatWindow() {
       setAvailableSlots([]); // Limpa slots antigos ao enviar nova mensagem
 
       try {
-        // 2. Monta o histórico para enviar à API
-        // O backend espera [{"role": "user", "content": "..."}, ...]
-        const historyForAPI = updatedMessages.map(({ role, content }) => ({ role, content }));
-
-        // 3. Chama a API do backend
-        const response = await fetch(`${API_URL}/chat`, {
-          method: 'POST',
-          headers: {
-          'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ history: historyForAPI }),
-        });
+        // 2. Garante uma sessao no backend (o historico fica guardado la)
+        const sessionId = sessionIdRef.current || await createSession();
+
+        // 3. Chama a API do backend mandando so a mensagem nova
+        let response = await postSessionMessage(sessionId, userMessage);
+        if (response.status === 404) {
+          // Sessao expirou no servidor: recria com o historico que ja esta na tela e tenta de novo
+          const seedHistory = messages.map(({ role, content }) => ({ role, content }));
+          response = await postSessionMessage(await createSession(seedHistory), userMessage);
+        }
 
         if (!response.ok) throw new Error(`Erro da API: ${response.statusText}`);
         const data = await response.json(); // A resposta do backend vem em { response: "..." }
@@ -68,6 +90,7 @@ function ChatWindow() {
             setAvailableSlots(jsonResponse.slots || []);
             setCurrentLeadData(jsonResponse.lead_data || null);
             setCurrentPipefyCardId(jsonResponse.pipefy_card_id || null);
+            setCurrentPipefyJobId(jsonResponse.pipefy_job_id || null);
             messageToAdd = { role: 'assistant', content: introMessage }; // Adiciona so a intro
 
           } else if (jsonResponse.status === 'success') {
@@ -103,7 +126,7 @@ function ChatWindow() {
     
     //Funcao para agendamento
     const handleSchedule = async (slot) => {
-      if (!currentLeadData || !currentPipefyCardId || isLoading) return;
+      if (!currentLeadData || (!currentPipefyCardId && !currentPipefyJobId) || isLoading) return;
 
       console.log("Agendando horário:", slot);
       setIsLoading(true);
@@ -119,7 +142,8 @@ function ChatWindow() {
           body: JSON.stringify({
             slot_info: slot,
             lead_data: currentLeadData,
-            pipefy_card_id: currentPipefyCardId
+            pipefy_card_id: currentPipefyCardId,
+            pipefy_job_id: currentPipefyJobId
           }),
         });
 
@@ -141,6 +165,7 @@ function ChatWindow() {
         // Limpa os dados do lead atual para evitar reagendamento acidental
         setCurrentLeadData(null);
         setCurrentPipefyCardId(null);
+        setCurrentPipefyJobId(null);
       }
     };
 